@@ -1,31 +1,25 @@
-from utils import unwrap_tag, remove_tag, get_internal_links, remove_external_links
+from analysis import analyze, collect_internal_links, resolve_region, walk, PageAnalysis, PageStream, RegionCapture, Tee
+from links import link_index
+import hashlib
 
 def find_element_with_most_direct_text(url, soup):
-    soup = remove_external_links(url, soup)
-    soup = unwrap_tag(soup, "p")
-    soup = remove_tag(soup, "script")
-    soup = remove_tag(soup, "style")
-    max_text_length = 0
-    max_text_element = None
-
-    for element in soup.find_all(True):  # Find all tags
-        direct_text = element.find_all(string=True, recursive=False)  # Get only direct text, not child elements' text
-        combined_text = ''.join(direct_text).strip()
-        if len(combined_text) > max_text_length:
-            max_text_length = len(combined_text)
-            max_text_element = element
-
-    return [max_text_element.text , max_text_length]
+    # soup can be a body from any backend in parsers.py
+    # same result as removing external links, unwrapping p & removing script / style then
+    # checking the direct text of every tag, in one walk & without mutating soup
+    analysis = analyze(url, soup)
+    return [analysis.max_text(), analysis.max_text_len]
 
 
 def apply_extraction(url, soup):
     # NOTE: recommend to use the soup.body from calling the function as head often contain scripts that will mess this up
+    return choose_content(url, analyze(url, soup))
 
-    # since there are only 2 things now, it will be an if else
-
-    total_site_text_len = len(soup.text)
 
-    max_text, max_text_len = find_element_with_most_direct_text(url, soup)
+def choose_content(url, analysis):
+    # since there are only 2 things now, it will be an if else
+    # both modes come out of the same walk
+    total_site_text_len = analysis.total_text_len
+    max_text, max_text_len = analysis.max_text(), analysis.max_text_len
 
     result = []
 
@@ -33,8 +27,9 @@ def apply_extraction(url, soup):
     if max_text_len >= total_site_text_len * 0.3:
         result = [max_text, max_text_len]
     else:
-        all_internal_links, all_internal_links_len = get_internal_links(url, soup)
-        result = [all_internal_links, all_internal_links_len]
+        # sorted unique canonical links, the site's link index
+        all_internal_links = link_index(analysis.internal_links(), url)
+        result = [all_internal_links, len(all_internal_links)]
     # [test-able-content, content-length]
     return result
 
@@ -50,13 +45,88 @@ def comparer(previous, now):
         raise NotImplementedError(f"Comparer for {type(previous)} class is not implemented")
     
 
-def quick_extract(content) -> callable:
-    # get extraction function based on content type
+def content_kind(content) -> str:
+    # name of the content type, stored next to the fingerprint
+    if isinstance(content, list):
+        return "links"
+
+    elif isinstance(content, str):
+        return "text"
+
+    else:
+        raise NotImplementedError(f"content_kind for {type(content)} class is not implemented")
+
+
+def fingerprint(content) -> str:
+    # stable hash of the content, equal fingerprints <=> comparer says same (modulo whitespace in text)
     if isinstance(content, list):
-        return get_internal_links
+        # order independent, same as comparing sets
+        normalized = "\n".join(sorted(set(content)))
 
     elif isinstance(content, str):
+        normalized = " ".join(content.split())
+
+    else:
+        raise NotImplementedError(f"fingerprint for {type(content)} class is not implemented")
+
+    return hashlib.sha256(normalized.encode()).hexdigest()
+
+
+def extract_by_kind(kind) -> callable:
+    # get extraction function based on the stored content kind
+    if kind == "links":
+        return collect_internal_links
+
+    elif kind == "text":
         return find_element_with_most_direct_text
 
     else:
-        raise NotImplementedError(f"quick_extract for {type(content)} class is not implemented")
\ No newline at end of file
+        raise NotImplementedError(f"extract_by_kind for {kind} is not implemented")
+
+
+class Extraction:
+    """
+    extraction_fn for scan_site / load_site that pins the element text sites are read from.
+    kind None (new site) : apply_extraction, remembering where the text is if the site is text based
+    kind "text" : only the pinned region, full search & pinned again when it no longer resolves
+    kind "links" : collect_internal_links
+    After a call, region is where the text was found & repinned tells if it differs from the given one.
+    """
+    def __init__(self, kind=None, region=None):
+        self.kind = kind
+        self.region = region
+        self.repinned = False
+
+    def __call__(self, url, soup):
+        if self.kind == "links":
+            return collect_internal_links(url, soup)
+
+        analysis = None
+        if self.region is not None and isinstance(soup, PageStream):
+            # read once, so the full search runs in the same pass in case the region is gone
+            capture, analysis = walk(soup, Tee(RegionCapture(url, self.region), PageAnalysis(url, locate=True))).handlers
+            if capture.text is not None:
+                return capture.text
+
+        elif self.region is not None:
+            element = resolve_region(soup, self.region)
+            if element is not None:
+                # direct lookup, only the subtree is walked
+                return analyze(url, element).root_text()
+
+        if analysis is None:
+            analysis = analyze(url, soup, locate=True)
+        if self.kind == "text":
+            result = [analysis.max_text(), analysis.max_text_len]
+        else:
+            result = choose_content(url, analysis)
+
+        region = analysis.region() if isinstance(result[0], str) else None
+        self.repinned = self.repinned or region != self.region
+        self.region = region
+        return result
+
+
+def quick_extract(content) -> callable:
+    # get extraction function based on content type
+    return extract_by_kind(content_kind(content))
@@ -0,0 +1,530 @@
+from bs4 import Tag, NavigableString, CData
+from bs4.builder import HTMLParserTreeBuilder
+from bs4.builder._htmlparser import BeautifulSoupHTMLParser
+from collections import Counter
+from types import SimpleNamespace
+import hashlib
+import inspect
+import math
+import re
+
+from links import is_external_link, link_index
+
+# same view of the page as remove_external_links + unwrap_tag(p) + remove_tag(script / style),
+# but gathered in one walk without mutating the tree
+
+SKIPPED_TAGS = ("script", "style") # removed with everything inside
+TRANSPARENT_TAGS = ("p",) # unwrapped, their text counts as direct text of the parent
+VISIBLE_STRINGS = (NavigableString, CData) # strings that tag.text keeps
+HIDDEN_TEXT_PARENTS = ("script", "style") # their strings are not part of tag.text
+PRESERVE_WHITESPACE_TAGS = ("pre", "textarea")
+ASCII_SPACES = " \n\t\x0c\r"
+
+# kinds of open elements
+ROOT, ELEMENT, TRANSPARENT, DROPPED = range(4)
+
+
+class PageAnalysis:
+    """
+    Collects what apply_extraction needs from start / data / end events in document order:
+    the element with most direct text (& its text), total text length and internal links.
+    With locate, also where that element is in the tree (see locator).
+    """
+    def __init__(self, base_url, locate=False):
+        self.base_url = base_url
+        self.total_text_len = 0 # len(soup.text) before anything is removed
+        self.texts = [] # kept visible strings, spans of it form the text of an element
+        self.href_links = []
+        self.src_links = []
+
+        self.max_text_len = 0
+        self.max_text_order = -1
+        self.max_text_span = None
+        self.order = 0
+
+        # open elements : [kind, direct strings, start in texts, document order]
+        self.stack = [[ROOT, [], 0, -1]]
+
+        # with locate, every open element of the real tree as [tag, nth of type, signature]
+        # & the tag counts of the children of each, to build a locator of the winner
+        self.path = [] if locate else None
+        self.child_tags = [{}]
+        self.max_text_path = None
+        self.max_text_children = None
+
+    def is_external(self, attrs) -> bool:
+        for attr in ["href", "src"]:
+            link = attrs.get(attr)
+            if link is not None and is_external_link(link, self.base_url):
+                return True
+        return False
+
+    def start(self, tag, attrs):
+        if self.path is not None:
+            siblings = self.child_tags[-1]
+            siblings[tag] = siblings.get(tag, 0) + 1
+            self.path.append([tag, siblings[tag], signature(tag, attrs)])
+            self.child_tags.append({})
+
+        parent = self.stack[-1]
+
+        if parent[0] == DROPPED or tag in SKIPPED_TAGS or self.is_external(attrs):
+            self.stack.append([DROPPED, None, 0, -1])
+
+        elif tag in TRANSPARENT_TAGS:
+            # direct strings go to the closest element that is kept
+            self.stack.append([TRANSPARENT, parent[1], 0, -1])
+
+        else:
+            self.stack.append([ELEMENT, [], len(self.texts), self.order])
+            self.order += 1
+
+            # external ones were dropped above, so whatever is left is internal
+            href, src = attrs.get("href"), attrs.get("src")
+            if href is not None:
+                self.href_links.append(href)
+            if src is not None:
+                self.src_links.append(src)
+
+    def data(self, text, visible=True):
+        if visible:
+            self.total_text_len += len(text)
+
+        frame = self.stack[-1]
+        if frame[0] == DROPPED:
+            return
+
+        if frame[1] is not None:
+            frame[1].append(text)
+        if visible:
+            self.texts.append(text)
+
+    def end(self):
+        kind, direct_text, text_start, order = self.stack.pop()
+        if kind == ELEMENT:
+            direct_text_len = len(''.join(direct_text).strip())
+            # ties go to the element first in document order, like find_all(True) did
+            if direct_text_len > self.max_text_len or (direct_text_len == self.max_text_len and direct_text_len > 0 and order < self.max_text_order):
+                self.max_text_len = direct_text_len
+                self.max_text_order = order
+                self.max_text_span = (text_start, len(self.texts))
+                if self.path is not None:
+                    self.max_text_path = [step[:] for step in self.path]
+                    self.max_text_children = sorted(self.child_tags[-1])
+
+        if self.path is not None:
+            self.path.pop()
+            self.child_tags.pop()
+
+    def max_text(self) -> str:
+        if self.max_text_span is None:
+            raise ValueError("No element with direct text found")
+        start, end = self.max_text_span
+        return ''.join(self.texts[start:end])
+
+    def internal_links(self) -> list:
+        # all href first then all src, same order as get_internal_links
+        return self.href_links + self.src_links
+
+    def root_text(self) -> list[str, int]:
+        # [text, direct text length] of the walked root itself, as max_text / max_text_len would give for it
+        return [''.join(self.texts), len(''.join(self.stack[0][1]).strip())]
+
+    def region(self) -> dict:
+        """Where the element with most direct text is, None if there is none or locate was off."""
+        if self.max_text_path is None:
+            return None
+        return {
+            "locator" : " > ".join(["body"] + [f"{tag}:nth-of-type({nth})" for tag, nth, _ in self.max_text_path]),
+            "fingerprint" : structure_fingerprint([sig for _, _, sig in self.max_text_path], self.max_text_children),
+        }
+
+
+def signature(tag, attrs) -> str:
+    # tag#id.classes, what the structure fingerprint is made of
+    classes = attrs.get("class") or ""
+    if isinstance(classes, str):
+        classes = classes.split()
+    element_id = attrs.get("id")
+    return tag + (f"#{element_id}" if element_id else "") + "".join(f".{c}" for c in sorted(classes))
+
+
+def structure_fingerprint(signatures : list, child_tags : list) -> str:
+    # changes when the element or one of its ancestors is swapped for another (layout change),
+    # not when the content inside changes, child_tags are the sorted unique tags of the element's children
+    return hashlib.sha256((" > ".join(signatures) + " / " + " ".join(child_tags)).encode()).hexdigest()
+
+
+LOCATOR_STEP = re.compile(r"(.+):nth-of-type\((\d+)\)")
+
+
+def element_children(node):
+    if isinstance(node, Tag):
+        return (child for child in node.children if isinstance(child, Tag))
+    return node.iter() # lexbor, elements only
+
+
+def element_tag(node) -> str:
+    if isinstance(node, Tag):
+        return node.name
+    return node.tag
+
+
+def element_attrs(node) -> dict:
+    if isinstance(node, Tag):
+        return node.attrs
+    return node.attributes
+
+
+def resolve_region(root, region : dict):
+    """The element region points to under root (a body), None if it's gone or its structure changed."""
+    steps = region["locator"].split(" > ")[1:] # [0] is body, the root
+    node, signatures = root, []
+    for step in steps:
+        match = LOCATOR_STEP.fullmatch(step)
+        if match is None:
+            return None
+        tag, nth = match.group(1), int(match.group(2))
+        for child in element_children(node):
+            if element_tag(child) == tag:
+                nth -= 1
+                if nth == 0:
+                    node = child
+                    break
+        else:
+            return None
+        signatures.append(signature(tag, element_attrs(node)))
+
+    child_tags = sorted({element_tag(child) for child in element_children(node)})
+    if structure_fingerprint(signatures, child_tags) != region["fingerprint"]:
+        return None
+    return node
+
+
+class LinkCollection:
+    # same as utils.get_internal_links, nothing removed beforehand
+    def __init__(self, base_url):
+        self.base_url = base_url
+        self.href_links = []
+        self.src_links = []
+
+    def start(self, tag, attrs):
+        href, src = attrs.get("href"), attrs.get("src")
+        if href is not None and not is_external_link(href, self.base_url):
+            self.href_links.append(href)
+        if src is not None and not is_external_link(src, self.base_url):
+            self.src_links.append(src)
+
+    def data(self, text, visible=True):
+        pass
+
+    def end(self):
+        pass
+
+    def internal_links(self) -> list:
+        return self.href_links + self.src_links
+
+
+def walk_soup(root : Tag, handler):
+    # feed the descendants of root (not root itself) to handler, iterative to survive deep pages
+    stack = [iter(root.contents)]
+    while stack:
+        for node in stack[-1]:
+            if isinstance(node, Tag):
+                handler.start(node.name, node.attrs)
+                stack.append(iter(node.contents))
+                break
+            handler.data(node, type(node) in VISIBLE_STRINGS)
+        else:
+            stack.pop()
+            if stack:
+                handler.end()
+    return handler
+
+
+def walk_lexbor(root, handler):
+    # same as walk_soup for a selectolax (lexbor) node
+    stack = [(root.tag, root.iter(include_text=True))]
+    preserve_whitespace = int(root.tag in PRESERVE_WHITESPACE_TAGS) # open pre / textarea
+    while stack:
+        parent_tag, children = stack[-1]
+        for node in children:
+            if node.is_element_node:
+                # valueless attributes are None in lexbor & "" in bs4
+                attrs = {key : ("" if value is None else value) for key, value in node.attributes.items()}
+                handler.start(node.tag, attrs)
+                stack.append((node.tag, node.iter(include_text=True)))
+                preserve_whitespace += node.tag in PRESERVE_WHITESPACE_TAGS
+                break
+            elif node.is_text_node:
+                text = node.text_content
+                if not preserve_whitespace and not text.strip(ASCII_SPACES):
+                    # bs4 collapses whitespace only strings
+                    text = "\n" if "\n" in text else " "
+                handler.data(text, parent_tag not in HIDDEN_TEXT_PARENTS)
+            elif node.is_comment_node:
+                # comment_content is stripped, bs4 keeps the whitespace of <!-- c -->
+                handler.data(node.html[4:-3], False)
+        else:
+            stack.pop()
+            preserve_whitespace -= parent_tag in PRESERVE_WHITESPACE_TAGS
+            if stack:
+                handler.end()
+    return handler
+
+
+class MemoryCapExceeded(Exception):
+    pass
+
+
+# bs4 4.13 takes the soup in the parser's constructor, before it was set after (as HTMLParserTreeBuilder.feed did)
+SOUP_IN_PARSER_INIT = "soup" in inspect.signature(BeautifulSoupHTMLParser.__init__).parameters
+
+
+def html_parser(sink):
+    if SOUP_IN_PARSER_INIT:
+        return BeautifulSoupHTMLParser(sink, convert_charrefs=False)
+    parser = BeautifulSoupHTMLParser(convert_charrefs=False)
+    parser.soup = sink
+    return parser
+
+
+# what handle_starttag gives back, html.parser's builder only looks at is_empty_element
+EMPTY_ELEMENT, ELEMENT_WITH_CONTENT = SimpleNamespace(is_empty_element=True), SimpleNamespace(is_empty_element=False)
+
+
+class StreamSink:
+    """
+    Stands in for the BeautifulSoup object html.parser's tree builder feeds, without building the tree :
+    same open tags, whitespace collapsing & string classes as bs4, the events under the first body
+    go to handler as walk_soup would give them. Also gathers soup.title.text.
+    """
+    def __init__(self, handler, builder):
+        self.handler = handler
+        self.builder = builder
+        self.contains_replacement_characters = False # set by the parser, unused
+        self.original_encoding = None # a str page, bs4 < 4.13 reads it for &#128; - &#255;
+        self.current_data = []
+        self.tags = ["[document]"] # open tags, the depth of a tag is its index
+        self.open_tags = Counter()
+        self.preserve_whitespace = [] # depths of the open pre / textarea
+        self.string_containers = [] # depths of the open script / style / template ...
+        self.body_depth = None # None before the first body, inf once it's closed
+        self.title = None
+        self.title_depth = None
+        self.kept = 0 # chars of visible text & links given to handler
+
+    def handle_starttag(self, name, namespace, nsprefix, attrs, sourceline=None, sourcepos=None, namespaces=None):
+        self.endData()
+        depth = len(self.tags)
+        self.tags.append(name)
+        self.open_tags[name] += 1
+        if name in self.builder.preserve_whitespace_tags:
+            self.preserve_whitespace.append(depth)
+        if name in self.builder.string_containers:
+            self.string_containers.append(depth)
+
+        if self.body_depth is not None and depth > self.body_depth:
+            self.handler.start(name, attrs)
+            self.kept += len(attrs.get("href") or "") + len(attrs.get("src") or "")
+        elif name == "body" and self.body_depth is None:
+            self.body_depth = depth
+        if name == "title" and self.title is None:
+            self.title, self.title_depth = "", depth
+        return EMPTY_ELEMENT if self.builder.can_be_empty_element(name) else ELEMENT_WITH_CONTENT
+
+    def handle_endtag(self, name, nsprefix=None):
+        self.endData()
+        # closes every tag opened after the last name, nothing if name isn't open
+        if not self.open_tags[name]:
+            return
+        while len(self.tags) > 1:
+            if self.popTag() == name:
+                break
+
+    def handle_data(self, data):
+        self.current_data.append(data)
+
+    def endData(self, containerClass=None):
+        if not self.current_data:
+            return
+        text = "".join(self.current_data)
+        self.current_data = []
+        if not self.preserve_whitespace and not text.strip(ASCII_SPACES):
+            text = "\n" if "\n" in text else " "
+
+        string_class = containerClass or NavigableString
+        if string_class is NavigableString and self.string_containers:
+            string_class = self.builder.string_containers.get(self.tags[self.string_containers[-1]], string_class)
+        visible = string_class in VISIBLE_STRINGS
+
+        if self.title_depth is not None and visible:
+            self.title += text
+        if self.body_depth is not None and len(self.tags) > self.body_depth:
+            self.handler.data(text, visible)
+            if visible:
+                self.kept += len(text)
+
+    def popTag(self) -> str:
+        name = self.tags.pop()
+        depth = len(self.tags)
+        self.open_tags[name] -= 1
+        if self.preserve_whitespace and self.preserve_whitespace[-1] == depth:
+            self.preserve_whitespace.pop()
+        if self.string_containers and self.string_containers[-1] == depth:
+            self.string_containers.pop()
+
+        if self.body_depth is not None:
+            if depth > self.body_depth:
+                self.handler.end()
+            elif depth == self.body_depth:
+                self.body_depth = math.inf
+        if depth == self.title_depth:
+            self.title_depth = None
+        return name
+
+    def close(self):
+        self.endData()
+        while len(self.tags) > 1:
+            self.popTag()
+
+
+class ClosedTags(Counter):
+    # bs4 lists the void elements it closed itself to skip their end tag if one comes, the list only
+    # grows & is searched on every end tag (quadratic on big pages), same membership as a multiset here
+    def append(self, tag):
+        self[tag] += 1
+
+    def remove(self, tag):
+        self[tag] -= 1
+        if not self[tag]:
+            del self[tag]
+
+
+class PageStream:
+    """
+    A page given as str chunks & parsed as they come, for pages too big to hold whole with their tree.
+    Walking it gives handler the events walk_soup gives for BeautifulSoup(page, "html.parser").body,
+    MemoryCapExceeded once more than memory_cap chars of text & links went to handler.
+    The chunks are read once, so it can only be walked once. title is soup.title.text after the walk.
+    """
+    def __init__(self, chunks, memory_cap=None):
+        self.chunks = chunks
+        self.memory_cap = memory_cap
+        self.title = None
+        self.has_body = False
+        self.size = 0 # chars read
+
+    def walk(self, handler):
+        if self.chunks is None:
+            raise RuntimeError("PageStream was already walked")
+        chunks, self.chunks = self.chunks, None
+
+        sink = StreamSink(handler, HTMLParserTreeBuilder(store_line_numbers=False))
+        parser = html_parser(sink)
+        parser.already_closed_empty_element = ClosedTags()
+        for chunk in chunks:
+            self.size += len(chunk)
+            parser.feed(chunk)
+            # checked per chunk, the overshoot is at most one chunk
+            if self.memory_cap is not None and sink.kept > self.memory_cap:
+                raise MemoryCapExceeded(f"More than {self.memory_cap} chars of text & links")
+        parser.close()
+        sink.close()
+
+        self.title = sink.title
+        self.has_body = sink.body_depth is not None
+        return handler
+
+
+class RegionCapture:
+    """
+    resolve_region & analyze of the element found, in one forward pass (for a PageStream).
+    text is its root_text, None if the region is gone or its structure changed.
+    """
+    def __init__(self, base_url, region : dict):
+        self.base_url = base_url
+        self.region = region
+        self.steps = []
+        for step in region["locator"].split(" > ")[1:]: # [0] is body, the root
+            match = LOCATOR_STEP.fullmatch(step)
+            if match is None:
+                self.steps = None
+                break
+            self.steps.append((match.group(1), int(match.group(2))))
+        self.depth = 0 # open elements under the root
+        self.matched = 0 # leading steps matched by the open elements
+        self.signatures = []
+        self.child_tags = [{}] # tag counts of the children of each open element
+        self.analysis = None # of the element, while inside it
+        self.text = None
+
+    def start(self, tag, attrs):
+        siblings = self.child_tags[-1]
+        siblings[tag] = siblings.get(tag, 0) + 1
+        self.child_tags.append({})
+        self.depth += 1
+
+        if self.analysis is not None:
+            self.analysis.start(tag, attrs)
+        elif self.steps and self.matched == self.depth - 1 < len(self.steps) and self.steps[self.matched] == (tag, siblings[tag]):
+            self.matched += 1
+            self.signatures.append(signature(tag, attrs))
+            if self.matched == len(self.steps):
+                self.analysis = PageAnalysis(self.base_url)
+
+    def data(self, text, visible=True):
+        if self.analysis is not None:
+            self.analysis.data(text, visible)
+
+    def end(self):
+        child_tags = self.child_tags.pop()
+        if self.analysis is not None and self.depth > self.matched:
+            self.analysis.end()
+        elif self.matched == self.depth > 0:
+            if self.analysis is not None:
+                if structure_fingerprint(self.signatures, sorted(child_tags)) == self.region["fingerprint"]:
+                    self.text = self.analysis.root_text()
+                # the only element with that locator, done
+                self.analysis, self.steps, self.matched = None, None, -1
+            else:
+                self.matched -= 1
+                self.signatures.pop()
+        self.depth -= 1
+
+
+class Tee:
+    # the same events to several handlers, one pass for all
+    def __init__(self, *handlers):
+        self.handlers = handlers
+
+    def start(self, tag, attrs):
+        for handler in self.handlers:
+            handler.start(tag, attrs)
+
+    def data(self, text, visible=True):
+        for handler in self.handlers:
+            handler.data(text, visible)
+
+    def end(self):
+        for handler in self.handlers:
+            handler.end()
+
+
+def walk(root, handler):
+    # pick the walker for the parser backend root comes from (see parsers.py)
+    if isinstance(root, Tag):
+        return walk_soup(root, handler)
+    if isinstance(root, PageStream):
+        return root.walk(handler)
+    return walk_lexbor(root, handler)
+
+
+def analyze(url, root, locate=False) -> PageAnalysis:
+    return walk(root, PageAnalysis(url, locate))
+
+
+def collect_internal_links(url, root) -> list[list, int]:
+    # as the site's link index, sorted unique canonical links
+    links = link_index(walk(root, LinkCollection(url)).internal_links(), url)
+    return [links, len(links)]
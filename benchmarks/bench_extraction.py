@@ -0,0 +1,183 @@
+import argparse
+import hashlib
+import json
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+
+# offline benchmark of the extraction pipeline over the saved pages in benchmarks/corpus
+# python benchmarks/bench_extraction.py              -> compare with benchmarks/baseline.json
+# python benchmarks/bench_extraction.py --save       -> overwrite the baseline for this parser
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+from algorithm import apply_extraction, find_element_with_most_direct_text, comparer, Extraction
+from utils import get_internal_links, remove_external_links
+from analysis import collect_internal_links, PageStream
+from parsers import parse_page, default_parser
+
+CORPUS_DIR = os.path.join(BENCH_DIR, "corpus")
+BASELINE_PATH = os.path.join(BENCH_DIR, "baseline.json")
+# differences below these are timer / allocator noise, not regressions
+MIN_TIME_DELTA_S = 0.0005
+MIN_MEMORY_DELTA_KB = 64
+URL = "https://www.example.com/index.html" # where the corpus pages were saved from
+
+
+def body_setup(parser):
+    def _setup(html):
+        return (parse_page(html, parser)[1],)
+    return _setup
+
+
+def comparer_setup(parser):
+    # compare the extracted content with an equal copy that isn't the same object
+    def _setup(html):
+        content = apply_extraction(URL, parse_page(html, parser)[1])[0]
+        now = content[::-1] if isinstance(content, list) else "".join(list(content))
+        return content, now
+    return _setup
+
+
+def pinned_setup(parser):
+    # a text site's rescan, region pinned by a full search beforehand
+    def _setup(html):
+        extraction = Extraction("text")
+        extraction(URL, parse_page(html, parser)[1])
+        return Extraction("text", extraction.region), parse_page(html, parser)[1]
+    return _setup
+
+
+def page_chunks(html, size=4096):
+    # the page as scanner.stream_page reads it from the browser
+    return (html[start:start+size] for start in range(0, len(html), size))
+
+
+def cases(parser) -> dict:
+    # name -> (setup(html) -> args, fn(*args) -> output), setup isn't timed
+    setup = body_setup(parser)
+    result = {
+        "apply_extraction" : (setup, lambda body : apply_extraction(URL, body)),
+        "find_element_with_most_direct_text" : (setup, lambda body : find_element_with_most_direct_text(URL, body)),
+        "collect_internal_links" : (setup, lambda body : collect_internal_links(URL, body)),
+        "pinned_region" : (pinned_setup(parser), lambda extraction, body : extraction(URL, body)),
+        "comparer" : (comparer_setup(parser), comparer),
+        # parsing included, the page as a tree vs streamed (see analysis.PageStream) for big pages
+        "parsed_page" : (lambda html : (html,), lambda html : apply_extraction(URL, parse_page(html, parser)[1])),
+        "streamed_page" : (lambda html : (html,), lambda html : apply_extraction(URL, PageStream(page_chunks(html)))),
+    }
+    if parser != "selectolax":
+        # bs4 only helpers
+        result["get_internal_links"] = (setup, lambda body : get_internal_links(URL, body))
+        result["remove_external_links"] = (setup, lambda body : str(remove_external_links(URL, body)))
+    return result
+
+
+def output_hash(output) -> str:
+    return hashlib.sha256(json.dumps(output, default=str).encode()).hexdigest()[:16]
+
+
+def measure(html, setup, fn, repeat) -> dict:
+    times, hashes = [], set()
+    for _ in range(repeat):
+        args = setup(html)
+        start = time.perf_counter()
+        output = fn(*args)
+        times.append(time.perf_counter() - start)
+        hashes.add(output_hash(output))
+
+    # separate run for memory, tracemalloc slows everything down
+    args = setup(html)
+    tracemalloc.start()
+    fn(*args)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return {
+        "median_s" : statistics.median(times),
+        "min_s" : min(times),
+        "peak_kb" : peak // 1024,
+        "output" : hashes.pop() if len(hashes) == 1 else "unstable",
+    }
+
+
+def run(parser, repeat, only=None) -> dict:
+    results = {}
+    for file_name in sorted(os.listdir(CORPUS_DIR)):
+        if not file_name.endswith(".html"):
+            continue
+        page_name = file_name[:-len(".html")]
+        with open(os.path.join(CORPUS_DIR, file_name)) as f:
+            html = f.read()
+
+        results[page_name] = {}
+        for case_name, (setup, fn) in cases(parser).items():
+            if only and case_name not in only:
+                continue
+            results[page_name][case_name] = measure(html, setup, fn, repeat)
+    return results
+
+
+def compare(results, baseline, tolerance) -> list:
+    # -> [(page, case, problem)]
+    problems = []
+    for page_name, page_results in results.items():
+        for case_name, current in page_results.items():
+            previous = baseline.get(page_name, {}).get(case_name)
+            if current["output"] == "unstable":
+                problems.append((page_name, case_name, "output differs between runs"))
+            if previous is None:
+                continue
+            if current["output"] != previous["output"]:
+                problems.append((page_name, case_name, f"output changed {previous['output']} -> {current['output']}"))
+            if current["median_s"] > previous["median_s"] * (1 + tolerance) + MIN_TIME_DELTA_S:
+                problems.append((page_name, case_name, f"slower {previous['median_s']*1000:.2f}ms -> {current['median_s']*1000:.2f}ms"))
+            if current["peak_kb"] > previous["peak_kb"] * (1 + tolerance) + MIN_MEMORY_DELTA_KB:
+                problems.append((page_name, case_name, f"more memory {previous['peak_kb']}KB -> {current['peak_kb']}KB"))
+    return problems
+
+
+def report(results, baseline):
+    print(f"{'page':<16} {'function':<36} {'median ms':>10} {'vs base':>8} {'peak KB':>9} {'vs base':>8}  output")
+    for page_name, page_results in results.items():
+        for case_name, current in page_results.items():
+            previous = baseline.get(page_name, {}).get(case_name)
+            time_ratio = f"{current['median_s'] / previous['median_s']:.2f}x" if previous else "-"
+            memory_ratio = f"{current['peak_kb'] / max(previous['peak_kb'], 1):.2f}x" if previous else "-"
+            print(f"{page_name:<16} {case_name:<36} {current['median_s']*1000:>10.2f} {time_ratio:>8} {current['peak_kb']:>9} {memory_ratio:>8}  {current['output']}")
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Benchmark the extraction pipeline over the saved corpus")
+    arg_parser.add_argument("--parser", default=default_parser(), help="html parser backend, see parsers.py")
+    arg_parser.add_argument("--repeat", type=int, default=5)
+    arg_parser.add_argument("--tolerance", type=float, default=0.3, help="allowed slowdown / memory growth vs the baseline")
+    arg_parser.add_argument("--only", nargs="*", help="only these functions")
+    arg_parser.add_argument("--save", action="store_true", help="save the results as the new baseline")
+    args = arg_parser.parse_args()
+
+    all_baselines = {}
+    if os.path.exists(BASELINE_PATH):
+        with open(BASELINE_PATH) as f:
+            all_baselines = json.load(f)
+    baseline = all_baselines.get(args.parser, {})
+
+    results = run(args.parser, args.repeat, args.only)
+    print(f"parser : {args.parser}")
+    report(results, baseline)
+
+    if args.save:
+        for page_name, page_results in results.items():
+            all_baselines.setdefault(args.parser, {}).setdefault(page_name, {}).update(page_results)
+        with open(BASELINE_PATH, "w") as f:
+            json.dump(all_baselines, f, indent=2, sort_keys=True)
+        print(f"Baseline saved to {BASELINE_PATH}")
+        sys.exit(0)
+
+    problems = compare(results, baseline, args.tolerance)
+    for page_name, case_name, problem in problems:
+        print(f"REGRESSION {page_name} / {case_name} : {problem}")
+    sys.exit(1 if problems else 0)
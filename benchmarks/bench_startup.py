@@ -0,0 +1,89 @@
+import argparse
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+
+# cold start of each cli.py command : import time in a fresh interpreter & the modules it pulls in
+# python benchmarks/bench_startup.py            -> exit code 1 if a command is over budget or imports what it shouldn't
+# python benchmarks/bench_startup.py --scale 2  -> budgets x2, for slow machines
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCH_DIR)
+
+SCRAPING = ["seleniumbase", "selenium", "scanner", "browser", "main"]
+# command -> (seconds to import it, modules it must not import)
+BUDGETS = {
+    "cli" : (0.05, SCRAPING + ["fastapi", "uvicorn", "pymongo", "bs4", "web", "distributed"]),
+    "serve" : (1.0, SCRAPING + ["uvicorn", "urllib3", "email_util", "distributed"]), # uvicorn only once serving
+    "scan-once" : (3.0, ["fastapi", "uvicorn", "web", "distributed"]),
+    "daemon" : (3.0, ["uvicorn", "distributed"]),
+    "worker" : (3.0, ["fastapi", "uvicorn", "web", "main"]),
+}
+# browser stack, may not be installed where this runs : the commands needing it are skipped
+OPTIONAL = ["seleniumbase"]
+MISSING_MODULE = re.compile(r"ModuleNotFoundError: No module named '([\w.]+)'")
+
+PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import cli
+if {command!r} != "cli":
+    cli.load({command!r})
+print(json.dumps({{"seconds": time.perf_counter() - start, "modules": sorted(sys.modules)}}))
+"""
+
+
+def measure(command, repeat) -> dict:
+    # fresh interpreter every time, nothing cached but the os file cache (first run warms it, not counted)
+    env = {**os.environ, "DB_CLIENT": "memory://", "SNAPSHOT_DIR": ""}
+    runs = []
+    for _ in range(repeat + 1):
+        process = subprocess.run(
+            [sys.executable, "-c", PROBE.format(command=command)],
+            cwd=ROOT_DIR, env=env, capture_output=True, text=True
+        )
+        if process.returncode != 0:
+            missing = MISSING_MODULE.search(process.stderr)
+            if missing is not None and missing.group(1).split(".")[0] in OPTIONAL:
+                return {"missing": missing.group(1)}
+            return {"error": process.stderr.strip()}
+        runs.append(json.loads(process.stdout.strip().splitlines()[-1]))
+    runs = runs[1:]
+    return {"seconds": statistics.median(run["seconds"] for run in runs), "modules": set(runs[0]["modules"])}
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Benchmark the cold start of the cli commands")
+    arg_parser.add_argument("--repeat", type=int, default=5)
+    arg_parser.add_argument("--scale", type=float, default=1.0, help="multiply the budgets")
+    arg_parser.add_argument("--only", nargs="*", help="only these commands")
+    args = arg_parser.parse_args()
+
+    problems = []
+    for command, (budget, forbidden) in BUDGETS.items():
+        if args.only and command not in args.only:
+            continue
+        result = measure(command, args.repeat)
+        if "missing" in result:
+            # its dependencies aren't installed here, nothing to measure
+            print(f"{command:<10} skipped : {result['missing']} is not installed")
+            continue
+        if "error" in result:
+            print(f"{command:<10} FAILED")
+            print(result["error"])
+            problems.append(f"{command} : failed to start")
+            continue
+        budget *= args.scale
+        imported = sorted(module for module in forbidden if module in result["modules"])
+        print(f"{command:<10} {result['seconds'] * 1000:8.1f} ms  (budget {budget * 1000:.0f} ms)  {len(result['modules'])} modules")
+        if result["seconds"] > budget:
+            problems.append(f"{command} : {result['seconds'] * 1000:.1f} ms over its {budget * 1000:.0f} ms budget")
+        if imported:
+            problems.append(f"{command} : imports {', '.join(imported)}")
+
+    for problem in problems:
+        print(f"REGRESSION {problem}")
+    sys.exit(1 if problems else 0)
@@ -0,0 +1,82 @@
+import random
+import os
+
+# writes the saved pages in benchmarks/corpus, only needed when the corpus itself changes
+# pages are shaped like a browser's outerHTML (already normalized markup)
+
+CORPUS_DIR = os.path.join(os.path.dirname(__file__), "corpus")
+WORDS = "lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod tempor incididunt ut labore et dolore magna aliqua".split()
+
+
+def sentence(r : random.Random, n_min=6, n_max=20) -> str:
+    return " ".join(r.choice(WORDS) for _ in range(r.randint(n_min, n_max))).capitalize() + "."
+
+
+def nav(r : random.Random, n_links : int) -> str:
+    links = "".join(f'<li><a href="/section/{i}">{r.choice(WORDS).title()}</a></li>' for i in range(n_links))
+    return f'<nav><ul>{links}</ul></nav>'
+
+
+def footer(r : random.Random) -> str:
+    # external links with nested linked elements, the tracker pixel etc..
+    social = "".join(
+        f'<a href="https://{name}.com/example"><img src="/static/{name}.svg" alt="{name}"></a>'
+        for name in ["twitter", "facebook", "instagram"]
+    )
+    return f'<footer><p>{sentence(r)}</p>{social}<img src="https://tracker.example.net/pixel.gif"><a href="/privacy">Privacy</a></footer>'
+
+
+def small_article(r : random.Random) -> str:
+    paragraphs = "".join(f"<p>{' '.join(sentence(r) for _ in range(r.randint(3, 7)))}</p>" for _ in range(15))
+    body = (
+        f'<header><a href="/"><img src="/static/logo.png"></a>{nav(r, 8)}</header>'
+        f'<main><article><h1>{sentence(r, 4, 8)}</h1><span class="date">March 3, 2025</span>{paragraphs}</article>'
+        f'<aside><h2>Related</h2><ul>{"".join(f"<li><a href=/post/{i}>{sentence(r, 3, 6)}</a></li>" for i in range(6))}</ul></aside></main>'
+        f'{footer(r)}'
+    )
+    return page("Small article", body)
+
+
+def link_index(r : random.Random, n_items=6000) -> str:
+    items = []
+    for i in range(n_items):
+        items.append(
+            f'<li class="item"><a href="/item/{i}?ref=index"><img src="/thumbs/{i}.jpg" alt=""></a>'
+            f'<div class="meta"><a href="/item/{i}">{sentence(r, 2, 5)}</a><span class="price">${r.randint(1, 999)}.99</span></div></li>'
+        )
+        if i % 50 == 0:
+            items.append(f'<li class="ad"><a href="https://ads.example.com/click?id={i}"><img src="https://ads.example.com/{i}.png"></a></li>')
+    pages = "".join(f'<a href="/index?page={i}">{i}</a>' for i in range(1, 40))
+    body = f'<header>{nav(r, 30)}</header><main><h1>Catalog</h1><ul class="grid">{"".join(items)}</ul><div class="pages">{pages}</div></main>{footer(r)}'
+    return page("Link heavy index", body)
+
+
+def spa_scripts(r : random.Random) -> str:
+    state = ",".join(f'{{"id":{i},"name":"{sentence(r, 2, 4)}","tags":["{r.choice(WORDS)}"]}}' for i in range(3000))
+    scripts = "".join(f'<script src="/static/chunk.{i}.js"></script>' for i in range(25))
+    inline = "".join(f"<script>window.__chunk{i}=function(){{return {r.random()};}};</script>" for i in range(200))
+    styles = "".join(f"<style>.c{i}{{color:#{r.randint(0, 0xFFFFFF):06x};margin:{i}px}}</style>" for i in range(100))
+    cards = "".join(
+        f'<div class="card"><div class="card-title">{sentence(r, 2, 5)}</div><div class="card-body"><span>{sentence(r)}</span></div>'
+        f'<button data-id="{i}">Open</button></div>'
+        for i in range(60)
+    )
+    body = (
+        f'<div id="root"><div class="app"><div class="toolbar">{nav(r, 12)}</div><div class="cards">{cards}</div></div></div>'
+        f'<noscript>You need to enable JavaScript to run this app.</noscript>'
+        f'<script id="__STATE__" type="application/json">[{state}]</script>{styles}{inline}{scripts}'
+    )
+    return page("Script heavy SPA", body)
+
+
+def page(title, body) -> str:
+    return f'<!DOCTYPE html><html lang="en"><head><meta charset="utf-8"><title>{title}</title></head><body>{body}</body></html>'
+
+
+if __name__ == "__main__":
+    os.makedirs(CORPUS_DIR, exist_ok=True)
+    for name, make in [("small_article", small_article), ("link_index", link_index), ("spa_scripts", spa_scripts)]:
+        path = os.path.join(CORPUS_DIR, f"{name}.html")
+        with open(path, "w") as f:
+            f.write(make(random.Random(name)))
+        print(f"Wrote {path} ({os.path.getsize(path) // 1024} KB)")
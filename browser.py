@@ -0,0 +1,175 @@
+from threading import Lock
+
+from policy import domain_of
+from sessions import SessionStore
+
+# long lived browsers for the scans, kept warm between cycles instead of a new chrome per cycle
+# pages load without images / fonts / media / known trackers, extraction only reads the DOM
+# (img src etc.. are still in it, the files just aren't downloaded)
+
+BLOCKED_EXTENSIONS = [
+    "png", "jpg", "jpeg", "gif", "webp", "avif", "ico", "bmp", # images, svg are left for captcha widgets
+    "woff", "woff2", "ttf", "otf", "eot", # fonts
+    "mp4", "webm", "ogg", "mp3", "wav", "m3u8", "m4s", # media
+]
+BLOCKED_HOSTS = [
+    "google-analytics.com", "googletagmanager.com", "doubleclick.net", "googlesyndication.com",
+    "adservice.google.com", "facebook.net", "connect.facebook.com", "hotjar.com", "segment.io",
+    "scorecardresearch.com", "quantserve.com", "taboola.com", "outbrain.com", "criteo.com",
+    "amazon-adsystem.com", "clarity.ms", "newrelic.com", "nr-data.net",
+]
+# Network.setBlockedURLs patterns, * is the only wildcard
+BLOCKED_URLS = (
+    [f"*.{extension}" for extension in BLOCKED_EXTENSIONS]
+    + [f"*.{extension}?*" for extension in BLOCKED_EXTENSIONS]
+    + [f"*://*{host}/*" for host in BLOCKED_HOSTS]
+)
+
+
+# challenge pages & widgets uc_gui_click_captcha is for, checked before clicking : most pages have none
+CAPTCHA_SELECTORS = [
+    "iframe[src*='challenges.cloudflare.com']", ".cf-turnstile", "#challenge-form", "#cf-challenge-running",
+    "iframe[src*='recaptcha'][src*='anchor']:not([src*='size=invisible'])", # not the invisible v3 badge
+    "iframe[src*='hcaptcha.com']", "iframe[src*='captcha-delivery.com']", "#px-captcha",
+]
+CAPTCHA_TITLES = ["just a moment", "attention required", "verify you are human", "security check"]
+HAS_CAPTCHA = f"""
+var title = (document.title || "").toLowerCase();
+return {CAPTCHA_TITLES!r}.some(function (part) {{ return title.indexOf(part) >= 0; }})
+    || document.querySelector({", ".join(CAPTCHA_SELECTORS)!r}) !== null;
+"""
+
+
+class BrowserManager:
+    """
+    One browser reused for many pages: started on first use, restarted after `max_pages`
+    pages or once it stopped answering. Used like the driver itself.
+    """
+    def __init__(self, driver_factory, max_pages=200, blocked_urls=BLOCKED_URLS, sessions : SessionStore = None):
+        self.driver_factory = driver_factory
+        self.max_pages = max_pages
+        self.blocked_urls = blocked_urls
+        self.sessions = sessions
+        self.driver = None
+        self.pages = 0
+        self.restored = set() # domains whose saved cookies are in this browser
+
+    def get(self):
+        if self.driver is not None and self.pages >= self.max_pages:
+            # long running chrome slowly grows, start over
+            self.stop()
+        if self.driver is None:
+            self.driver = self.driver_factory()
+            self.pages = 0
+            self.restored = set()
+        return self.driver
+
+    def block_resources(self, driver):
+        if not self.blocked_urls:
+            return
+        try:
+            driver.execute_cdp_cmd("Network.enable", {})
+            driver.execute_cdp_cmd("Network.setBlockedURLs", {"urls": self.blocked_urls})
+        except Exception as e:
+            # page still loads, only slower
+            print(f"Resource blocking failed with ERROR : {e}")
+
+    def restore_session(self, driver, url):
+        # cookies of a challenge passed before (by any browser), once per domain
+        domain = domain_of(url)
+        if self.sessions is None or domain in self.restored:
+            return
+        self.restored.add(domain)
+        try:
+            cookies = self.sessions.load(domain)
+            if cookies:
+                driver.execute_cdp_cmd("Network.setCookies", {"cookies": cookies})
+        except Exception as e:
+            # the page may ask for the captcha again
+            print(f"Restoring the session of {domain} failed with ERROR : {e}")
+
+    def save_session(self, url):
+        """Keep the cookies of url's domain, called once its captcha is done."""
+        if self.sessions is None or self.driver is None:
+            return
+        try:
+            cookies = self.driver.execute_cdp_cmd("Network.getCookies", {"urls": [url]})["cookies"]
+            self.sessions.save(domain_of(url), cookies)
+        except Exception as e:
+            print(f"Saving the session of {domain_of(url)} failed with ERROR : {e}")
+
+    def has_captcha(self) -> bool:
+        return bool(self.get().execute_script(HAS_CAPTCHA))
+
+    def uc_open(self, url):
+        driver = self.get()
+        # set on every page, uc mode reconnects to the browser around page loads
+        self.block_resources(driver)
+        self.restore_session(driver, url)
+        self.pages += 1
+        return driver.uc_open(url)
+
+    def refresh(self):
+        # called after a failed attempt, a browser that can't refresh has crashed
+        if self.driver is None:
+            return
+        try:
+            self.driver.refresh()
+        except Exception as e:
+            print(f"Browser not responding, restarting it. Reason : {e}")
+            self.stop()
+
+    def __getattr__(self, name):
+        return getattr(self.get(), name)
+
+    def stop(self):
+        if self.driver is not None:
+            try:
+                self.driver.quit()
+            except Exception:
+                pass # already dead
+            self.driver = None
+
+
+class BrowserLease:
+    # a pool's browser for one worker, quit only hands it back
+    def __init__(self, pool, browser : BrowserManager):
+        self.pool = pool
+        self.browser = browser
+
+    def __getattr__(self, name):
+        return getattr(self.browser, name)
+
+    def quit(self):
+        self.pool.release(self.browser)
+
+
+class BrowserPool:
+    """
+    Warm browsers shared by the scan cycles, each run_pool worker leases one
+    (`run_pool(items, task, pool.lease, workers)`) and gives it back when done.
+    """
+    def __init__(self, driver_factory, max_pages=200, blocked_urls=BLOCKED_URLS, sessions : SessionStore = None):
+        self.driver_factory = driver_factory
+        self.max_pages = max_pages
+        self.blocked_urls = blocked_urls
+        self.sessions = sessions
+        self.idle = []
+        self.lock = Lock()
+
+    def lease(self) -> BrowserLease:
+        with self.lock:
+            browser = self.idle.pop() if self.idle else None
+        if browser is None:
+            browser = BrowserManager(self.driver_factory, self.max_pages, self.blocked_urls, self.sessions)
+        return BrowserLease(self, browser)
+
+    def release(self, browser : BrowserManager):
+        with self.lock:
+            self.idle.append(browser)
+
+    def close(self):
+        with self.lock:
+            browsers, self.idle = self.idle, []
+        for browser in browsers:
+            browser.stop()
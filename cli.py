@@ -0,0 +1,52 @@
+import argparse
+import importlib
+
+# one entry point for every way of running the app, each command only imports what it runs :
+#   serve      dashboard & api only, no scanning code (fastapi + the db)
+#   scan-once  one cycle over every site, sends the digest & exits
+#   daemon     web, email & the scan loop in one process (what main.py used to be)
+#   scheduler / worker / reporter / api   the roles of distributed.py
+# python cli.py <command>, benchmarks/bench_startup.py keeps the cold starts in check
+
+COMMANDS = {
+    # command -> (module, function), imported when run
+    "serve" : ("web", "serve"),
+    "scan-once" : ("main", "scan_once"),
+    "daemon" : ("main", "daemon"),
+    "scheduler" : ("distributed", "run_scheduler"),
+    "worker" : ("distributed", "run_worker"),
+    "reporter" : ("distributed", "run_reporter"),
+    "api" : ("distributed", "run_api"),
+}
+
+
+def load(command):
+    """Import what command needs & return its function, without running it."""
+    module, function = COMMANDS[command]
+    return getattr(importlib.import_module(module), function)
+
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(description="Site change notifier")
+    commands = arg_parser.add_subparsers(dest="command", required=True)
+    serve_parser = commands.add_parser("serve", help="dashboard & api only")
+    serve_parser.add_argument("--port", type=int, default=None, help="default PORT from config")
+    scan_parser = commands.add_parser("scan-once", help="check every site once & send the digest")
+    scan_parser.add_argument("--workers", type=int, default=None, help="browsers in parallel, default SCAN_WORKERS")
+    commands.add_parser("daemon", help="web, email & scan loop in one process")
+    for role in ("scheduler", "worker", "reporter", "api"):
+        commands.add_parser(role, help=f"the {role} role of distributed.py")
+    args = arg_parser.parse_args(argv)
+
+    run = load(args.command)
+    if args.command == "serve":
+        from config import PORT
+        run(args.port or PORT)
+    elif args.command == "scan-once" and args.workers is not None:
+        run(args.workers)
+    else:
+        run()
+
+
+if __name__ == "__main__":
+    main()
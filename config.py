@@ -0,0 +1,33 @@
+from dotenv import load_dotenv
+import os
+
+# settings from the environment (.env), shared by main.py & the roles in distributed.py
+# nothing here connects to anything
+load_dotenv()
+
+sender_email = os.getenv("SENDER_EMAIL")
+app_password = os.getenv("APP_PASSWORD")
+recipient_email = os.getenv("RECIPIENT_EMAIL")
+db_client = os.getenv("DB_CLIENT")
+dbname = os.getenv("DB_NAME")
+PORT = 3000
+PUBLIC_URL = os.getenv("PUBLIC_URL") # address in the digest, the local ip if not set
+SCAN_WORKERS = int(os.getenv("SCAN_WORKERS", 1)) # browsers scanning in parallel
+BROWSER_MAX_PAGES = int(os.getenv("BROWSER_MAX_PAGES", 200)) # pages before a browser is restarted
+BLOCK_RESOURCES = os.getenv("BLOCK_RESOURCES", "1") == "1" # images / fonts / media / trackers
+DOMAIN_CONCURRENCY = int(os.getenv("DOMAIN_CONCURRENCY", 1)) # scans of one domain at once
+DOMAIN_RATE = float(os.getenv("DOMAIN_RATE", 0.5)) # scans of one domain per second
+SMTP_HOST = os.getenv("SMTP_HOST", "smtp.gmail.com")
+SMTP_PORT = int(os.getenv("SMTP_PORT", 587))
+SMTP_STARTTLS = os.getenv("SMTP_STARTTLS", "1") == "1"
+SNAPSHOT_DIR = os.getenv("SNAPSHOT_DIR", "snapshots") # raw pages of the scans, empty to turn off (see snapshots.py)
+SNAPSHOT_KEEP = int(os.getenv("SNAPSHOT_KEEP", 5)) # per site
+SNAPSHOT_MAX_DAYS = int(os.getenv("SNAPSHOT_MAX_DAYS", 30))
+# browser pages longer than this (chars) are parsed while read in chunks, without the whole page & its tree in memory
+# (see analysis.PageStream), 0 to turn off
+STREAM_PAGES_OVER = int(os.getenv("STREAM_PAGES_OVER", 5_000_000))
+STREAM_MEMORY_CAP = int(os.getenv("STREAM_MEMORY_CAP", 20_000_000)) # chars of text & links kept while streaming, past it the whole page is parsed
+# distance (0 - 1, see similarity.py) over which a change of content counts, for sites without their own
+# 0 : any change counts
+CHANGE_THRESHOLD = float(os.getenv("CHANGE_THRESHOLD", 0))
+SESSION_MAX_DAYS = int(os.getenv("SESSION_MAX_DAYS", 7)) # cookies kept after a captcha (see sessions.py)
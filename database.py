@@ -1,110 +1,324 @@
 from pymongo import MongoClient
-from datetime import datetime
+from datetime import datetime, timedelta
+from threading import Lock
+
+from algorithm import fingerprint, content_kind
+from similarity import signature
+from delta import make_delta, apply_delta
+from storage import storage_of
+
+def summary_fields(content) -> dict:
+    # what scans compare instead of the content itself
+    return {
+        'content-fingerprint': fingerprint(content),
+        'content-kind': content_kind(content),
+        'content-signature': signature(content), # see similarity.py
+    }
+
 
 class NotifyDB:
     def __init__(self, client : MongoClient, dbname):
-        self.db = client[dbname]
-        self.collection = self.db['sites']  # The collection to store site data
-        self.collection.create_index('url', unique=True)
+        # a MongoClient or a storage.SQLiteStorage, see storage.open_storage
+        self.store = storage_of(client).sites(dbname)  # The store of site data
+
+        # updates buffered during a scan cycle, see queue_put / flush
+        self.pending_updates = []
+        self.pending_updates_lock = Lock()
 
     def get_all_links(self):
         """Return all existing site links."""
-        return [doc['url'] for doc in self.collection.find({}, {'_id': 0, 'url': 1})]
+        return self.store.urls()
     
     def get_all(self):
-        return list(self.collection.find({}, {'_id': 0}))
+        return self.store.find()
+
+    def get_page(self, limit, after=None, with_content=False):
+        """Sites sorted by url, starting after the url `after` -> (sites, next cursor or None)."""
+        # one extra to know if there is a next page
+        docs = self.store.find(with_content, after=after, limit=limit + 1)
+        if len(docs) > limit:
+            return docs[:limit], docs[limit - 1]['url']
+        return docs, None
+
+    def exists(self, site):
+        return self.store.exists(site)
 
-    def post(self, site, title, content):
+    def post(self, site, title, content, fetch_info=None, region=None):
         """Add a new site."""
-        if self.collection.find_one({'url': site}):
-            raise ValueError(f"Site '{site}' already exists.")
-        self.collection.insert_one({
+        # the unique url does the existence check
+        now = datetime.now()
+        inserted = self.store.insert({
             'url': site,
             'title': title,
-            'last-search': datetime.now(),
+            'added-date': now,
+            'last-search': now,
             'latest-search-content': content,
-            'latest-updated-date' : None
+            **summary_fields(content[0]),
+            'latest-updated-date' : None,
+            'region': region, # where text sites are read from, see algorithm.Extraction
+            **(fetch_info or {})
         })
+        if not inserted:
+            raise ValueError(f"Site '{site}' already exists.")
 
     def delete(self, site):
         """Remove a site."""
-        result = self.collection.delete_one({'url': site})
-        if result.deleted_count == 0:
+        if not self.store.delete(site):
             raise ValueError(f"Site '{site}' not found.")
 
-    def put(self, site, title=None, content=None):
-        """Update site details."""
-        # Build the update structure dynamically
+    def delete_many(self, sites):
+        self.store.delete_many(sites)
 
-        update_fields = {'last-search': datetime.now()}  # Always update last-search
+    @staticmethod
+    def update_fields(title=None, content=None, fetch_info=None, region=None):
+        # Build the update structure dynamically
+        update_fields = {'last-search': datetime.now(), 'failures': 0}  # Always update last-search, a search that worked
+        if fetch_info is not None:
+            # needs-browser / etag / last-modified from the http tier
+            update_fields.update(fetch_info)
+        if region is not None:
+            update_fields['region'] = region
         if title is not None:
             update_fields['title'] = title
         if content is not None:
+            # full payload only written when it changed
             update_fields['latest-search-content'] = content
+            update_fields.update(summary_fields(content[0]))
 
         if (title is not None) and (content is not None):
             update_fields['latest-updated-date'] = update_fields['last-search']
+        return update_fields
 
+    def put(self, site, title=None, content=None, fetch_info=None, region=None):
+        """Update site details."""
         # Perform the update
-        result = self.collection.update_one(
-            {'url': site},
-            {'$set': update_fields}
-        )
-        if result.matched_count == 0:
+        if not self.store.update(site, self.update_fields(title, content, fetch_info, region)):
+            raise ValueError(f"Site '{site}' not found.")
+
+    def set_threshold(self, site, threshold=None):
+        """Distance (0 - 1, see similarity.py) over which a change of site counts, None for CHANGE_THRESHOLD."""
+        if threshold is not None and not 0 <= threshold <= 1:
+            raise ValueError(f"Threshold {threshold} is not between 0 and 1.")
+        if not self.store.update(site, {'change-threshold': threshold}):
             raise ValueError(f"Site '{site}' not found.")
 
-    def get(self, site):
+    def get(self, site, with_content=True):
         """Get a single site's information."""
-        doc = self.collection.find_one({'url': site}, {'_id': 0})
+        doc = self.store.find_one(site, with_content)
         if not doc:
             raise ValueError(f"Site '{site}' not found.")
+
+        if not with_content and 'content-signature' not in doc:
+            # stored before fingerprints / signatures existed, compute them once from the full content
+            backfill = summary_fields(self.get(site)['latest-search-content'][0])
+            doc.update(backfill)
+            self.store.update(site, backfill)
         return doc
 
+    def get_many(self):
+        """Get every site without its content, in one query -> {url : doc}."""
+        docs = {doc['url'] : doc for doc in self.store.find(with_content=False)}
+
+        # stored before fingerprints / signatures existed, one more query for just those
+        legacy = [url for url, doc in docs.items() if 'content-signature' not in doc]
+        if legacy:
+            for doc in self.store.find(urls=legacy):
+                backfill = summary_fields(doc['latest-search-content'][0])
+                docs[doc['url']].update(backfill)
+                self.queue_update(doc['url'], backfill)
+        return docs
+
+    def queue(self, site, set_fields, inc_fields=None, batch_size=500):
+        # buffer a write, written with the others by flush
+        with self.pending_updates_lock:
+            self.pending_updates.append((site, set_fields, inc_fields))
+            is_full = len(self.pending_updates) >= batch_size
+        if is_full:
+            self.flush()
+
+    def queue_update(self, site, update_fields):
+        self.queue(site, update_fields)
+
+    def queue_put(self, site, title=None, content=None, fetch_info=None, region=None):
+        """Same as put, but buffered until flush."""
+        self.queue_update(site, self.update_fields(title, content, fetch_info, region))
+
+    def queue_failure(self, site, error):
+        """Count a failed search of site (reset by the next one that works), buffered until flush."""
+        self.queue(site, {'last-error': str(error), 'last-failure': datetime.now()}, {'failures': 1})
+
+    def flush(self):
+        """Write all buffered updates in one bulk write."""
+        with self.pending_updates_lock:
+            updates, self.pending_updates = self.pending_updates, []
+        if updates:
+            self.store.bulk_update(updates)
+
+
+
+class HistoryDB:
+    # past versions of every site's content, each one a delta against the one before
+    # with a full snapshot every `snapshot_every` versions, only the last `max_versions` are kept
+    def __init__(self, client : MongoClient, dbname, snapshot_every=10, max_versions=50):
+        assert 0 < snapshot_every <= max_versions, "Need a snapshot within the kept versions"
+        self.db = client[dbname]
+        self.collection = self.db['history']
+        self.collection.create_index([('url', 1), ('version', 1)], unique=True)
+        self.snapshot_every = snapshot_every
+        self.max_versions = max_versions
+
+    def latest_version(self, site):
+        doc = self.collection.find_one({'url': site}, {'_id': 0, 'version': 1}, sort=[('version', -1)])
+        return None if doc is None else doc['version']
+
+    def record(self, site, previous, content):
+        """Store `content` ([value, length]) as the newest version, `previous` is the version before it (None if new)."""
+        latest = self.latest_version(site)
+
+        if latest is None and previous is not None:
+            # site older than the history, start from what it had
+            self.collection.insert_one(self.snapshot_doc(site, 0, previous))
+            latest = 0
+
+        version = 0 if latest is None else latest + 1
+        same_kind = previous is not None and content_kind(previous[0]) == content_kind(content[0])
+        if version % self.snapshot_every == 0 or not same_kind:
+            doc = self.snapshot_doc(site, version, content)
+        else:
+            doc = {
+                'url': site,
+                'version': version,
+                'date': datetime.now(),
+                'kind': content_kind(content[0]),
+                'length': content[1],
+                'delta': make_delta(previous[0], content[0]),
+            }
+        self.collection.insert_one(doc)
+        self.trim(site, version)
+
+    @staticmethod
+    def snapshot_doc(site, version, content):
+        value = sorted(set(content[0])) if isinstance(content[0], list) else content[0]
+        return {
+            'url': site,
+            'version': version,
+            'date': datetime.now(),
+            'kind': content_kind(content[0]),
+            'length': content[1],
+            'snapshot': value,
+        }
+
+    def trim(self, site, latest):
+        # drop versions past retention, the oldest kept one becomes a snapshot if it's a delta
+        oldest_kept = latest - self.max_versions + 1
+        if oldest_kept <= 0:
+            return
+        oldest = self.collection.find_one({'url': site, 'version': oldest_kept}, {'_id': 0, 'snapshot': 1})
+        if oldest is not None and 'snapshot' not in oldest:
+            self.collection.update_one(
+                {'url': site, 'version': oldest_kept},
+                {'$set': {'snapshot': self.get(site, oldest_kept)}, '$unset': {'delta': ''}}
+            )
+        self.collection.delete_many({'url': site, 'version': {'$lt': oldest_kept}})
+
+    def list_versions(self, site):
+        """Versions of a site without their content."""
+        return list(self.collection.find({'url': site}, {'_id': 0, 'snapshot': 0, 'delta': 0}).sort('version', -1))
+
+    def get(self, site, version):
+        """Rebuild the content of a version from the closest snapshot before it."""
+        snapshot = self.collection.find_one(
+            {'url': site, 'version': {'$lte': version}, 'snapshot': {'$exists': True}},
+            {'_id': 0, 'version': 1, 'snapshot': 1},
+            sort=[('version', -1)]
+        )
+        if snapshot is None:
+            raise ValueError(f"Version {version} of '{site}' not found.")
+
+        content = snapshot['snapshot']
+        if snapshot['version'] == version:
+            return content
+
+        deltas = self.collection.find(
+            {'url': site, 'version': {'$gt': snapshot['version'], '$lte': version}},
+            {'_id': 0, 'version': 1, 'delta': 1}
+        ).sort('version', 1)
+        found = snapshot['version']
+        for doc in deltas:
+            content = apply_delta(content, doc['delta'])
+            found = doc['version']
+        if found != version:
+            raise ValueError(f"Version {version} of '{site}' not found.")
+        return content
+
+    def delete(self, site):
+        self.collection.delete_many({'url': site})
+
 
 
 class PoppingDB:
     # this is to be used with Notify DB
-    def __init__(self, client : MongoClient, dbname, notifiyDB : NotifyDB):
-        self.db = client[dbname]
-        self.collection = self.db['pending']
-        self.collection.create_index('url', unique=True)
+    # a lease queue : claim hides a url for `lease` (visibility timeout), ack removes it once added,
+    # a url whose worker died shows up again when the lease runs out, so several processes can ingest
+    def __init__(self, client : MongoClient, dbname, notifiyDB : NotifyDB, lease : timedelta = timedelta(minutes=15), max_attempts = 5):
+        self.store = storage_of(client).pending(dbname)
         self.ndb = notifiyDB
+        self.lease = lease
+        # claims in a row without an ack / release (the worker died on it) before a url is left for the user to look at
+        self.max_attempts = max_attempts
 
     def post(self, url):
-        result = None
-        try:
-            result = self.ndb.get(url)
-        except ValueError:
-            # if not in ndb
-            result = None
-
-        if (result is not None) or (self.collection.find_one({'url': url}, {'_id': 0}) is not None):
+        if self.ndb.exists(url):
             raise ValueError(f"Site {url} already exist in DB")
 
-        self.collection.insert_one({
-            'url' : url
-        })
+        # the unique url does the check for pending
+        if not self.store.insert(self.new_doc(url)):
+            raise ValueError(f"Site {url} already exist in DB")
+
+    def post_many(self, urls):
+        # already pending ones are skipped
+        self.store.insert_many([self.new_doc(url) for url in urls])
 
     def delete(self, url):
         """Remove a site."""
-        result = self.collection.delete_one({'url': url})
-        if result.deleted_count == 0:
+        if not self.store.delete(url):
             raise ValueError(f"Site '{url}' not found.")
         
     def get_all_url(self):
-        return [doc['url'] for doc in self.collection.find({}, {'_id': 0, 'url': 1})]
+        return self.store.urls()
 
-    def __iter__(self):
-        all_current_url = self.get_all_url()
+    @staticmethod
+    def new_doc(url):
+        return {'url': url, 'lease-until': None, 'attempts': 0}
+
+    def claim(self, available_before : datetime = None):
+        """
+        Lease the oldest available url, None if there is none. ack or release it after.
+        With available_before, only urls released or whose lease ran out before then.
+        """
+        now = datetime.now()
+        return self.store.claim(available_before or now, now + self.lease, self.max_attempts)
 
-        for url in all_current_url:
+    def ack(self, url):
+        # added, done with it
+        self.store.delete(url)
+
+    def release(self, url):
+        # failed, available again from the next iteration, a clean failure doesn't count as an attempt
+        self.store.release(url, datetime.now())
+
+    def __iter__(self):
+        # claimed urls until none is left, each one has to be acked or released.
+        # what is released meanwhile waits for the next iteration, a url is tried once per cycle
+        started = datetime.now()
+        while (url := self.claim(started)) is not None:
             yield url
-            self.delete(url)
 
 
-def move_all_from_notify_to_popping(ndb : NotifyDB, pdb : PoppingDB):
+def move_all_from_notify_to_popping(ndb : NotifyDB, pdb : PoppingDB, batch_size=1000):
+    # pending first, a crash in between leaves a url in both rather than in neither
     all_ndb_url = ndb.get_all_links()
-    for url in all_ndb_url:
-        ndb.delete(url)
-        pdb.post(url)
-    
\ No newline at end of file
+    for start in range(0, len(all_ndb_url), batch_size):
+        batch = all_ndb_url[start:start + batch_size]
+        pdb.post_many(batch)
+        ndb.delete_many(batch)
@@ -0,0 +1,53 @@
+from difflib import SequenceMatcher
+import re
+
+# deltas between two versions of a site's content, for the history collection
+# links are kept as sets (sorted unique list), text is diffed on words so the rebuild is exact
+
+
+def link_delta(previous : list, now : list) -> dict:
+    previous, now = set(previous), set(now)
+    return {
+        "added" : sorted(now - previous),
+        "removed" : sorted(previous - now),
+    }
+
+
+def apply_link_delta(previous : list, delta : dict) -> list:
+    return sorted((set(previous) - set(delta["removed"])) | set(delta["added"]))
+
+
+def tokenize(text : str) -> list:
+    # words & the whitespace between them, "".join gives back text
+    return re.split(r"(\s+)", text)
+
+
+def text_delta(previous : str, now : str) -> list:
+    # [[start, end, replacement tokens], ...] on the tokens of previous
+    previous_tokens, now_tokens = tokenize(previous), tokenize(now)
+    matcher = SequenceMatcher(None, previous_tokens, now_tokens, autojunk=False)
+    return [
+        [i1, i2, now_tokens[j1:j2]]
+        for tag, i1, i2, j1, j2 in matcher.get_opcodes()
+        if tag != "equal"
+    ]
+
+
+def apply_text_delta(previous : str, delta : list) -> str:
+    tokens = tokenize(previous)
+    # from the end so earlier indexes stay valid
+    for start, end, replacement in reversed(delta):
+        tokens[start:end] = replacement
+    return "".join(tokens)
+
+
+def make_delta(previous, now):
+    if isinstance(now, list):
+        return link_delta(previous, now)
+    return text_delta(previous, now)
+
+
+def apply_delta(previous, delta):
+    if isinstance(previous, list):
+        return apply_link_delta(previous, delta)
+    return apply_text_delta(previous, delta)
@@ -0,0 +1,65 @@
+from datetime import datetime
+from html import escape
+
+from utils import time_difference_description
+
+# the email digest of a scan cycle, from what add_site / check_site returned
+
+
+def compose_digest(added : list, messages : list, hosting_address) -> tuple[str, str, bool]:
+    """
+    added : [(url, is_added)], messages : check_site messages in url order
+    -> (subject, html body, if anything was updated or added)
+    """
+    construct_message = ""
+    new_counter = 0
+    for site, is_added in sorted(added, key=lambda r : r[0]):
+        new_counter += bool(is_added)
+        if is_added:
+            construct_message += f"Site : {site} Added\n\n"
+        else:
+            construct_message += f"Site : {site} Failed to be added\n\n"
+
+    update_counter = 0
+    failed_counter = 0
+
+
+    for message in messages:
+        same = message["same"]
+        title = " ".join(message['title'].split()) # pretty only at output
+        update_counter += not(same)
+        failed_counter += message["error"] is not None
+        
+        update_msg = f"--- Updated {time_difference_description(message['latest_update'])}" if message['latest_update'] else "Never - Updated"
+        update_msg = update_msg if same else "--- Updated now"
+        if message["changes"] is not None:
+            added_links, removed_links = message["changes"]
+            update_msg += f" (+{len(added_links)} / -{len(removed_links)} links)"
+        if message["error"] is not None:
+            update_msg = f"--- Failed {message['failures']} time(s) in a row : {escape(message['error'])}"
+        update_msg += "\n"
+
+        composed_message = f'<p><a href="{message["url"]}" target="_blank">{title}</a></p>\n{update_msg}\n'
+
+        
+
+        if same:
+            # append
+            construct_message += composed_message
+        else:
+            # prepend if updated
+            construct_message = composed_message + construct_message
+
+    construct_message += f'<p> Local Address if @ home  <a href="{hosting_address}" target="_blank"> {hosting_address} </a> </p> \n'
+
+
+    first_string = f"Updates : {update_counter}"
+
+    if new_counter > 0:
+        first_string += f" & {new_counter} New Sites Added"
+    if failed_counter > 0:
+        first_string += f" & {failed_counter} Failed"
+
+    subject_message = f"{first_string} @ {datetime.now().strftime('%B %d, %Y - (%I:%M %p)')}"
+
+    return subject_message, construct_message, update_counter > 0 or new_counter > 0
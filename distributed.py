@@ -0,0 +1,264 @@
+from datetime import datetime, timedelta
+from threading import Thread
+import argparse
+import os
+import socket
+import time
+
+from pymongo import MongoClient, UpdateOne
+
+from config import (
+    sender_email, app_password, recipient_email, db_client, dbname, PORT, PUBLIC_URL, SCAN_WORKERS,
+    BROWSER_MAX_PAGES, BLOCK_RESOURCES, DOMAIN_CONCURRENCY, DOMAIN_RATE, SMTP_HOST, SMTP_PORT, SMTP_STARTTLS,
+    SESSION_MAX_DAYS
+)
+from database import NotifyDB, PoppingDB, HistoryDB
+from scheduler import SiteScheduler
+from utils import get_local_ip, time_iterator, hour_range
+
+# main.py split in roles that only share mongo, each one its own process on any host :
+#   scheduler : every tick, puts the due sites & the pending urls of a new cycle in the 'jobs' collection
+#   worker    : claims jobs with a lease, scans them with its browsers & writes the result (run as many as needed)
+#   reporter  : once every job of a cycle is done, builds that cycle's digest & sends the emails
+#   api       : the web app
+# python distributed.py <role>
+
+
+class JobQueue:
+    """
+    Scan jobs ({cycle, kind : check | add, url}) in the 'jobs' collection, one cycle per scheduler tick in 'cycles'.
+    A claimed job is hidden for `lease`, if its worker dies it's claimed again, after `max_attempts` it's given up.
+    """
+    def __init__(self, client : MongoClient, dbname, lease : timedelta = timedelta(minutes=15), max_attempts = 3):
+        self.db = client[dbname]
+        self.collection = self.db['jobs']
+        self.collection.create_index([('status', 1), ('lease-until', 1)])
+        self.collection.create_index([('cycle', 1), ('status', 1)])
+        self.collection.create_index([('url', 1), ('kind', 1)])
+        self.cycles = self.db['cycles']
+        self.lease = lease
+        self.max_attempts = max_attempts
+
+    def new_cycle(self):
+        # not reported before seal_cycle, the reporter would see it done while its jobs are being added
+        return self.cycles.insert_one({'created': datetime.now(), 'status': 'scheduling'}).inserted_id
+
+    def seal_cycle(self, cycle):
+        # every job of cycle is queued
+        self.cycles.update_one({'_id': cycle}, {'$set': {'status': 'running'}})
+
+    def seal_unfinished(self):
+        # cycles left scheduling by a scheduler that stopped, their queued jobs still get reported
+        self.cycles.update_many({'status': 'scheduling'}, {'$set': {'status': 'running'}})
+
+    def enqueue(self, cycle, kind, urls) -> int:
+        """Add jobs to cycle, skipping urls that still have an unfinished job of that kind -> jobs added."""
+        if not urls:
+            return 0
+        now = datetime.now()
+        result = self.collection.bulk_write([
+            UpdateOne(
+                {'url': url, 'kind': kind, 'status': {'$ne': 'done'}},
+                {'$setOnInsert': {'cycle': cycle, 'status': 'pending', 'lease-until': None, 'attempts': 0, 'created': now}},
+                upsert=True
+            )
+            for url in urls
+        ], ordered=False)
+        return result.upserted_count
+
+    def claim(self, worker):
+        """Lease the oldest available job, None if there is none."""
+        now = datetime.now()
+        return self.collection.find_one_and_update(
+            {'status': {'$ne': 'done'}, '$or': [{'lease-until': None}, {'lease-until': {'$lt': now}}]},
+            {'$set': {'status': 'leased', 'lease-until': now + self.lease, 'worker': worker}, '$inc': {'attempts': 1}},
+            sort=[('_id', 1)]
+        ) # as it was before the claim, attempts not counting this one
+
+    def finish(self, job, result):
+        self.collection.update_one(
+            {'_id': job['_id']},
+            {'$set': {'status': 'done', 'result': result, 'lease-until': None, 'finished': datetime.now()}}
+        )
+
+    def release(self, job):
+        # the worker failed on it, let anyone take it again
+        self.collection.update_one({'_id': job['_id']}, {'$set': {'status': 'pending', 'lease-until': None}})
+
+    def open_cycles(self) -> list:
+        return list(self.cycles.find({'status': 'running'}).sort('created', 1))
+
+    def remaining(self, cycle) -> int:
+        return self.collection.count_documents({'cycle': cycle, 'status': {'$ne': 'done'}})
+
+    def results(self, cycle) -> list:
+        return list(self.collection.find({'cycle': cycle}, {'_id': 0, 'kind': 1, 'url': 1, 'result': 1}))
+
+    def close_cycle(self, cycle):
+        # reported, the jobs aren't needed anymore
+        self.cycles.update_one({'_id': cycle}, {'$set': {'status': 'reported', 'reported': datetime.now()}})
+        self.collection.delete_many({'cycle': cycle})
+
+    def drop_cycle(self, cycle):
+        self.cycles.delete_one({'_id': cycle})
+
+
+def connect():
+    client = MongoClient(db_client)
+    database = NotifyDB(client, dbname)
+    pending_db = PoppingDB(client, dbname, database)
+    return client, database, pending_db
+
+
+def schedule_cycle(queue : JobQueue, db : NotifyDB, pending_db : PoppingDB):
+    # one tick : due sites from what's stored (last-search & last change), so nothing is lost on restart
+    scheduler = SiteScheduler()
+    scheduler.sync(db.get_many())
+    db.flush() # fingerprints backfilled by get_many
+    due = sorted(scheduler.pop_due())
+    # claimed from pending until the add job acks / releases them
+    adds = list(pending_db)
+
+    cycle = queue.new_cycle()
+    count = queue.enqueue(cycle, 'check', due) + queue.enqueue(cycle, 'add', adds)
+    if count == 0:
+        queue.drop_cycle(cycle)
+    else:
+        queue.seal_cycle(cycle)
+    print(f"Cycle {cycle} : {count} jobs queued ({len(due)} due, {len(adds)} pending)")
+    return count
+
+
+def run_scheduler(duration_h_m=(0, 30), running_hours=(5, 23)):
+    client, database, pending_db = connect()
+    queue = JobQueue(client, dbname)
+    queue.seal_unfinished()
+    for next_time in time_iterator(hour_range(*running_hours), duration_h_m):
+        schedule_cycle(queue, database, pending_db)
+        now = datetime.now()
+        print(f"Sleep Until {next_time.strftime('%B %d, %Y - (%I:%M:%S %p)')} -> {(next_time - now).total_seconds()}s")
+        time.sleep((next_time - now).total_seconds())
+
+
+def work(queue : JobQueue, worker, driver, db : NotifyDB, pending_db : PoppingDB, history : HistoryDB, policy, poll_interval=10):
+    # one worker thread, until the process stops
+    from scanner import check_site, ingest, failed_message
+    from snapshots import snapshots
+
+    while True:
+        job = queue.claim(worker)
+        if job is None:
+            # snapshots are on the worker's host, aged out while there's nothing to scan
+            snapshots.prune()
+            time.sleep(poll_interval)
+            continue
+
+        site = job['url']
+        try:
+            if job['attempts'] >= queue.max_attempts:
+                # every worker that took it died or failed
+                print(f"Giving up on {job['kind']} job for {site}")
+                if job['kind'] == 'add':
+                    result = False
+                else:
+                    previous_values = db.get(site, with_content=False)
+                    result = failed_message(site, previous_values, "Scan job failed on every worker", previous_values.get("failures", 0))
+            elif job['kind'] == 'add':
+                result = ingest(site, driver, db, pending_db, history, policy)
+            else:
+                result = check_site(site, db.get(site, with_content=False), driver, db, history, policy)
+            # results visible before the job counts as done
+            db.flush()
+        except ValueError:
+            # site deleted since it was scheduled
+            result = None
+        except Exception as e:
+            print(f"Worker failed on : {site}")
+            print(f"Reason : {e}")
+            queue.release(job)
+            continue
+        queue.finish(job, result)
+
+
+def run_worker(threads=SCAN_WORKERS):
+    # scanning code & browsers are only needed here
+    from scanner import new_driver
+    from browser import BrowserManager, BLOCKED_URLS
+    from policy import ScanPolicy, CircuitBreaker
+    from sessions import SessionStore
+
+    client, database, pending_db = connect()
+    history = HistoryDB(client, dbname)
+    queue = JobQueue(client, dbname)
+    policy = ScanPolicy(CircuitBreaker(client, dbname), DOMAIN_CONCURRENCY, DOMAIN_RATE)
+    worker_name = f"{socket.gethostname()}:{os.getpid()}"
+
+    # one warm browser per thread, captcha cookies shared with the other workers
+    sessions = SessionStore(client, dbname, timedelta(days=SESSION_MAX_DAYS))
+    browsers = [BrowserManager(new_driver, BROWSER_MAX_PAGES, BLOCKED_URLS if BLOCK_RESOURCES else [], sessions) for _ in range(threads)]
+    workers = [
+        Thread(target=work, args=(queue, f"{worker_name}:{i}", browser, database, pending_db, history, policy), daemon=True)
+        for i, browser in enumerate(browsers)
+    ]
+    for worker in workers:
+        worker.start()
+    try:
+        for worker in workers:
+            worker.join()
+    finally:
+        for browser in browsers:
+            browser.stop()
+
+
+def report_cycle(queue : JobQueue, outbox, cycle) -> bool:
+    # digest of a finished cycle, returns if an email was queued
+    from digest import compose_digest
+
+    added, messages = [], []
+    for job in queue.results(cycle):
+        if job['kind'] == 'add':
+            added.append((job['url'], job.get('result')))
+        elif job.get('result') is not None:
+            messages.append(job['result'])
+    messages.sort(key=lambda message : message['url'])
+
+    subject_message, construct_message, has_news = compose_digest(added, messages, PUBLIC_URL or f"http://{get_local_ip()}:{PORT}/")
+    if has_news:
+        outbox.enqueue(sender_email, recipient_email, subject_message, construct_message)
+    queue.close_cycle(cycle)
+    return has_news
+
+
+def run_reporter(poll_interval=60):
+    from email_util import Outbox, OutboxSender
+
+    client = MongoClient(db_client)
+    queue = JobQueue(client, dbname)
+    outbox = Outbox(client, dbname)
+    OutboxSender(outbox, sender_email, app_password, smtp_server=SMTP_HOST, smtp_port=SMTP_PORT, use_tls=SMTP_STARTTLS).start()
+
+    while True:
+        for cycle in queue.open_cycles():
+            if queue.remaining(cycle['_id']) == 0:
+                report_cycle(queue, outbox, cycle['_id'])
+        time.sleep(poll_interval)
+
+
+def run_api():
+    from web import serve
+    serve(PORT)
+
+
+ROLES = {
+    "scheduler" : run_scheduler,
+    "worker" : run_worker,
+    "reporter" : run_reporter,
+    "api" : run_api,
+}
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Run one role of the distributed scanner")
+    arg_parser.add_argument("role", choices=list(ROLES))
+    args = arg_parser.parse_args()
+    ROLES[args.role]()
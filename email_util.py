@@ -1,17 +1,24 @@
 import smtplib
 from email.mime.text import MIMEText
+from datetime import datetime, timedelta
+from threading import Thread, Event
+import time
+
+from pymongo import MongoClient, ReturnDocument
 
 
 def email_server_login(
     sender_em,
-    sender_pass
+    sender_pass,
+    smtp_server = "smtp.gmail.com",
+    smtp_port = 587,
+    use_tls = True
 ):
-    smtp_server = "smtp.gmail.com"
-    smtp_port = 587
-    
-    server = smtplib.SMTP(smtp_server, smtp_port)
-    server.starttls()
-    server.login(sender_em, sender_pass)
+    server = smtplib.SMTP(smtp_server, smtp_port, timeout=30)
+    if use_tls:
+        server.starttls()
+    if sender_pass:
+        server.login(sender_em, sender_pass)
     return server
 
 def compose_msg(
@@ -31,13 +38,168 @@ def send_email(
     sender_pass,
     receiver,
     subject,
-    body
+    body,
+    smtp_server = "smtp.gmail.com",
+    smtp_port = 587,
+    use_tls = True
 ):
     msg = compose_msg(subject, body, sender, receiver)
+    server = None
     try:
-        server = email_server_login(sender, sender_pass)
+        server = email_server_login(sender, sender_pass, smtp_server, smtp_port, use_tls)
         server.sendmail(sender, receiver, msg.as_string())
     except Exception as e:
         print(f"Message : {msg} sending failed with ERROR : {e}")
     finally:
-        server.quit()
\ No newline at end of file
+        # login itself may have failed
+        if server is not None:
+            server.quit()
+
+
+class Outbox:
+    # emails waiting to be sent, kept in mongo so nothing is lost if sending fails or the app stops
+    def __init__(self, client : MongoClient, dbname):
+        self.db = client[dbname]
+        self.collection = self.db['outbox']
+        self.collection.create_index([('status', 1), ('next-attempt', 1)])
+        self.new_message = Event() # wakes up the sender
+
+    def enqueue(self, sender, receiver, subject, body):
+        now = datetime.now()
+        self.collection.insert_one({
+            'from': sender,
+            'to': receiver,
+            'subject': subject,
+            'body': body,
+            'status': 'pending',
+            'attempts': 0,
+            'created': now,
+            'next-attempt': now,
+        })
+        self.new_message.set()
+
+    def claim(self):
+        """Take the next due message, None if there is none."""
+        return self.collection.find_one_and_update(
+            {'status': 'pending', 'next-attempt': {'$lte': datetime.now()}},
+            {'$set': {'status': 'sending'}},
+            sort=[('next-attempt', 1)],
+            return_document=ReturnDocument.AFTER
+        )
+
+    def sent(self, message):
+        self.collection.update_one({'_id': message['_id']}, {'$set': {'status': 'sent', 'sent-date': datetime.now()}})
+
+    def failed(self, message, error, retry_in : timedelta = None):
+        # back to pending for a retry, or failed for good when retry_in is None
+        update = {'status': 'failed', 'last-error': str(error)}
+        if retry_in is not None:
+            update.update({'status': 'pending', 'next-attempt': datetime.now() + retry_in})
+        self.collection.update_one({'_id': message['_id']}, {'$set': update, '$inc': {'attempts': 1}})
+
+    def release_stuck(self):
+        # messages left 'sending' by a process that died
+        self.collection.update_many({'status': 'sending'}, {'$set': {'status': 'pending'}})
+
+
+class OutboxSender(Thread):
+    """
+    Background sender for the outbox, reuses one logged in SMTP session between messages
+    and retries failures with exponential backoff.
+    """
+    def __init__(
+        self,
+        outbox : Outbox,
+        sender,
+        sender_pass,
+        smtp_server = "smtp.gmail.com",
+        smtp_port = 587,
+        use_tls = True,
+        max_attempts = 6,
+        base_backoff : timedelta = timedelta(seconds=30),
+        max_backoff : timedelta = timedelta(hours=1),
+        poll_interval = 60,
+        idle_check_after = 60
+    ):
+        super().__init__(daemon=True)
+        self.outbox = outbox
+        self.sender = sender
+        self.sender_pass = sender_pass
+        self.smtp_server = smtp_server
+        self.smtp_port = smtp_port
+        self.use_tls = use_tls
+        self.max_attempts = max_attempts
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.poll_interval = poll_interval
+        self.idle_check_after = idle_check_after
+
+        self.server = None
+        self.last_used = 0
+        self.stopping = Event()
+
+    def session(self):
+        # logged in session, reconnect if the server dropped it while idle
+        if self.server is not None and time.monotonic() - self.last_used > self.idle_check_after:
+            try:
+                self.server.noop()
+            except smtplib.SMTPException:
+                self.close()
+
+        if self.server is None:
+            self.server = email_server_login(self.sender, self.sender_pass, self.smtp_server, self.smtp_port, self.use_tls)
+        return self.server
+
+    def close(self):
+        if self.server is not None:
+            try:
+                self.server.quit()
+            except smtplib.SMTPException:
+                pass
+            self.server = None
+
+    def backoff(self, attempts) -> timedelta:
+        # attempts failed so far, base_backoff after the first one
+        return min(self.base_backoff * (2 ** (attempts - 1)), self.max_backoff)
+
+    def send(self, message):
+        msg = compose_msg(message['subject'], message['body'], message['from'], message['to'])
+        try:
+            self.session().sendmail(message['from'], message['to'], msg.as_string())
+        except (smtplib.SMTPException, OSError) as e:
+            # session may be broken, next message logs in again
+            self.close()
+            attempts = message['attempts'] + 1
+            retry_in = self.backoff(attempts) if attempts < self.max_attempts else None
+            print(f"Message : {message['subject']} sending failed (attempt {attempts}) with ERROR : {e}")
+            self.outbox.failed(message, e, retry_in)
+            return False
+
+        self.last_used = time.monotonic()
+        self.outbox.sent(message)
+        return True
+
+    def send_due(self):
+        # send everything due now, returns how many were sent
+        count = 0
+        while not self.stopping.is_set():
+            message = self.outbox.claim()
+            if message is None:
+                break
+            count += self.send(message)
+        return count
+
+    def run(self):
+        self.outbox.release_stuck()
+        while not self.stopping.is_set():
+            self.outbox.new_message.clear()
+            try:
+                self.send_due()
+            except Exception as e:
+                print(f"Outbox sender failed with ERROR : {e}")
+            self.outbox.new_message.wait(self.poll_interval)
+        self.close()
+
+    def stop(self):
+        self.stopping.set()
+        self.outbox.new_message.set()
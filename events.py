@@ -0,0 +1,92 @@
+from collections import deque
+from threading import Lock
+import asyncio
+import time
+
+# live updates for the dashboard, streamed by /api/events (server-sent events)
+# scan threads & api handlers publish, every connected browser tab gets its own queue
+# one bus per process, `events` below, like metrics it only sees what its own process does
+#
+#   cycle          {state: start | end, due, pending} / {state: end, checked, added, seconds}
+#   scan           {url, kind: add | check} a scan started
+#   scanned        {url, kind, ok, same} a scan finished
+#   site           {url, title, latest-updated-date, ...} a site was added or changed, no content
+#   site-removed   {url}
+#   pending        {url}
+#   pending-removed {url}
+#   reload         {} too much was missed, fetch the lists again
+
+
+class Subscription:
+    def __init__(self, loop : asyncio.AbstractEventLoop, max_queued):
+        self.loop = loop
+        self.queue = asyncio.Queue(max_queued)
+        self.overflowed = False # a slow client missed events, gets a reload
+
+    def offer(self, item):
+        # on the subscriber's loop
+        try:
+            self.queue.put_nowait(item)
+        except asyncio.QueueFull:
+            self.overflowed = True
+
+
+class EventBus:
+    def __init__(self, history=1000, max_queued=1000):
+        self.lock = Lock()
+        # ids keep growing across restarts, a client reconnecting to a new process gets a reload
+        self.last_id = int(time.time() * 1000)
+        self.recent = deque(maxlen=history) # (id, event, data) replayed to reconnecting clients
+        self.max_queued = max_queued
+        self.subscribers = set()
+
+    def publish(self, event, data):
+        # from any thread
+        with self.lock:
+            self.last_id += 1
+            item = (self.last_id, event, data)
+            self.recent.append(item)
+            subscribers = list(self.subscribers)
+        for subscription in subscribers:
+            try:
+                subscription.loop.call_soon_threadsafe(subscription.offer, item)
+            except RuntimeError:
+                pass # loop closed, unsubscribed soon
+
+    def reload_item(self):
+        # call with the lock held
+        return (self.last_id, "reload", {})
+
+    def subscribe(self, loop, last_id=None) -> tuple[Subscription, list]:
+        """New subscription & what it missed since the event `last_id` (Last-Event-ID header)."""
+        subscription = Subscription(loop, self.max_queued)
+        with self.lock:
+            if last_id is None or last_id == self.last_id:
+                backlog = []
+            elif self.last_id > last_id and self.recent and self.recent[0][0] <= last_id + 1:
+                backlog = [item for item in self.recent if item[0] > last_id]
+            else:
+                # older than what is kept, or from another process
+                backlog = [self.reload_item()]
+            self.subscribers.add(subscription)
+        return subscription, backlog
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            self.subscribers.discard(subscription)
+
+    async def next(self, subscription : Subscription, timeout):
+        """Next event of subscription, None after `timeout` seconds without one."""
+        if subscription.overflowed:
+            subscription.overflowed = False
+            while not subscription.queue.empty():
+                subscription.queue.get_nowait()
+            with self.lock:
+                return self.reload_item()
+        try:
+            return await asyncio.wait_for(subscription.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+
+events = EventBus()
@@ -0,0 +1,73 @@
+import urllib3
+
+# plain http tier, used before falling back to the browser for sites that don't need JS / captcha
+
+USER_AGENT = "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/131.0.0.0 Safari/537.36"
+
+# markers of pages that only a real browser gets through
+CHALLENGE_MARKERS = (
+    b"challenges.cloudflare.com",
+    b"cf-browser-verification",
+    b"cf_chl_opt",
+    b"g-recaptcha",
+    b"h-captcha",
+    b"<title>Just a moment...</title>",
+)
+
+# one retry of a failed connect / read, redirects counted on their own (total would cap them too)
+RETRIES = urllib3.Retry(total=None, connect=1, read=1, redirect=5, raise_on_redirect=False)
+
+# shared by all scan workers, connections are kept alive per host
+http = urllib3.PoolManager(
+    num_pools=50,
+    maxsize=10,
+    headers={"User-Agent": USER_AGENT, "Accept": "text/html,application/xhtml+xml"},
+    timeout=urllib3.Timeout(connect=5, read=20),
+    retries=RETRIES,
+)
+
+
+def conditional_get(url, etag=None, last_modified=None) -> dict:
+    # GET with the stored validators, a 304 means the page didn't change since it was stored
+    headers = {}
+    if etag:
+        headers["If-None-Match"] = etag
+    if last_modified:
+        headers["If-Modified-Since"] = last_modified
+
+    # retries given again : the urllib3 of poetry.lock (2.3) follows redirects with the default Retry(3), not the pool's
+    response = http.request("GET", url, headers=headers, retries=RETRIES)
+    return {
+        "status" : response.status,
+        "html" : response.data,
+        "content-type" : response.headers.get("Content-Type", ""),
+        "etag" : response.headers.get("ETag"),
+        "last-modified" : response.headers.get("Last-Modified"),
+    }
+
+
+def try_conditional_get(url, etag=None, last_modified=None):
+    # same as conditional_get, but None on connection errors so the browser can take over
+    try:
+        return conditional_get(url, etag, last_modified)
+    except urllib3.exceptions.HTTPError as e:
+        print(f"HTTP fetch on site : {url} Failed")
+        print(f"Reason : {e}")
+        return None
+
+
+def needs_browser(response) -> bool:
+    # if the plain http response can't be used as the page
+    if response is None or response["status"] != 200:
+        return True
+    if "html" not in response["content-type"]:
+        return True
+    return any(marker in response["html"] for marker in CHALLENGE_MARKERS)
+
+
+def validators(response) -> dict:
+    # fields stored on the site for the next conditional GET
+    return {
+        "etag" : response["etag"],
+        "last-modified" : response["last-modified"],
+    }
@@ -66,6 +66,7 @@ const SiteManager = () => {
   const [pendingSites, setPendingSites] = useState([]);
   const [userAddingSite, setUserAddingSite] = useState({ url: "" });
   const [sortNotificationByLatest, setSortNotificationByLatest] = useState(false);
+  const [scanProgress, setScanProgress] = useState(null); // { total, done, current } while a cycle runs
 
   const fetchSites = async (route) => {
     const setter = {
@@ -74,8 +75,20 @@ const SiteManager = () => {
     }[route];
 
     try {
-      const response = await axios.get(`/api/${route}`);
-      setter(response.data);
+      if (route === "notification") {
+        // paginated, follow the cursor until the last page
+        let sites = [];
+        let after = null;
+        do {
+          const response = await axios.get(`/api/${route}`, { params: { limit: 500, after } });
+          sites = sites.concat(response.data.items);
+          after = response.data.next;
+        } while (after);
+        setter(sites);
+      } else {
+        const response = await axios.get(`/api/${route}`);
+        setter(response.data);
+      }
     } catch (error) {
       console.error(`Error fetching sites: ${route}`, error);
     }
@@ -86,18 +99,80 @@ const SiteManager = () => {
     await fetchSites("pending");
   };
 
-  // Refresh every 30 minutes
+  // Load once, then apply the server's events (api/events).
+  // Still polled every 30 minutes : events of other processes (distributed workers) never reach this stream
   useEffect(() => {
     refresh();
-    const interval = setInterval(refresh, 30 * 60 * 1000); 
-    return () => clearInterval(interval);
+    let interval = setInterval(refresh, 30 * 60 * 1000);
+    const poll = (every) => {
+      clearInterval(interval);
+      interval = setInterval(refresh, every);
+    };
+
+    const source = new EventSource("api/events");
+    let lost = false;
+    source.onerror = () => {
+      lost = true;
+      if (source.readyState === EventSource.CLOSED) {
+        // gave up (proxy without streaming, error response), polling only
+        poll(60 * 1000);
+      }
+    };
+    source.onopen = () => {
+      if (lost) {
+        // the server may have restarted & lost what was missed
+        lost = false;
+        refresh();
+      }
+    };
+    const on = (event, handler) =>
+      source.addEventListener(event, (e) => handler(JSON.parse(e.data)));
+
+    on("site", (site) =>
+      setNotificationSites((sites) => {
+        const index = sites.findIndex((s) => s.url === site.url);
+        if (index === -1) {
+          // same url order as the api
+          return [...sites, site].sort((a, b) => (a.url < b.url ? -1 : a.url > b.url ? 1 : 0));
+        }
+        const updated = [...sites];
+        updated[index] = { ...sites[index], ...site };
+        return updated;
+      })
+    );
+    on("site-removed", ({ url }) =>
+      setNotificationSites((sites) => sites.filter((s) => s.url !== url))
+    );
+    on("pending", ({ url }) =>
+      setPendingSites((sites) => (sites.includes(url) ? sites : [...sites, url]))
+    );
+    on("pending-removed", ({ url }) =>
+      setPendingSites((sites) => sites.filter((s) => s !== url))
+    );
+    on("reload", refresh);
+
+    on("cycle", (cycle) =>
+      setScanProgress(
+        cycle.state === "start" ? { total: cycle.due + cycle.pending, done: 0, current: null } : null
+      )
+    );
+    on("scan", ({ url }) =>
+      setScanProgress((progress) => progress && { ...progress, current: url })
+    );
+    on("scanned", () =>
+      setScanProgress((progress) => progress && { ...progress, done: progress.done + 1 })
+    );
+
+    return () => {
+      source.close();
+      clearInterval(interval);
+    };
   }, []);
 
   const addSite = async () => {
     try {
       await axios.post("api/pending", userAddingSite);
       setUserAddingSite({ url: "" });
-      await fetchSites("pending");
     } catch (error) {
       console.error("Error adding site:", error);
     }
@@ -110,7 +185,6 @@ const SiteManager = () => {
     const encodedUrl = encodeURIComponent(url);
     try {
       await axios.delete(`api/${route}/${encodedUrl}`);
-      await fetchSites(route);
     } catch (error) {
       console.error("Error deleting site:", error);
     }
@@ -148,6 +222,13 @@ const SiteManager = () => {
         </Button>
       </Box>
 
+      {scanProgress && (
+        <Typography variant="body2" color="text.secondary" mb={2}>
+          Scanning {scanProgress.done} / {scanProgress.total}
+          {scanProgress.current && ` : ${scanProgress.current}`}
+        </Typography>
+      )}
+
       <Typography variant="h5">Notification Sites</Typography>
       <TableContainer component={Paper}>
         <Table>
@@ -0,0 +1,94 @@
+from functools import lru_cache
+import re
+from urllib.parse import urlsplit, urlunsplit, urljoin, parse_qsl, urlencode
+
+# link handling for internal-link extraction
+# base urls are parsed once, links are canonicalized so /a, /a/ & /a?utm_source=x are the same link
+# and a site's links are kept as a sorted unique list (its link index) so changes are a merge diff
+
+TRACKING_PARAMS = {"fbclid", "gclid", "dclid", "msclkid", "mc_cid", "mc_eid", "igshid", "_ga", "_gl", "yclid"}
+TRACKING_PREFIXES = ("utm_",)
+DEFAULT_PORTS = {"http": 80, "https": 443}
+# absolute path with nothing for urljoin to resolve or clean, most internal links
+SIMPLE_PATH = re.compile(r"/(?!/)[^?#\t\r\n]*")
+
+
+@lru_cache(maxsize=1024)
+def split_base(base_url):
+    return urlsplit(base_url)
+
+
+def is_external_link(link, base_url) -> bool:
+    # same answer as comparing scheme & netloc of urljoin(base_url, link) with base_url, without the join
+    base = split_base(base_url)
+    parts = urlsplit(link)
+    if parts.scheme and parts.scheme != base.scheme:
+        return True
+    # relative links keep the netloc of the base
+    return bool(parts.netloc) and parts.netloc != base.netloc
+
+
+def is_tracking_param(name) -> bool:
+    return name.lower() in TRACKING_PARAMS or name.lower().startswith(TRACKING_PREFIXES)
+
+
+@lru_cache(maxsize=1024)
+def canonical_origin(base_url) -> str:
+    return canonicalize(urlunsplit(split_base(base_url)[:2] + ("/", "", "")), base_url)[:-1]
+
+
+def canonicalize(link, base_url) -> str:
+    # absolute url without fragment, tracking params, default port or trailing slash
+    if SIMPLE_PATH.fullmatch(link) and "/." not in link:
+        return canonical_origin(base_url) + (link.rstrip("/") or "/")
+
+    parts = urlsplit(urljoin(base_url, link))
+
+    try:
+        host = parts.hostname or ""
+        netloc = f"[{host}]" if ":" in host else host
+        if parts.port is not None and parts.port != DEFAULT_PORTS.get(parts.scheme):
+            netloc += f":{parts.port}"
+    except ValueError:
+        # invalid port, leave it as it is
+        netloc = parts.netloc
+
+    path = parts.path.rstrip("/") or "/"
+
+    query = parts.query
+    if query:
+        params = parse_qsl(query, keep_blank_values=True)
+        kept = [(name, value) for name, value in params if not is_tracking_param(name)]
+        if len(kept) != len(params):
+            query = urlencode(kept)
+
+    return urlunsplit((parts.scheme, netloc, path, query, ""))
+
+
+def link_index(links, base_url) -> list:
+    # sorted unique canonical links
+    return sorted({canonicalize(link, base_url) for link in set(links)})
+
+
+def diff_sorted(previous : list, now : list) -> tuple[list, list]:
+    # (added, removed) between two sorted unique lists, in one merge pass
+    added, removed = [], []
+    i, j = 0, 0
+    while i < len(previous) and j < len(now):
+        if previous[i] == now[j]:
+            i += 1
+            j += 1
+        elif previous[i] < now[j]:
+            removed.append(previous[i])
+            i += 1
+        else:
+            added.append(now[j])
+            j += 1
+    removed.extend(previous[i:])
+    added.extend(now[j:])
+    return added, removed
+
+
+def diff_links(previous, now : list, base_url) -> tuple[list, list]:
+    # previous may be stored before links were canonicalized, indexing it again is a no-op otherwise
+    return diff_sorted(link_index(previous, base_url), now)
@@ -1,181 +1,183 @@
 # from selenium import webdriver
-from seleniumbase import Driver
-from bs4 import BeautifulSoup
 from pymongo import MongoClient
 
-from utils import time_difference_description, get_local_ip, time_iterator, hour_range
-from email_util import send_email
-from algorithm import comparer, apply_extraction, quick_extract
-from database import NotifyDB, PoppingDB
-from web import WebApp
-from fastapi.staticfiles import StaticFiles
-
-from datetime import datetime
+from utils import get_local_ip, time_iterator, hour_range
+from email_util import Outbox, OutboxSender, send_email
+from database import NotifyDB, PoppingDB, HistoryDB
+from scan_pool import run_pool
+from scanner import new_driver, ingest, check_site
+from digest import compose_digest
+from scheduler import SiteScheduler, last_change
+from metrics import metrics
+from events import events
+from snapshots import snapshots
+from browser import BrowserPool, BLOCKED_URLS
+from policy import ScanPolicy, CircuitBreaker
+from sessions import SessionStore
+from storage import open_storage
+from config import (
+    sender_email, app_password, recipient_email, db_client, dbname, PORT, PUBLIC_URL, SCAN_WORKERS,
+    BROWSER_MAX_PAGES, BLOCK_RESOURCES, DOMAIN_CONCURRENCY, DOMAIN_RATE, SMTP_HOST, SMTP_PORT, SMTP_STARTTLS,
+    SESSION_MAX_DAYS
+)
+
+from datetime import datetime, timedelta
 import atexit
 
-import uvicorn
 from threading import Thread
 
-
-from dotenv import load_dotenv
-import os
 import time
-load_dotenv()
-
-sender_email = os.getenv("SENDER_EMAIL")
-app_password = os.getenv("APP_PASSWORD")
-recipient_email = os.getenv("RECIPIENT_EMAIL")
-db_client = os.getenv("DB_CLIENT")
-dbname = os.getenv("DB_NAME")
-PORT = 3000
-
-
-client = MongoClient(db_client)  
-database = NotifyDB(client, dbname)
-pending_db = PoppingDB(client,dbname, database)
-webapp = WebApp(database, pending_db)
-
-
-
-def scan_site(url, driver : Driver, extraction_fn = None):
-    driver.uc_open(url)
-    driver.uc_gui_click_captcha()
-    current_page = driver.execute_script("return document.documentElement.outerHTML;")
-
-    soup = BeautifulSoup(current_page, 'html.parser')
-
-    # this operation is time consuming & it's unlikely to change
-    if extraction_fn is None:
-        result = apply_extraction(url, soup.body) # NOTE body use avoid script tags etc..
-    else:
-        result = extraction_fn(url, soup.body)
-
-    return soup, result
 
-
-def run(db : NotifyDB, pending_db : PoppingDB):
+# everything in one process : scan loop, web & email. distributed.py runs the same as separate roles
+# started through cli.py (scan-once / daemon), importing this module connects to nothing
+
+
+class Services:
+    # what the scan loop uses, one per process
+    def __init__(self):
+        self.client = open_storage(db_client)
+        # history, outbox & circuit breaker need mongo, with sqlite / memory (see storage.py) they're off
+        # and the digest is sent right away
+        is_mongo = isinstance(self.client, MongoClient)
+        self.database = NotifyDB(self.client, dbname)
+        self.pending_db = PoppingDB(self.client, dbname, self.database)
+        self.history_db = HistoryDB(self.client, dbname) if is_mongo else None
+        self.outbox = Outbox(self.client, dbname) if is_mongo else None
+        self.policy = ScanPolicy(CircuitBreaker(self.client, dbname) if is_mongo else None, DOMAIN_CONCURRENCY, DOMAIN_RATE)
+        # cookies of passed captchas, kept across runs
+        self.sessions = SessionStore(self.client, dbname, timedelta(days=SESSION_MAX_DAYS))
+        # warm between cycles, see browser.py
+        self.browsers = BrowserPool(new_driver, BROWSER_MAX_PAGES, BLOCKED_URLS if BLOCK_RESOURCES else [], self.sessions)
+
+    def outbox_sender(self) -> OutboxSender:
+        return OutboxSender(
+            self.outbox,
+            sender_email,
+            app_password,
+            smtp_server=SMTP_HOST,
+            smtp_port=SMTP_PORT,
+            use_tls=SMTP_STARTTLS
+        )
+
+    def close(self):
+        self.browsers.close()
+
+
+def run(services : Services, workers : int = SCAN_WORKERS, scheduler : SiteScheduler = None):
     # global last_sent
-    # driver will live and die in the function
-    # driver = webdriver.Chrome()
-    driver = Driver(uc=True)
-    driver.implicitly_wait(10)
-
-    messages = []
-    construct_message = ""
-    all_current_stored_sites = sorted(db.get_all_links())
+    # drivers are leased from the browsers pool, one per worker, & stay warm for the next cycle
+    # without scheduler every stored site is checked & the digest is always sent,
+    # with it only the due sites are checked & the email only goes out if something changed
+
+    db, pending_db, history, policy, outbox = services.database, services.pending_db, services.history_db, services.policy, services.outbox
+
+    cycle_start = time.perf_counter()
+    # every stored site in one query, before the pending ones are added
+    with metrics.timer("mongo_get_many"):
+        stored_sites = db.get_many()
+    if scheduler is None:
+        all_current_stored_sites = sorted(stored_sites)
+    else:
+        scheduler.sync(stored_sites)
+        all_current_stored_sites = sorted(scheduler.pop_due())
+
+    # live progress on the dashboard, see events.py
+    events.publish("cycle", {"state": "start", "due": len(all_current_stored_sites), "pending": len(pending_db.get_all_url())})
+
+    def add(site, driver):
+        events.publish("scan", {"url": site, "kind": "add"})
+        is_added = ingest(site, driver, db, pending_db, history, policy)
+        events.publish("scanned", {"url": site, "kind": "add", "ok": is_added, "same": False})
+        if is_added:
+            events.publish("pending-removed", {"url": site})
+            events.publish("site", db.get(site, with_content=False))
+        return is_added
+
+    def check(site, driver):
+        events.publish("scan", {"url": site, "kind": "check"})
+        message = check_site(site, stored_sites[site], driver, db, history, policy)
+        events.publish("scanned", {"url": site, "kind": "check", "ok": message["error"] is None, "same": message["same"]})
+        if not message["same"]:
+            # stored at the flush, the dashboard can show it now
+            events.publish("site", {"url": site, "title": message["title"], "latest-updated-date": datetime.now()})
+        return message
 
     # checking if pending DB has anything
-    new_counter = 0
-    for site in pending_db:
-        print(f"Adding {site=}")
-        new_counter += 1
-        for tries in range(1, 3+1):
-            try:
-                soup, current_values = scan_site(site, driver)
-                title = soup.title.text
-                
-            except Exception as e:
-                driver.refresh()
-                print(f"Attempt {tries} on adding site : {site} Failed")
-                print(f"Reason : {e}")
-                continue
-
-            db.post(site, title, current_values)
-            construct_message += f"Site : {site} Added\n\n"
-            break
-
-
-    for site in all_current_stored_sites:
-        for tries in range(1, 3+1): # 3 tries
-            try:
-                previous_values = db.get(site)
-                previous_values_content = previous_values["latest-search-content"]
-
-                extraction_function = quick_extract(previous_values_content[0])
-
-                soup, current_values = scan_site(site, driver, extraction_function)
-                is_same = comparer(previous_values_content[0], current_values[0])
-                title = soup.title.text
-            except Exception as e:
-                driver.refresh()
-                print(f"Attempt {tries} on site : {site} Failed")
-                print(f"Reason : {e}")
-                continue
-
-            # Db
-            db.put(site) if is_same else db.put(site, title, current_values)
-            # message info gathering
-            messages.append({
-                "same" : is_same,
-                "url" : site,
-                "title" : title,
-                "latest_update" : previous_values["latest-updated-date"]
-            })
-            break
-            
-
-    driver.quit()
-
-    
-    update_counter = 0
-
-
-    for message in messages:
-        same = message["same"]
-        title = " ".join(message['title'].split()) # pretty only at output
-        update_counter += not(same)
-        
-        update_msg = f"--- Updated {time_difference_description(message['latest_update'])}" if message['latest_update'] else "Never - Updated"
-        update_msg = update_msg if same else "--- Updated now"
-        update_msg += "\n"
-
-        composed_message = f'<p><a href="{message["url"]}" target="_blank">{title}</a></p>\n{update_msg}\n'
-
-        
-
-        if same:
-            # append
-            construct_message += composed_message
-        else:
-            # prepend if updated
-            construct_message = composed_message + construct_message
-
-    hosting_address = f"http://{get_local_ip()}:{PORT}/"
-    construct_message += f'<p> Local Address if @ home  <a href="{hosting_address}" target="_blank"> {hosting_address} </a> </p> \n'
-
-
-    first_string = f"Updates : {update_counter}"
-
-    if new_counter > 0:
-        first_string += f" & {new_counter} New Sites Added"
-
-    subject_message = f"{first_string} @ {datetime.now().strftime('%B %d, %Y - (%I:%M %p)')}"
-
-    send_email(sender_email, app_password, recipient_email, subject_message,construct_message)
-
-
-def run_web():
-    uvicorn.run(webapp, host="0.0.0.0", port=PORT)
-
-
-
-if __name__ == "__main__":
-    # chromedriver_autoinstaller.install()
-    webapp.mount("/", StaticFiles(directory="static",html=True), name="static")
-
-
-    Thread(target=run_web, daemon=True).start()
+    added = run_pool(pending_db, add, services.browsers.lease, workers)
+
+    checked = run_pool(all_current_stored_sites, check, services.browsers.lease, workers)
+    with metrics.timer("mongo_flush"):
+        db.flush()
+    snapshots.prune()
+    cycle_seconds = time.perf_counter() - cycle_start
+    metrics.observe("cycle", cycle_seconds)
+    events.publish("cycle", {"state": "end", "checked": len(checked), "added": sum(1 for _, is_added in added if is_added), "seconds": cycle_seconds})
+    # keep the digest in url order regardless of which worker finished first
+    messages = [message for _, message in sorted(checked, key=lambda r : r[0]) if message is not None]
+
+    if scheduler is not None:
+        now = datetime.now()
+        for site, message in checked:
+            if message is None or message["error"] is not None:
+                # failed, try again soon
+                scheduler.schedule(site, now, now)
+            else:
+                scheduler.schedule(site, now, last_change(stored_sites[site]) if message["same"] else now)
+
+    subject_message, construct_message, has_news = compose_digest(added, messages, PUBLIC_URL or f"http://{get_local_ip()}:{PORT}/")
+    if scheduler is not None and not has_news:
+        return
+
+    if outbox is None:
+        Thread(
+            target=send_email,
+            args=(sender_email, app_password, recipient_email, subject_message, construct_message),
+            kwargs={"smtp_server": SMTP_HOST, "smtp_port": SMTP_PORT, "use_tls": SMTP_STARTTLS}
+        ).start() # not a daemon, scan-once waits for it before exiting
+        return
+    # sent in the background by OutboxSender, never blocks the scan loop
+    outbox.enqueue(sender_email, recipient_email, subject_message, construct_message)
+
+
+def scan_once(workers : int = SCAN_WORKERS):
+    # one cycle over every site, the digest is sent before returning
+    services = Services()
+    try:
+        run(services, workers)
+        if services.outbox is not None:
+            sender = services.outbox_sender()
+            sender.send_due()
+            sender.close()
+    finally:
+        services.close()
+
+
+def daemon(running_hours=(5, 23), duration_h_m=(0, 30)):
+    # web, email & the scan loop, every tick only the sites due get checked
+    from web import WebApp, serve_app
+
+    services = Services()
+    webapp = WebApp(services.database, services.pending_db, services.history_db)
+    Thread(target=serve_app, args=(webapp, PORT), daemon=True).start()
+    if services.outbox is not None:
+        services.outbox_sender().start()
 
     atexit.register(lambda : print('Application is ending!'))
+    atexit.register(services.close)
 
-
-    running_start_time = 5 # 5 AM
-    running_end_time = 23 # 11 PM
-    duration_h_m = (3, 0) # every 3 hrs
-    for next_time in time_iterator(hour_range(running_start_time, running_end_time), duration_h_m):
-        run(database, pending_db)
+    scheduler = SiteScheduler()
+    for next_time in time_iterator(hour_range(*running_hours), duration_h_m):
+        run(services, scheduler=scheduler)
 
         now = datetime.now()
+        next_due = scheduler.next_due()
         print(f"It's Currently : {datetime.now().strftime('%B %d, %Y - (%I:%M:%S %p)')}")
+        if next_due is not None:
+            print(f"Next site due @ {next_due.strftime('%B %d, %Y - (%I:%M:%S %p)')}")
         print(f"Sleep Until {next_time.strftime('%B %d, %Y - (%I:%M:%S %p)')} -> {(next_time - now).total_seconds()}s")
-        time.sleep( (next_time - now).total_seconds() )
\ No newline at end of file
+        time.sleep( (next_time - now).total_seconds() )
+
+
+if __name__ == "__main__":
+    # same as python cli.py daemon
+    daemon()
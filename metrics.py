@@ -0,0 +1,159 @@
+from bisect import bisect_left
+from contextlib import contextmanager
+from threading import Lock
+import time
+
+# timings of the scan hot path, kept in memory as histograms & served by /api/metrics (prometheus text format)
+# one registry per process, `metrics` below, every scan thread writes to it
+
+STAGE_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800) # long ones for whole cycles
+SIZE_BUCKETS = (10_000, 50_000, 100_000, 250_000, 500_000, 1_000_000, 2_500_000, 5_000_000, 10_000_000)
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1) # per bucket, last one is +Inf, cumulated when rendered
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def render(self, name, labels : str) -> list[str]:
+        lines, cumulative = [], 0
+        for bound, count in zip(self.buckets + ("+Inf",), self.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{labels}{"," if labels else ""}le="{bound}"}} {cumulative}')
+        labels = f"{{{labels}}}" if labels else ""
+        lines.append(f'{name}_sum{labels} {self.sum}')
+        lines.append(f'{name}_count{labels} {self.count}')
+        return lines
+
+
+class SiteStats:
+    # per site view, stage -> [count, total, max, last] seconds
+    def __init__(self):
+        self.stages = {}
+        self.retries = 0
+        self.failures = 0
+        self.page_bytes = None
+
+    def observe(self, stage, seconds):
+        stats = self.stages.setdefault(stage, [0, 0, 0, 0])
+        stats[0] += 1
+        stats[1] += seconds
+        stats[2] = max(stats[2], seconds)
+        stats[3] = seconds
+
+    def mean(self, stage) -> float:
+        count, total, _, _ = self.stages[stage]
+        return total / count
+
+
+class Metrics:
+    def __init__(self):
+        self.lock = Lock()
+        self.stage_seconds = {} # stage -> Histogram
+        self.page_bytes = Histogram(SIZE_BUCKETS)
+        self.retries = {} # kind (add / check) -> count
+        self.failures = {} # kind -> sites given up on after every try
+        self.sites = {} # url -> SiteStats
+
+    def site(self, url) -> SiteStats:
+        # call with the lock held
+        if url not in self.sites:
+            self.sites[url] = SiteStats()
+        return self.sites[url]
+
+    def observe(self, stage, seconds, url=None):
+        with self.lock:
+            if stage not in self.stage_seconds:
+                self.stage_seconds[stage] = Histogram(STAGE_BUCKETS)
+            self.stage_seconds[stage].observe(seconds)
+            if url is not None:
+                self.site(url).observe(stage, seconds)
+
+    @contextmanager
+    def timer(self, stage, url=None):
+        # time the block, failures included (a timing out uc_open is what we want to see)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start, url)
+
+    def page_size(self, url, size):
+        with self.lock:
+            self.page_bytes.observe(size)
+            self.site(url).page_bytes = size
+
+    def retry(self, url, kind):
+        with self.lock:
+            self.retries[kind] = self.retries.get(kind, 0) + 1
+            self.site(url).retries += 1
+
+    def failure(self, url, kind):
+        with self.lock:
+            self.failures[kind] = self.failures.get(kind, 0) + 1
+            self.site(url).failures += 1
+
+    def forget(self, url):
+        # site deleted, the aggregated histograms keep its past timings
+        with self.lock:
+            self.sites.pop(url, None)
+
+    def render(self) -> str:
+        """Everything in the prometheus text exposition format."""
+        with self.lock:
+            lines = [
+                "# HELP scan_stage_seconds Duration of each stage of a site scan.",
+                "# TYPE scan_stage_seconds histogram",
+            ]
+            for stage, histogram in sorted(self.stage_seconds.items()):
+                lines += histogram.render("scan_stage_seconds", f'stage="{stage}"')
+
+            lines += [
+                "# HELP scan_page_bytes Size of the loaded pages.",
+                "# TYPE scan_page_bytes histogram",
+            ]
+            lines += self.page_bytes.render("scan_page_bytes", "")
+
+            lines += [
+                "# HELP scan_retries_total Failed attempts that were tried again.",
+                "# TYPE scan_retries_total counter",
+            ]
+            lines += [f'scan_retries_total{{kind="{kind}"}} {count}' for kind, count in sorted(self.retries.items())]
+
+            lines += [
+                "# HELP scan_failures_total Sites given up on after every attempt failed.",
+                "# TYPE scan_failures_total counter",
+            ]
+            lines += [f'scan_failures_total{{kind="{kind}"}} {count}' for kind, count in sorted(self.failures.items())]
+        return "\n".join(lines) + "\n"
+
+    def slowest(self, limit=20) -> list[dict]:
+        """Sites by their mean scan time, each with its stages slowest first."""
+        with self.lock:
+            view = []
+            for url, stats in self.sites.items():
+                stages = [
+                    {"stage": stage, "mean_s": stats.mean(stage), "max_s": max_s, "last_s": last_s, "count": count}
+                    for stage, (count, _, max_s, last_s) in stats.stages.items()
+                ]
+                stages.sort(key=lambda s : s["mean_s"], reverse=True)
+                view.append({
+                    "url": url,
+                    "total_mean_s": sum(s["mean_s"] for s in stages),
+                    "retries": stats.retries,
+                    "failures": stats.failures,
+                    "page_bytes": stats.page_bytes,
+                    "stages": stages,
+                })
+        view.sort(key=lambda s : s["total_mean_s"], reverse=True)
+        return view[:limit]
+
+
+metrics = Metrics()
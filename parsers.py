@@ -0,0 +1,45 @@
+from bs4 import BeautifulSoup
+import importlib.util
+import os
+
+# html parser backends for scan_site, the extraction in analysis.py walks any of them
+# selectolax (lexbor) > lxml > html.parser, the fastest one installed is used unless HTML_PARSER pins one
+
+try:
+    from selectolax.lexbor import LexborHTMLParser
+except ImportError:
+    LexborHTMLParser = None
+
+# only used through BeautifulSoup
+has_lxml = importlib.util.find_spec("lxml") is not None
+
+
+def available_parsers() -> list[str]:
+    parsers = []
+    if LexborHTMLParser is not None:
+        parsers.append("selectolax")
+    if has_lxml:
+        parsers.append("lxml")
+    parsers.append("html.parser") # always there, fallback
+    return parsers
+
+
+def default_parser() -> str:
+    pinned = os.getenv("HTML_PARSER")
+    if pinned:
+        assert pinned in available_parsers(), f"HTML_PARSER={pinned} is not installed, available : {available_parsers()}"
+        return pinned
+    return available_parsers()[0]
+
+
+def parse_page(page, parser : str = None) -> tuple:
+    # -> (title or None, body node), page can be str or bytes
+    parser = parser or default_parser()
+
+    if parser == "selectolax":
+        tree = LexborHTMLParser(page)
+        title = tree.css_first("title")
+        return (title.text() if title is not None else None), tree.body
+
+    soup = BeautifulSoup(page, parser)
+    return (soup.title.text if soup.title is not None else None), soup.body
@@ -0,0 +1,167 @@
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from threading import Lock, BoundedSemaphore
+from urllib.parse import urlsplit
+import random
+import time
+
+from pymongo import MongoClient
+
+# how hard sites get scanned: per domain concurrency & rate, backoff between tries
+# and a circuit breaker that skips a domain for a while after repeated failures
+
+
+def domain_of(url) -> str:
+    return (urlsplit(url).hostname or url).lower()
+
+
+class TokenBucket:
+    # `rate` tokens per second up to `burst`, acquire waits for one
+    def __init__(self, rate : float, burst : int = 1):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.lock = Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class CircuitBreaker:
+    """
+    Per domain state in the 'circuits' collection, survives restarts.
+    After `threshold` sites of a domain fail in a row the domain is skipped for a cooldown,
+    doubled every time it opens again (up to max_cooldown). Once it's over one site is let
+    through as a trial, its result closes or reopens the circuit.
+    """
+    def __init__(
+        self,
+        client : MongoClient,
+        dbname,
+        threshold = 3,
+        cooldown : timedelta = timedelta(hours=1),
+        max_cooldown : timedelta = timedelta(days=1)
+    ):
+        self.db = client[dbname]
+        self.collection = self.db['circuits']
+        self.collection.create_index('domain', unique=True)
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+
+        self.lock = Lock()
+        self.circuits = {doc['domain'] : doc for doc in self.collection.find({}, {'_id': 0})}
+        self.trials = set() # domains with a trial running
+
+    def save(self, circuit):
+        self.collection.update_one({'domain': circuit['domain']}, {'$set': circuit}, upsert=True)
+
+    def circuit(self, domain) -> dict:
+        # call with the lock held
+        if domain not in self.circuits:
+            self.circuits[domain] = {'domain': domain, 'failures': 0, 'opened': 0, 'open-until': None, 'last-error': None}
+        return self.circuits[domain]
+
+    def open_until(self, url):
+        """When the domain of url can be scanned again, None if it can now (may start a trial)."""
+        domain = domain_of(url)
+        with self.lock:
+            circuit = self.circuits.get(domain)
+            if circuit is None or circuit['open-until'] is None:
+                return None
+            if circuit['open-until'] > datetime.now() or domain in self.trials:
+                return circuit['open-until']
+            self.trials.add(domain)
+            return None
+
+    def success(self, url):
+        domain = domain_of(url)
+        with self.lock:
+            self.trials.discard(domain)
+            circuit = self.circuits.get(domain)
+            if circuit is None or (circuit['failures'] == 0 and circuit['open-until'] is None):
+                return
+            circuit.update({'failures': 0, 'opened': 0, 'open-until': None, 'last-error': None})
+            self.save(circuit)
+
+    def failure(self, url, error):
+        domain = domain_of(url)
+        with self.lock:
+            self.trials.discard(domain)
+            circuit = self.circuit(domain)
+            circuit['failures'] += 1
+            circuit['last-error'] = str(error)
+            if circuit['failures'] >= self.threshold:
+                cooldown = min(self.cooldown * (2 ** circuit['opened']), self.max_cooldown)
+                circuit['open-until'] = datetime.now() + cooldown
+                circuit['opened'] += 1
+                print(f"Domain {domain} failed {circuit['failures']} times in a row, skipped until {circuit['open-until']}")
+            self.save(circuit)
+
+
+class ScanPolicy:
+    """
+    Wraps every scan attempt: `with policy.slot(url)` keeps at most `max_concurrent` scans per domain
+    & `rate` per second (token bucket), `policy.backoff(tries)` waits before the next try.
+    """
+    def __init__(
+        self,
+        breaker : CircuitBreaker = None,
+        max_concurrent = 1,
+        rate : float = 0.5,
+        burst = 2,
+        base_backoff = 2,
+        max_backoff = 60,
+        tries = 3
+    ):
+        self.breaker = breaker
+        self.max_concurrent = max_concurrent
+        self.rate = rate
+        self.burst = burst
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.tries = tries
+
+        self.lock = Lock()
+        self.semaphores = {} # domain -> BoundedSemaphore
+        self.buckets = {} # domain -> TokenBucket
+
+    def domain_limits(self, url) -> tuple[BoundedSemaphore, TokenBucket]:
+        domain = domain_of(url)
+        with self.lock:
+            if domain not in self.semaphores:
+                self.semaphores[domain] = BoundedSemaphore(self.max_concurrent)
+                self.buckets[domain] = TokenBucket(self.rate, self.burst)
+            return self.semaphores[domain], self.buckets[domain]
+
+    @contextmanager
+    def slot(self, url):
+        semaphore, bucket = self.domain_limits(url)
+        with semaphore:
+            bucket.acquire()
+            yield
+
+    def backoff(self, tries):
+        # full jitter, so sites failing together don't retry together
+        time.sleep(random.uniform(0, min(self.max_backoff, self.base_backoff * (2 ** tries))))
+
+    def open_until(self, url):
+        return None if self.breaker is None else self.breaker.open_until(url)
+
+    def success(self, url):
+        if self.breaker is not None:
+            self.breaker.success(url)
+
+    def failure(self, url, error):
+        if self.breaker is not None:
+            self.breaker.failure(url, error)
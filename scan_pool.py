@@ -0,0 +1,77 @@
+from threading import Thread, Lock
+
+
+class WorkQueue:
+    # thread safe wrapper over any iterable, so lazy iterables (ie PoppingDB) can be shared
+    def __init__(self, items):
+        self.items = iter(items)
+        self.lock = Lock()
+
+    def get(self):
+        # return (True, item) or (False, None) once the queue is drained
+        with self.lock:
+            for item in self.items:
+                return True, item
+            return False, None
+
+
+class LazyDriver:
+    # only starts the real driver on first use, sites served by plain http never pay for a browser
+    def __init__(self, driver_factory):
+        self.driver_factory = driver_factory
+        self.driver = None
+
+    def __getattr__(self, name):
+        if self.driver is None:
+            self.driver = self.driver_factory()
+        return getattr(self.driver, name)
+
+    def refresh(self):
+        if self.driver is not None:
+            self.driver.refresh()
+
+    def quit(self):
+        if self.driver is not None:
+            self.driver.quit()
+            self.driver = None
+
+
+def run_pool(items, task, driver_factory, workers : int = 1) -> list[tuple]:
+    """
+    Run `task(item, driver)` on every item with `workers` threads pulling from one shared queue.
+    Each worker owns its own driver, which is only started once a task uses it.
+    Returns [(item, task result), ...] in completion order.
+    """
+    assert workers > 0, "Need at least 1 worker"
+
+    queue = WorkQueue(items)
+    results = []
+    results_lock = Lock()
+
+    def _worker():
+        driver = LazyDriver(driver_factory)
+        try:
+            while True:
+                has_item, item = queue.get()
+                if not has_item:
+                    break
+
+                try:
+                    result = task(item, driver)
+                except Exception as e:
+                    print(f"Worker failed on : {item}")
+                    print(f"Reason : {e}")
+                    result = None
+
+                with results_lock:
+                    results.append((item, result))
+        finally:
+            driver.quit()
+
+    threads = [Thread(target=_worker, daemon=True) for _ in range(workers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    return results
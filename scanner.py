@@ -0,0 +1,347 @@
+from seleniumbase import Driver
+
+from algorithm import comparer, apply_extraction, extract_by_kind, fingerprint, Extraction
+from analysis import PageStream
+from database import NotifyDB, PoppingDB, HistoryDB
+from fetcher import try_conditional_get, needs_browser, validators
+from parsers import parse_page
+from links import diff_links
+from metrics import metrics
+from policy import ScanPolicy
+from snapshots import snapshots
+from similarity import signature, distance
+from config import BLOCK_RESOURCES, STREAM_PAGES_OVER, STREAM_MEMORY_CAP, CHANGE_THRESHOLD
+
+# scanning one site : load (http tier or browser), extract & compare with what is stored
+# used by main.run (all in one process) & by the workers of distributed.py
+
+default_policy = ScanPolicy() # no circuit breaker, pass one with it
+
+
+# pages up to the size given come back whole, bigger ones are kept in the browser & their length returned,
+# then read whole or in chunks & deleted
+LOAD_PAGE = """
+var page = document.documentElement.outerHTML;
+if (!arguments[0] || page.length <= arguments[0]) return page;
+window.__notifyPage = page;
+return page.length;
+"""
+READ_PAGE = "return window.__notifyPage;"
+READ_CHUNK = """
+var page = window.__notifyPage, start = arguments[0], end = Math.min(start + arguments[1], page.length);
+// a surrogate pair cut in two wouldn't survive the json transfer
+if (end < page.length && end > start + 1) {
+    var code = page.charCodeAt(end - 1);
+    if (code >= 0xD800 && code <= 0xDBFF) end -= 1;
+}
+return [page.substring(start, end), end];
+"""
+DROP_PAGE = "delete window.__notifyPage;"
+STREAM_CHUNK = 1 << 20 # chars per read
+
+
+def load_page(url, driver : Driver, stream_over = 0):
+    # -> the page, or its length when longer than stream_over (kept in the browser for read_page / stream_page)
+    with metrics.timer("uc_open", url):
+        driver.uc_open(url)
+    # no challenge on most pages (or passed before, the browser has the cookies, see sessions.py)
+    if driver.has_captcha():
+        with metrics.timer("captcha", url):
+            driver.uc_gui_click_captcha()
+        driver.save_session(url)
+    with metrics.timer("execute_script", url):
+        return driver.execute_script(LOAD_PAGE, stream_over)
+
+
+def read_page(url, driver : Driver) -> str:
+    with metrics.timer("execute_script", url):
+        return driver.execute_script(READ_PAGE)
+
+
+def extract_page(url, page, extraction_fn = None):
+    # -> (title, result), parsed with the fastest installed backend (see parsers.py)
+    metrics.page_size(url, len(page))
+    with metrics.timer("parse", url):
+        title, body = parse_page(page)
+    if title is None:
+        raise ValueError(f"Page {url} has no title")
+
+    # this operation is time consuming & it's unlikely to change
+    with metrics.timer("extraction", url):
+        if extraction_fn is None:
+            result = apply_extraction(url, body) # NOTE body use avoid script tags etc..
+        else:
+            result = extraction_fn(url, body)
+
+    return title, result
+
+
+def snapshot_kind(extraction_fn):
+    # content kind the scan extracts, kept with the snapshot for reprocessing. None for a new site
+    return getattr(extraction_fn, "kind", None)
+
+
+def keep_snapshot(url, page, source, extraction_fn = None):
+    # for offline reprocessing, a full disk doesn't fail the scan
+    try:
+        with metrics.timer("snapshot", url):
+            snapshots.put(url, page, source, snapshot_kind(extraction_fn))
+    except Exception as e:
+        print(f"Snapshot of {url} failed with ERROR : {e}")
+
+
+def stream_page(url, driver : Driver, length, extraction_fn = None):
+    # -> (title, result) like extract_page, the page is parsed (& snapshotted) chunk by chunk as it's read
+    # from the browser : no whole page nor tree in memory, MemoryCapExceeded if the text & links kept grow too big
+    metrics.page_size(url, length)
+    writer = None
+    try:
+        writer = snapshots.writer(url, "browser", snapshot_kind(extraction_fn))
+    except Exception as e:
+        print(f"Snapshot of {url} failed with ERROR : {e}")
+
+    def chunks():
+        nonlocal writer
+        start = 0
+        while start < length:
+            with metrics.timer("execute_script", url):
+                chunk, start = driver.execute_script(READ_CHUNK, start, STREAM_CHUNK)
+            if writer is not None:
+                try:
+                    writer.write(chunk)
+                except Exception as e:
+                    print(f"Snapshot of {url} failed with ERROR : {e}")
+                    writer.abort()
+                    writer = None
+            yield chunk
+
+    page = PageStream(chunks(), STREAM_MEMORY_CAP)
+    try:
+        with metrics.timer("stream", url):
+            result = (extraction_fn or apply_extraction)(url, page)
+    except BaseException:
+        if writer is not None:
+            writer.abort()
+        raise
+
+    if writer is not None:
+        try:
+            with metrics.timer("snapshot", url):
+                writer.close()
+        except Exception as e:
+            print(f"Snapshot of {url} failed with ERROR : {e}")
+    if page.title is None:
+        raise ValueError(f"Page {url} has no title")
+    return page.title, result
+
+
+def scan_site(url, driver : Driver, extraction_fn = None):
+    page = load_page(url, driver, STREAM_PAGES_OVER)
+    if isinstance(page, int):
+        try:
+            try:
+                return stream_page(url, driver, page, extraction_fn)
+            except Exception as e:
+                # over STREAM_MEMORY_CAP, or the streaming parser failed (ie a bs4 it doesn't know) : the tree path still works
+                print(f"Streaming {url} stopped : {type(e).__name__} {e}, parsing the whole page")
+            page = read_page(url, driver)
+        finally:
+            driver.execute_script(DROP_PAGE)
+    keep_snapshot(url, page, "browser", extraction_fn)
+    return extract_page(url, page, extraction_fn)
+
+
+def probe_http(url, response, browser_values, extraction_fn = None) -> dict:
+    # check if plain http extracts the same as the browser, if so later scans skip the browser
+    if needs_browser(response):
+        return {"needs-browser" : True, "etag" : None, "last-modified" : None}
+
+    try:
+        _, http_values = extract_page(url, response["html"], extraction_fn)
+    except Exception:
+        http_values = [None]
+
+    if not comparer(browser_values[0], http_values[0]):
+        return {"needs-browser" : True, "etag" : None, "last-modified" : None}
+
+    return {"needs-browser" : False, **validators(response)}
+
+
+def load_site(site, previous_values, driver : Driver, extraction_fn):
+    # http tier first, browser only for sites needing it -> (title, values, fetch_info)
+    # title & values are None when the server answered 304 Not Modified
+    needs_js = previous_values.get("needs-browser") # None -> never probed yet
+
+    response = None
+    if needs_js is not True:
+        with metrics.timer("http_get", site):
+            response = try_conditional_get(site, previous_values.get("etag"), previous_values.get("last-modified"))
+
+    if needs_js is False and response is not None and response["status"] == 304:
+        return None, None, None
+
+    if needs_js is False and not needs_browser(response):
+        keep_snapshot(site, response["html"], "http", extraction_fn)
+        title, current_values = extract_page(site, response["html"], extraction_fn)
+        return title, current_values, validators(response)
+
+    title, current_values = scan_site(site, driver, extraction_fn)
+    # full search on the http page, so the probe doesn't move the element pinned in the browser page
+    probe_fn = extract_by_kind(previous_values["content-kind"])
+    fetch_info = None if needs_js is True else probe_http(site, response, current_values, probe_fn)
+    return title, current_values, fetch_info
+
+
+def new_driver() -> Driver:
+    # a fresh browser, used through a BrowserPool / BrowserManager (see browser.py)
+    with metrics.timer("driver_start"):
+        driver = Driver(uc=True, block_images=BLOCK_RESOURCES) # images also off by pref, survives uc reconnects
+        driver.implicitly_wait(10)
+    return driver
+
+
+
+def add_site(site, driver : Driver, db : NotifyDB, history : HistoryDB = None, policy : ScanPolicy = default_policy) -> bool:
+    # scan a site coming from pending & store it, return if it was added
+    print(f"Adding {site=}")
+    error = None
+    for tries in range(1, policy.tries+1):
+        if tries > 1:
+            policy.backoff(tries - 1)
+        try:
+            with policy.slot(site):
+                # pins where the text is for text sites, rescans only read that element
+                extraction = Extraction()
+                title, current_values = scan_site(site, driver, extraction)
+                with metrics.timer("http_get", site):
+                    response = try_conditional_get(site)
+            
+        except Exception as e:
+            error = e
+            driver.refresh()
+            metrics.retry(site, "add")
+            print(f"Attempt {tries} on adding site : {site} Failed")
+            print(f"Reason : {e}")
+            continue
+
+        policy.success(site)
+        fetch_info = probe_http(site, response, current_values)
+        with metrics.timer("mongo", site):
+            db.post(site, title, current_values, fetch_info, extraction.region)
+            if history is not None:
+                history.record(site, None, current_values)
+        return True
+    metrics.failure(site, "add")
+    policy.failure(site, error)
+    return False
+
+
+def ingest(site, driver : Driver, db : NotifyDB, pending : PoppingDB, history : HistoryDB = None, policy : ScanPolicy = default_policy) -> bool:
+    # add a url claimed from pending, ack it once stored, release it to try again next cycle
+    try:
+        added = add_site(site, driver, db, history, policy)
+    except ValueError:
+        # stored meanwhile by another process
+        pending.ack(site)
+        return False
+
+    if added:
+        pending.ack(site)
+    else:
+        pending.release(site)
+    return added
+
+
+def is_minor_change(previous_values, content) -> bool:
+    # content differs from the stored one but not more than the site's threshold : noise, nothing is written
+    # & the stored content stays the one compared with, so small changes adding up still get reported
+    threshold = previous_values.get("change-threshold")
+    threshold = CHANGE_THRESHOLD if threshold is None else threshold
+    if not threshold or "content-signature" not in previous_values:
+        return False
+    return distance(previous_values["content-signature"], signature(content)) <= threshold
+
+
+def failed_message(site, previous_values, error, failures):
+    # digest entry of a site that couldn't be checked, shown with the old title
+    return {
+        "same" : True,
+        "url" : site,
+        "title" : previous_values["title"],
+        "latest_update" : previous_values["latest-updated-date"],
+        "changes" : None,
+        "error" : str(error),
+        "failures" : failures # in a row
+    }
+
+
+def check_site(site, previous_values, driver : Driver, db : NotifyDB, history : HistoryDB = None, policy : ScanPolicy = default_policy):
+    # rescan a stored site, return the message info (with the error if all tries failed)
+    # previous_values comes from db.get_many, only the fingerprint & signature are needed to compare
+    failures = previous_values.get("failures", 0)
+    down_until = policy.open_until(site)
+    if down_until is not None:
+        return failed_message(site, previous_values, f"Domain skipped until {down_until.strftime('%B %d - (%I:%M %p)')}", failures)
+
+    error = None
+    for tries in range(1, policy.tries+1): # 3 tries
+        if tries > 1:
+            # exponential with jitter, don't hammer a site that just failed
+            policy.backoff(tries - 1)
+        try:
+            extraction = Extraction(previous_values["content-kind"], previous_values.get("region"))
+
+            with policy.slot(site):
+                title, current_values, fetch_info = load_site(site, previous_values, driver, extraction)
+            if current_values is None:
+                # 304, nothing to parse
+                is_same, title = True, previous_values["title"]
+            else:
+                is_same = fingerprint(current_values[0]) == previous_values["content-fingerprint"]
+                if not is_same:
+                    is_same = is_minor_change(previous_values, current_values[0])
+        except Exception as e:
+            error = e
+            driver.refresh()
+            metrics.retry(site, "check")
+            print(f"Attempt {tries} on site : {site} Failed")
+            print(f"Reason : {e}")
+            continue
+
+        policy.success(site)
+        # Db, written in bulk at the end of the cycle
+        changes = None
+        # the pinned element moved (or was never pinned), store where it is now
+        region = extraction.region if extraction.repinned else None
+        if is_same:
+            db.queue_put(site, fetch_info=fetch_info, region=region)
+        else:
+            # the only time the stored content is read, still the previous one until the flush
+            with metrics.timer("mongo", site):
+                previous_content = db.get(site)["latest-search-content"]
+            if isinstance(previous_content[0], list) and isinstance(current_values[0], list):
+                changes = diff_links(previous_content[0], current_values[0], site)
+
+            if changes == ([], []):
+                # stored before links were canonicalized, same links in the new format
+                is_same, changes = True, None
+                db.queue_put(site, content=current_values, fetch_info=fetch_info, region=region)
+            else:
+                if history is not None:
+                    with metrics.timer("mongo", site):
+                        history.record(site, previous_content, current_values)
+                db.queue_put(site, title, current_values, fetch_info, region)
+
+        # message info gathering
+        return {
+            "same" : is_same,
+            "url" : site,
+            "title" : title,
+            "latest_update" : previous_values["latest-updated-date"],
+            "changes" : changes, # (added, removed) links
+            "error" : None
+        }
+    metrics.failure(site, "check")
+    policy.failure(site, error)
+    db.queue_failure(site, error)
+    return failed_message(site, previous_values, error, failures + 1)
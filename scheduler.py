@@ -0,0 +1,66 @@
+import heapq
+from datetime import datetime, timedelta
+
+
+def last_change(doc):
+    # when the content last changed, the date it was added if never changed (None for old docs)
+    return doc.get('latest-updated-date') or doc.get('added-date')
+
+
+class SiteScheduler:
+    """
+    Priority queue of sites by next due time.
+    A site is due again after `factor` x the time its content has stayed the same,
+    so active sites come back quickly & stale ones slowly, within [min_interval, max_interval].
+    """
+    def __init__(
+        self,
+        min_interval : timedelta = timedelta(minutes=30),
+        max_interval : timedelta = timedelta(days=1),
+        default_interval : timedelta = timedelta(hours=3),
+        factor : float = 0.5
+    ):
+        assert min_interval <= default_interval <= max_interval, "Intervals out of order"
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.default_interval = default_interval
+        self.factor = factor
+
+        self.heap = [] # (due, url), entries not matching due_times are stale
+        self.due_times = {} # url -> due
+
+    def interval(self, last_search : datetime, changed : datetime) -> timedelta:
+        if changed is None:
+            return self.default_interval
+        return min(max((last_search - changed) * self.factor, self.min_interval), self.max_interval)
+
+    def schedule(self, url, last_search : datetime, changed : datetime):
+        due = last_search + self.interval(last_search, changed)
+        self.due_times[url] = due
+        heapq.heappush(self.heap, (due, url))
+
+    def sync(self, docs : dict):
+        # docs from NotifyDB.get_many, picks up added sites & forgets deleted ones
+        for url in list(self.due_times):
+            if url not in docs:
+                del self.due_times[url]
+
+        for url, doc in docs.items():
+            if url not in self.due_times:
+                self.schedule(url, doc.get('last-search') or datetime.now(), last_change(doc))
+
+    def pop_due(self, now : datetime = None) -> list:
+        # remove & return all sites due by now, they have to be scheduled again once checked
+        now = now or datetime.now()
+        due = []
+        while self.heap and self.heap[0][0] <= now:
+            due_time, url = heapq.heappop(self.heap)
+            if self.due_times.get(url) == due_time:
+                del self.due_times[url]
+                due.append(url)
+        return due
+
+    def next_due(self):
+        while self.heap and self.due_times.get(self.heap[0][1]) != self.heap[0][0]:
+            heapq.heappop(self.heap)
+        return self.heap[0][0] if self.heap else None
@@ -0,0 +1,41 @@
+from datetime import datetime, timedelta
+import time
+
+from storage import storage_of
+
+# cookies per domain, so a browser (new, restarted or another worker's) doesn't go through a challenge
+# the domain already passed : saved after a captcha, set in the browser before its first page of that
+# domain (see browser.BrowserManager). In the 'sessions' collection with mongo, the sessions table with sqlite
+
+# what Network.setCookies takes back from Network.getCookies
+COOKIE_FIELDS = ("name", "value", "domain", "path", "secure", "httpOnly", "sameSite", "expires")
+
+
+class SessionStore:
+    """
+    Cookies of each domain as saved after its last captcha, for at most `max_age`
+    (cookies expiring before are dropped on their own).
+    """
+    def __init__(self, client, dbname=None, max_age : timedelta = timedelta(days=7)):
+        # a MongoClient or a storage.SQLiteStorage, like NotifyDB
+        self.store = storage_of(client).sessions(dbname)
+        self.max_age = max_age
+
+    def load(self, domain) -> list[dict]:
+        """Cookies of domain still valid, [] if there is no session."""
+        # read each time, another worker may have passed a captcha since
+        session = self.store.find(domain)
+        if session is None or session['saved'] < datetime.now() - self.max_age:
+            return []
+        now = time.time()
+        return [cookie for cookie in session['cookies'] if 'expires' not in cookie or cookie['expires'] > now]
+
+    def save(self, domain, cookies : list[dict]):
+        kept = []
+        for cookie in cookies:
+            cookie = {field : cookie[field] for field in COOKIE_FIELDS if field in cookie}
+            if cookie.get('expires', -1) <= 0:
+                # session cookie (expires -1), set back without an expiry
+                cookie.pop('expires', None)
+            kept.append(cookie)
+        self.store.save(domain, kept, datetime.now())
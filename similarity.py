@@ -0,0 +1,90 @@
+from collections import Counter
+import hashlib
+import heapq
+
+# compact signatures of the extracted content, to tell a real change from noise (a rotating timestamp,
+# counter or ad slot) without reading the full content. distance of two signatures is in [0, 1] :
+#   text  : SimHash (64 bits) of the word 3-grams, differing bits / 64
+#   links : bottom-k MinHash of the link set (the 64 smallest link hashes), 1 - estimated jaccard similarity
+# algorithm.fingerprint still tells if anything changed, a site only counts as changed when the distance
+# is over its threshold (see scanner.check_site). Stored signatures must stay comparable : don't change the hashing
+
+SIMHASH_BITS = 64
+SHINGLE_WORDS = 3
+MINHASH_SIZE = 64
+
+# SimHash adds up the bits of every shingle hash, 64 counters of LANE bits packed in one int so
+# a hash is added with 8 table lookups instead of 64 steps
+LANE = 32
+BYTE_LANES = [sum(((byte >> bit) & 1) << (bit * LANE) for bit in range(8)) for byte in range(256)]
+LANE_MASK = (1 << LANE) - 1
+
+
+def hash64(text : str) -> bytes:
+    return hashlib.blake2b(text.encode(), digest_size=8).digest()
+
+
+def shingles(text : str) -> Counter:
+    # word 3-grams, whitespace & case insensitive like fingerprint
+    words = text.lower().split()
+    if len(words) <= SHINGLE_WORDS:
+        return Counter([" ".join(words)] if words else [])
+    return Counter(" ".join(words[i:i + SHINGLE_WORDS]) for i in range(len(words) - SHINGLE_WORDS + 1))
+
+
+def simhash(text : str) -> str:
+    """64 bits SimHash of text as 16 hex digits, near texts have few differing bits."""
+    counts = shingles(text)
+    lanes, total = 0, 0
+    for shingle, weight in counts.items():
+        spread = 0
+        for i, byte in enumerate(hash64(shingle)):
+            spread |= BYTE_LANES[byte] << (i * 8 * LANE)
+        lanes += spread * weight
+        total += weight
+
+    value = 0
+    for bit in range(SIMHASH_BITS):
+        # set when more than half of the (weighted) shingles have it
+        if 2 * ((lanes >> (bit * LANE)) & LANE_MASK) > total:
+            value |= 1 << bit
+    return f"{value:016x}"
+
+
+def minhash(links : list) -> list[int]:
+    """Bottom-k MinHash of the link set, sorted, ints under 2**63 so they fit a mongo int64."""
+    hashes = {int.from_bytes(hash64(link), "big") >> 1 for link in links}
+    return heapq.nsmallest(MINHASH_SIZE, hashes)
+
+
+def signature(content):
+    # simhash for text content, minhash for links, see algorithm.content_kind
+    if isinstance(content, list):
+        return minhash(content)
+    elif isinstance(content, str):
+        return simhash(content)
+    raise NotImplementedError(f"signature for {type(content)} class is not implemented")
+
+
+def text_distance(previous : str, now : str) -> float:
+    return (int(previous, 16) ^ int(now, 16)).bit_count() / SIMHASH_BITS
+
+
+def links_distance(previous : list, now : list) -> float:
+    if not previous and not now:
+        return 0.0
+    # the k smallest of the union are a sample of it, the share in both sets estimates the jaccard similarity
+    # (exact while both sets have less than k links)
+    previous, now = set(previous), set(now)
+    sample = heapq.nsmallest(MINHASH_SIZE, previous | now)
+    shared = sum(1 for value in sample if value in previous and value in now)
+    return 1 - shared / len(sample)
+
+
+def distance(previous, now) -> float:
+    """0 same content ... 1 nothing in common, content of another kind is 1."""
+    if isinstance(previous, str) and isinstance(now, str):
+        return text_distance(previous, now)
+    if isinstance(previous, list) and isinstance(now, list):
+        return links_distance(previous, now)
+    return 1.0
@@ -0,0 +1,363 @@
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from threading import Lock, local, get_ident
+import argparse
+import hashlib
+import os
+import sqlite3
+import sys
+import zlib
+
+from config import SNAPSHOT_DIR, SNAPSHOT_KEEP, SNAPSHOT_MAX_DAYS
+
+# raw pages of every scan, to re-run the extraction offline (new rules, a wrong "Updated now") without a browser
+# blobs are compressed & named by the sha256 of the page, a page that didn't change between cycles is stored once
+#   <dir>/blobs/ab/ab12...<.zst | .zz>   one file per distinct page
+#   <dir>/index.db                       sqlite, which page each site had at each scan
+# zlib by default, zstd when zstandard is installed (the zstd extra), both stay readable
+# python snapshots.py reprocess | prune | stats | dump <url>
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+class Codecs:
+    # compressors per thread, zstandard's aren't thread safe
+    def __init__(self, level=3):
+        self.level = level
+        self.local = local()
+
+    @property
+    def extension(self) -> str:
+        return "zst" if zstandard is not None else "zz"
+
+    def compress(self, data : bytes) -> bytes:
+        if zstandard is None:
+            return zlib.compress(data, 6)
+        if not hasattr(self.local, "compressor"):
+            self.local.compressor = zstandard.ZstdCompressor(level=self.level)
+        return self.local.compressor.compress(data)
+
+    def compressobj(self):
+        # for data given in parts, see SnapshotWriter
+        if zstandard is None:
+            return zlib.compressobj(6)
+        return zstandard.ZstdCompressor(level=self.level).compressobj()
+
+    def decompress(self, data : bytes, extension) -> bytes:
+        if extension == "zz":
+            return zlib.decompress(data)
+        if zstandard is None:
+            raise RuntimeError("Snapshot is zstd compressed, pip install zstandard to read it")
+        if not hasattr(self.local, "decompressor"):
+            self.local.decompressor = zstandard.ZstdDecompressor()
+        # frames written by compressobj don't have the content size, decompress needs it
+        return self.local.decompressor.decompressobj().decompress(data)
+
+
+class SnapshotStore:
+    """
+    Pages by site & scan time, at most `keep` per site and none older than `max_age`.
+    Opened on first use, nothing touches the disk before. directory None turns it off.
+    """
+    def __init__(self, directory, keep=5, max_age : timedelta = timedelta(days=30)):
+        self.directory = directory
+        self.keep = keep
+        self.max_age = max_age
+        self.codecs = Codecs()
+        self.lock = Lock()
+        self.connection = None
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.directory)
+
+    def index(self) -> sqlite3.Connection:
+        # call with the lock held
+        if self.connection is None:
+            os.makedirs(os.path.join(self.directory, "blobs"), exist_ok=True)
+            self.connection = sqlite3.connect(os.path.join(self.directory, "index.db"), check_same_thread=False, isolation_level=None)
+            # several processes (distributed workers on one host) can share the directory
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute("PRAGMA busy_timeout=5000")
+            self.connection.executescript("""
+                CREATE TABLE IF NOT EXISTS snapshots (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    url TEXT NOT NULL,
+                    taken REAL NOT NULL,
+                    hash TEXT NOT NULL,
+                    extension TEXT NOT NULL,
+                    source TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    kind TEXT
+                );
+                CREATE INDEX IF NOT EXISTS snapshots_url ON snapshots (url, taken);
+                CREATE INDEX IF NOT EXISTS snapshots_hash ON snapshots (hash);
+                CREATE INDEX IF NOT EXISTS snapshots_taken ON snapshots (taken);
+            """)
+        return self.connection
+
+    @contextmanager
+    def transaction(self):
+        # write transaction on the index, lock held
+        with self.lock:
+            connection = self.index()
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                yield connection
+            except BaseException:
+                connection.execute("ROLLBACK")
+                raise
+            connection.execute("COMMIT")
+
+    def blob_path(self, digest, extension) -> str:
+        return os.path.join(self.directory, "blobs", digest[:2], f"{digest}.{extension}")
+
+    def put(self, url, page, source="browser", kind=None):
+        """
+        Store page (str from the browser, bytes from http) as the latest snapshot of url.
+        kind is the content kind the scan extracted ("text" | "links"), None for a new site (apply_extraction).
+        """
+        if not self.enabled:
+            return
+        data = page.encode("utf-8") if isinstance(page, str) else page
+        digest = hashlib.sha256(data).hexdigest()
+
+        path, is_stored, stale = self.record(url, digest, self.codecs.extension, source, len(data), kind)
+        if not is_stored:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            temporary = f"{path}.{os.getpid()}.{get_ident()}.tmp"
+            with open(temporary, "wb") as file:
+                file.write(self.codecs.compress(data))
+            os.replace(temporary, path) # readers never see half a blob
+
+        if stale:
+            self.drop(stale)
+
+    def writer(self, url, source="browser", kind=None):
+        """SnapshotWriter for a page given in parts, None when snapshots are off."""
+        if not self.enabled:
+            return None
+        return SnapshotWriter(self, url, source, kind)
+
+    def record(self, url, digest, extension, source, size, kind=None) -> tuple:
+        # index the new snapshot -> (blob path, if the blob is there, rows out of retention)
+        # one write transaction with the blob check, serialized with drop even across processes :
+        # the row references the blob before it's written, so a drop meanwhile can't delete it
+        with self.transaction() as connection:
+            row = connection.execute("SELECT extension FROM snapshots WHERE hash = ? LIMIT 1", (digest,)).fetchone()
+            is_stored = row is not None and os.path.exists(self.blob_path(digest, row[0]))
+            if is_stored:
+                # by an earlier scan, maybe with the other codec
+                extension = row[0]
+            connection.execute(
+                "INSERT INTO snapshots (url, taken, hash, extension, source, size, kind) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (url, datetime.now().timestamp(), digest, extension, source, size, kind)
+            )
+            stale = connection.execute(
+                "SELECT id, hash, extension FROM snapshots WHERE url = ? ORDER BY taken DESC LIMIT -1 OFFSET ?",
+                (url, self.keep)
+            ).fetchall()
+            return self.blob_path(digest, extension), is_stored, stale
+
+    def drop(self, rows):
+        # rows (id, hash, extension) out of retention, blobs no other row uses are deleted
+        with self.transaction() as connection:
+            connection.executemany("DELETE FROM snapshots WHERE id = ?", [(row[0],) for row in rows])
+            for digest, extension in {(row[1], row[2]) for row in rows}:
+                if connection.execute("SELECT 1 FROM snapshots WHERE hash = ? LIMIT 1", (digest,)).fetchone() is None:
+                    try:
+                        os.remove(self.blob_path(digest, extension))
+                    except FileNotFoundError:
+                        pass
+
+    def prune(self) -> int:
+        """Drop snapshots older than max_age -> how many."""
+        if not self.enabled:
+            return 0
+        oldest = (datetime.now() - self.max_age).timestamp()
+        with self.lock:
+            rows = self.index().execute("SELECT id, hash, extension FROM snapshots WHERE taken < ?", (oldest,)).fetchall()
+        if rows:
+            self.drop(rows)
+        return len(rows)
+
+    def list(self, url=None, latest=False) -> list[dict]:
+        """Snapshots (of url) newest first, only the newest of each site with latest."""
+        sql = "SELECT url, taken, hash, extension, source, size, kind FROM snapshots"
+        params = []
+        if url is not None:
+            sql += " WHERE url = ?"
+            params.append(url)
+        sql += " ORDER BY url, taken DESC"
+        with self.lock:
+            rows = self.index().execute(sql, params).fetchall()
+
+        snapshots, seen = [], set()
+        for url, taken, digest, extension, source, size, kind in rows:
+            if latest and url in seen:
+                continue
+            seen.add(url)
+            snapshots.append({
+                "url": url,
+                "taken": datetime.fromtimestamp(taken),
+                "hash": digest,
+                "path": self.blob_path(digest, extension),
+                "source": source,
+                "size": size,
+                "kind": kind
+            })
+        return snapshots
+
+    def stats(self) -> dict:
+        with self.lock:
+            count, sites, pages, raw = self.index().execute(
+                "SELECT COUNT(*), COUNT(DISTINCT url), COUNT(DISTINCT hash), COALESCE(SUM(size), 0) FROM snapshots"
+            ).fetchone()
+        stored = 0
+        for folder, _, files in os.walk(os.path.join(self.directory, "blobs")):
+            stored += sum(os.path.getsize(os.path.join(folder, name)) for name in files)
+        return {"snapshots": count, "sites": sites, "distinct_pages": pages, "raw_bytes": raw, "stored_bytes": stored}
+
+
+class SnapshotWriter:
+    """
+    A snapshot given in parts (a page streamed from the browser), hashed & compressed as they come.
+    close stores it like SnapshotStore.put, abort forgets it.
+    """
+    def __init__(self, store : SnapshotStore, url, source, kind=None):
+        self.store = store
+        self.url = url
+        self.source = source
+        self.kind = kind
+        self.hash = hashlib.sha256()
+        self.size = 0
+        self.extension = store.codecs.extension
+        self.compressor = store.codecs.compressobj()
+        os.makedirs(os.path.join(store.directory, "blobs"), exist_ok=True)
+        # named by its hash once complete
+        self.temporary = os.path.join(store.directory, "blobs", f"{os.getpid()}.{get_ident()}.tmp")
+        self.file = open(self.temporary, "wb")
+
+    def write(self, part):
+        data = part.encode("utf-8") if isinstance(part, str) else part
+        self.hash.update(data)
+        self.size += len(data)
+        self.file.write(self.compressor.compress(data))
+
+    def close(self):
+        self.file.write(self.compressor.flush())
+        self.file.close()
+        path, is_stored, stale = self.store.record(self.url, self.hash.hexdigest(), self.extension, self.source, self.size, self.kind)
+        if is_stored:
+            os.remove(self.temporary)
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(self.temporary, path)
+        if stale:
+            self.store.drop(stale)
+
+    def abort(self):
+        self.file.close()
+        os.remove(self.temporary)
+
+
+def read_snapshot(snapshot : dict, codecs : Codecs = None):
+    # -> page as it was given to put, str for the browser ones (the meta charset may not be utf-8)
+    codecs = codecs or Codecs()
+    with open(snapshot["path"], "rb") as file:
+        data = codecs.decompress(file.read(), snapshot["path"].rsplit(".", 1)[1])
+    return data.decode("utf-8") if snapshot["source"] == "browser" else data
+
+
+def reprocess_one(snapshot : dict) -> dict:
+    # in a pool process : the extraction a scan would run on this page (scanner.extract_page without the metrics),
+    # the one of the content kind kept with the snapshot, apply_extraction for a new site
+    from algorithm import apply_extraction, extract_by_kind, fingerprint, content_kind
+    from parsers import parse_page
+
+    try:
+        title, body = parse_page(read_snapshot(snapshot))
+        if title is None:
+            raise ValueError(f"Page {snapshot['url']} has no title")
+        extraction_fn = apply_extraction if snapshot["kind"] is None else extract_by_kind(snapshot["kind"])
+        values = extraction_fn(snapshot["url"], body)
+    except Exception as e:
+        return {**snapshot, "error": str(e)}
+    return {
+        **snapshot,
+        "error": None,
+        "title": title,
+        "kind": content_kind(values[0]),
+        "length": values[1],
+        "fingerprint": fingerprint(values[0]),
+    }
+
+
+def reprocess(store : SnapshotStore, url=None, latest=True, workers=None, compare=False):
+    """Run the extraction over the stored snapshots with a process pool, prints one line per snapshot."""
+    snapshots = store.list(url, latest)
+    stored = {}
+    if compare:
+        # what is in the db now, to see which sites the current rules would report as changed
+        from storage import open_storage
+        from database import NotifyDB
+        from config import db_client, dbname
+        stored = NotifyDB(open_storage(db_client), dbname).get_many()
+        for snapshot in snapshots:
+            if snapshot["kind"] is None and snapshot["url"] in stored:
+                # taken when the site was added or before kinds were kept, compared with what is stored now
+                snapshot["kind"] = stored[snapshot["url"]].get("content-kind")
+
+    counts = {"same": 0, "changed": 0, "failed": 0}
+    with ProcessPoolExecutor(workers) as pool:
+        for result in pool.map(reprocess_one, snapshots, chunksize=8):
+            line = f"{result['taken']:%Y-%m-%d %H:%M} {result['url']}"
+            if result["error"] is not None:
+                counts["failed"] += 1
+                print(f"{line} FAILED : {result['error']}")
+                continue
+            line += f" {result['kind']} {result['length']} {result['fingerprint'][:12]}"
+            if compare and result["url"] in stored:
+                is_same = stored[result["url"]].get("content-fingerprint") == result["fingerprint"]
+                counts["same" if is_same else "changed"] += 1
+                line += " same" if is_same else " CHANGED"
+            print(line)
+    print(f"{len(snapshots)} snapshots reprocessed, {counts}")
+    return counts
+
+
+snapshots = SnapshotStore(SNAPSHOT_DIR, SNAPSHOT_KEEP, timedelta(days=SNAPSHOT_MAX_DAYS))
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Stored page snapshots")
+    commands = arg_parser.add_subparsers(dest="command", required=True)
+    reprocess_parser = commands.add_parser("reprocess", help="run the extraction over stored snapshots, no browser")
+    reprocess_parser.add_argument("--url", help="only this site")
+    reprocess_parser.add_argument("--all", action="store_true", help="every kept snapshot, not only the latest of each site")
+    reprocess_parser.add_argument("--workers", type=int, default=None, help="processes, default one per cpu")
+    reprocess_parser.add_argument("--compare", action="store_true", help="compare with the content stored in the db")
+    commands.add_parser("prune", help="drop snapshots past SNAPSHOT_MAX_DAYS")
+    commands.add_parser("stats")
+    dump_parser = commands.add_parser("dump", help="write the latest page of a site to stdout")
+    dump_parser.add_argument("url")
+    args = arg_parser.parse_args()
+
+    if not snapshots.enabled:
+        sys.exit("SNAPSHOT_DIR is empty, snapshots are off")
+    if args.command == "reprocess":
+        reprocess(snapshots, args.url, not args.all, args.workers, args.compare)
+    elif args.command == "prune":
+        print(f"{snapshots.prune()} snapshots dropped")
+    elif args.command == "stats":
+        print(snapshots.stats())
+    else:
+        found = snapshots.list(args.url, latest=True)
+        if not found:
+            sys.exit(f"No snapshot of {args.url}")
+        page = read_snapshot(found[0])
+        sys.stdout.buffer.write(page.encode("utf-8") if isinstance(page, str) else page)
@@ -0,0 +1,407 @@
+from datetime import datetime
+from threading import Lock
+import json
+import sqlite3
+
+from pymongo import MongoClient, UpdateOne
+from pymongo.errors import DuplicateKeyError, BulkWriteError
+
+# where NotifyDB & PoppingDB keep their data, picked from DB_CLIENT by open_storage :
+#   mongodb://...       -> mongo (default)
+#   sqlite:///path.db   -> one sqlite file in WAL mode, for single node setups
+#   memory://           -> sqlite in memory, for tests & benchmarks, gone when the process ends
+# a site store holds site docs by unique url, a pending store the lease queue of urls to add,
+# a session store the captcha cookies by domain (see sessions.py)
+
+CONTENT = 'latest-search-content' # the big field, kept apart so listing sites never reads it
+
+
+def open_storage(db_client):
+    # unset is mongo on localhost, as MongoClient(None)
+    db_client = db_client or ""
+    if db_client.startswith("sqlite:///"):
+        # sqlite:///relative.db, sqlite:////absolute.db
+        return SQLiteStorage(db_client[len("sqlite:///"):])
+    if db_client.startswith("memory://"):
+        return SQLiteStorage(":memory:")
+    return MongoClient(db_client or None)
+
+
+def storage_of(client):
+    # NotifyDB / PoppingDB take a MongoClient as before, or a storage
+    return client if isinstance(client, (MongoStorage, SQLiteStorage)) else MongoStorage(client)
+
+
+class MongoStorage:
+    def __init__(self, client : MongoClient):
+        self.client = client
+
+    def sites(self, dbname):
+        return MongoSiteStore(self.client[dbname]['sites'])
+
+    def pending(self, dbname):
+        return MongoPendingStore(self.client[dbname]['pending'])
+
+    def sessions(self, dbname):
+        return MongoSessionStore(self.client[dbname]['sessions'])
+
+
+class MongoSiteStore:
+    def __init__(self, collection):
+        self.collection = collection
+        self.collection.create_index('url', unique=True)
+
+    def find(self, with_content=True, after=None, limit=None, urls=None) -> list:
+        # docs sorted by url
+        query = {}
+        if after is not None:
+            query['url'] = {'$gt': after}
+        if urls is not None:
+            query.setdefault('url', {})['$in'] = urls
+        projection = {'_id': 0} if with_content else {'_id': 0, CONTENT: 0}
+        cursor = self.collection.find(query, projection).sort('url', 1)
+        if limit is not None:
+            cursor = cursor.limit(limit)
+        return list(cursor)
+
+    def urls(self) -> list:
+        return [doc['url'] for doc in self.collection.find({}, {'_id': 0, 'url': 1})]
+
+    def find_one(self, url, with_content=True):
+        projection = {'_id': 0} if with_content else {'_id': 0, CONTENT: 0}
+        return self.collection.find_one({'url': url}, projection)
+
+    def exists(self, url) -> bool:
+        return self.collection.find_one({'url': url}, {'_id': 1}) is not None
+
+    def insert(self, doc) -> bool:
+        # False if the url is already there
+        try:
+            self.collection.insert_one(doc)
+        except DuplicateKeyError:
+            return False
+        return True
+
+    def delete(self, url) -> bool:
+        return self.collection.delete_one({'url': url}).deleted_count > 0
+
+    def delete_many(self, urls):
+        self.collection.delete_many({'url': {'$in': urls}})
+
+    def update(self, url, set_fields, inc_fields=None) -> bool:
+        # False if there is no such url
+        return self.collection.update_one({'url': url}, mongo_update(set_fields, inc_fields)).matched_count > 0
+
+    def bulk_update(self, updates):
+        # [(url, set_fields, inc_fields or None)] in one unordered bulk write
+        self.collection.bulk_write(
+            [UpdateOne({'url': url}, mongo_update(set_fields, inc_fields)) for url, set_fields, inc_fields in updates],
+            ordered=False
+        )
+
+
+def mongo_update(set_fields, inc_fields=None) -> dict:
+    update = {'$set': set_fields}
+    if inc_fields:
+        update['$inc'] = inc_fields
+    return update
+
+
+class MongoPendingStore:
+    def __init__(self, collection):
+        self.collection = collection
+        self.collection.create_index('url', unique=True)
+        self.collection.create_index('lease-until')
+
+    def insert(self, doc) -> bool:
+        try:
+            self.collection.insert_one(doc)
+        except DuplicateKeyError:
+            return False
+        return True
+
+    def insert_many(self, docs):
+        # urls already pending are skipped
+        try:
+            self.collection.insert_many(docs, ordered=False)
+        except BulkWriteError as e:
+            if any(error['code'] != 11000 for error in e.details['writeErrors']):
+                raise
+
+    def delete(self, url) -> bool:
+        return self.collection.delete_one({'url': url}).deleted_count > 0
+
+    def urls(self) -> list:
+        return [doc['url'] for doc in self.collection.find({}, {'_id': 0, 'url': 1})]
+
+    def claim(self, now : datetime, lease_until : datetime, max_attempts):
+        # oldest url without a running lease, leased until lease_until, in one round trip
+        doc = self.collection.find_one_and_update(
+            # lease-until None also matches urls stored before leases
+            {'$or': [{'lease-until': None}, {'lease-until': {'$lt': now}}], 'attempts': {'$not': {'$gte': max_attempts}}},
+            {'$set': {'lease-until': lease_until}, '$inc': {'attempts': 1}},
+            sort=[('_id', 1)],
+            projection={'_id': 0, 'url': 1} # same before & after the update
+        )
+        return None if doc is None else doc['url']
+
+    def release(self, url, released_at : datetime):
+        # lease-until is when it was released, claims of an iteration started before skip it
+        self.collection.update_one({'url': url}, {'$set': {'lease-until': released_at, 'attempts': 0}})
+
+
+class MongoSessionStore:
+    def __init__(self, collection):
+        self.collection = collection
+        self.collection.create_index('domain', unique=True)
+
+    def find(self, domain):
+        # {domain, cookies, saved} or None
+        return self.collection.find_one({'domain': domain}, {'_id': 0})
+
+    def save(self, domain, cookies : list, saved : datetime):
+        self.collection.update_one({'domain': domain}, {'$set': {'cookies': cookies, 'saved': saved}}, upsert=True)
+
+
+def encode(value):
+    # json for what mongo would store natively
+    if isinstance(value, datetime):
+        # milliseconds, like bson
+        return {'$date': value.replace(microsecond=value.microsecond // 1000 * 1000).isoformat()}
+    raise TypeError(f"{type(value)} can't be stored")
+
+
+def decode(obj : dict):
+    if len(obj) == 1 and '$date' in obj:
+        return datetime.fromisoformat(obj['$date'])
+    return obj
+
+
+def dumps(value) -> str:
+    return json.dumps(value, default=encode)
+
+
+def loads(text : str):
+    return json.loads(text, object_hook=decode)
+
+
+class SQLiteStorage:
+    """
+    One sqlite database (a file in WAL mode, or ":memory:"), shared by every thread through one
+    connection & a lock. dbname is ignored, it's one set of data per file.
+    """
+    def __init__(self, path=":memory:"):
+        self.connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.lock = Lock()
+        if path != ":memory:":
+            # readers (another process serving the api) don't block the writer
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute("PRAGMA synchronous=NORMAL")
+            self.connection.execute("PRAGMA busy_timeout=5000")
+        self.connection.executescript("""
+            CREATE TABLE IF NOT EXISTS sites (url TEXT PRIMARY KEY, doc TEXT NOT NULL, content TEXT);
+            CREATE TABLE IF NOT EXISTS pending (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                url TEXT NOT NULL UNIQUE,
+                lease_until REAL,
+                attempts INTEGER NOT NULL DEFAULT 0
+            );
+            CREATE INDEX IF NOT EXISTS pending_lease ON pending (lease_until);
+            CREATE TABLE IF NOT EXISTS sessions (domain TEXT PRIMARY KEY, cookies TEXT NOT NULL, saved REAL NOT NULL);
+        """)
+
+    def sites(self, dbname=None):
+        return SQLiteSiteStore(self)
+
+    def pending(self, dbname=None):
+        return SQLitePendingStore(self)
+
+    def sessions(self, dbname=None):
+        return SQLiteSessionStore(self)
+
+    def execute(self, sql, params=()) -> list:
+        with self.lock:
+            return self.connection.execute(sql, params).fetchall()
+
+    def transaction(self, statements):
+        # [(sql, params)] all or nothing
+        with self.lock:
+            self.connection.execute("BEGIN IMMEDIATE")
+            try:
+                for sql, params in statements:
+                    self.connection.execute(sql, params)
+            except BaseException:
+                self.connection.execute("ROLLBACK")
+                raise
+            self.connection.execute("COMMIT")
+
+
+class SQLiteSiteStore:
+    # sites(url, doc json without content, content json)
+    def __init__(self, storage : SQLiteStorage):
+        self.storage = storage
+
+    @staticmethod
+    def to_doc(url, doc, content=None) -> dict:
+        doc = {'url': url, **loads(doc)}
+        if content is not None:
+            doc[CONTENT] = loads(content)
+        return doc
+
+    def find(self, with_content=True, after=None, limit=None, urls=None) -> list:
+        columns = "url, doc, content" if with_content else "url, doc"
+        if urls is not None:
+            # in chunks, sqlite caps the number of parameters
+            docs = []
+            for start in range(0, len(urls), 500):
+                chunk = urls[start:start + 500]
+                rows = self.storage.execute(f"SELECT {columns} FROM sites WHERE url IN ({','.join('?' * len(chunk))})", chunk)
+                docs += [self.to_doc(*row) for row in rows if after is None or row[0] > after]
+            docs.sort(key=lambda doc : doc['url'])
+            return docs if limit is None else docs[:limit]
+
+        sql, params = f"SELECT {columns} FROM sites", []
+        if after is not None:
+            sql += " WHERE url > ?"
+            params.append(after)
+        sql += " ORDER BY url"
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(limit)
+        return [self.to_doc(*row) for row in self.storage.execute(sql, params)]
+
+    def urls(self) -> list:
+        # insertion order, like mongo's natural order
+        return [url for url, in self.storage.execute("SELECT url FROM sites ORDER BY rowid")]
+
+    def find_one(self, url, with_content=True):
+        columns = "url, doc, content" if with_content else "url, doc"
+        rows = self.storage.execute(f"SELECT {columns} FROM sites WHERE url = ?", (url,))
+        return self.to_doc(*rows[0]) if rows else None
+
+    def exists(self, url) -> bool:
+        return bool(self.storage.execute("SELECT 1 FROM sites WHERE url = ?", (url,)))
+
+    def insert(self, doc) -> bool:
+        doc = dict(doc)
+        url, content = doc.pop('url'), doc.pop(CONTENT, None)
+        try:
+            self.storage.execute("INSERT INTO sites (url, doc, content) VALUES (?, ?, ?)", (url, dumps(doc), dumps(content)))
+        except sqlite3.IntegrityError:
+            return False
+        return True
+
+    def delete(self, url) -> bool:
+        with self.storage.lock:
+            return self.storage.connection.execute("DELETE FROM sites WHERE url = ?", (url,)).rowcount > 0
+
+    def delete_many(self, urls):
+        self.storage.transaction([("DELETE FROM sites WHERE url = ?", (url,)) for url in urls])
+
+    def update_statements(self, rows : dict, updates) -> list:
+        # read, modify, write : same result as $set / $inc on the docs in rows (url -> doc json)
+        docs = {}
+        statements = []
+        for url, set_fields, inc_fields in updates:
+            if url not in docs:
+                if url not in rows:
+                    continue
+                docs[url] = loads(rows[url])
+            doc = docs[url]
+            set_fields = dict(set_fields)
+            if CONTENT in set_fields:
+                statements.append(("UPDATE sites SET content = ? WHERE url = ?", (dumps(set_fields.pop(CONTENT)), url)))
+            doc.update(set_fields)
+            for key, value in (inc_fields or {}).items():
+                doc[key] = doc.get(key, 0) + value
+        statements += [("UPDATE sites SET doc = ? WHERE url = ?", (dumps(doc), url)) for url, doc in docs.items()]
+        return statements
+
+    def rows(self, urls) -> dict:
+        # call with the lock held
+        rows = {}
+        urls = list(set(urls))
+        for start in range(0, len(urls), 500):
+            chunk = urls[start:start + 500]
+            rows.update(self.storage.connection.execute(f"SELECT url, doc FROM sites WHERE url IN ({','.join('?' * len(chunk))})", chunk).fetchall())
+        return rows
+
+    def bulk_update(self, updates):
+        # everything in one transaction
+        with self.storage.lock:
+            connection = self.storage.connection
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                rows = self.rows([url for url, _, _ in updates])
+                for sql, params in self.update_statements(rows, updates):
+                    connection.execute(sql, params)
+            except BaseException:
+                connection.execute("ROLLBACK")
+                raise
+            connection.execute("COMMIT")
+
+    def update(self, url, set_fields, inc_fields=None) -> bool:
+        if not self.exists(url):
+            return False
+        self.bulk_update([(url, set_fields, inc_fields)])
+        return True
+
+
+class SQLitePendingStore:
+    def __init__(self, storage : SQLiteStorage):
+        self.storage = storage
+
+    def insert(self, doc) -> bool:
+        try:
+            self.storage.execute("INSERT INTO pending (url) VALUES (?)", (doc['url'],))
+        except sqlite3.IntegrityError:
+            return False
+        return True
+
+    def insert_many(self, docs):
+        self.storage.transaction([("INSERT OR IGNORE INTO pending (url) VALUES (?)", (doc['url'],)) for doc in docs])
+
+    def delete(self, url) -> bool:
+        with self.storage.lock:
+            return self.storage.connection.execute("DELETE FROM pending WHERE url = ?", (url,)).rowcount > 0
+
+    def urls(self) -> list:
+        return [url for url, in self.storage.execute("SELECT url FROM pending ORDER BY id")]
+
+    def claim(self, now : datetime, lease_until : datetime, max_attempts):
+        # one statement, atomic even with other processes on the same file
+        rows = self.storage.execute(
+            """
+            UPDATE pending SET lease_until = ?, attempts = attempts + 1
+            WHERE id = (
+                SELECT id FROM pending
+                WHERE (lease_until IS NULL OR lease_until < ?) AND attempts < ?
+                ORDER BY id LIMIT 1
+            )
+            RETURNING url
+            """,
+            (lease_until.timestamp(), now.timestamp(), max_attempts)
+        )
+        return rows[0][0] if rows else None
+
+    def release(self, url, released_at : datetime):
+        self.storage.execute("UPDATE pending SET lease_until = ?, attempts = 0 WHERE url = ?", (released_at.timestamp(), url))
+
+
+class SQLiteSessionStore:
+    def __init__(self, storage : SQLiteStorage):
+        self.storage = storage
+
+    def find(self, domain):
+        rows = self.storage.execute("SELECT cookies, saved FROM sessions WHERE domain = ?", (domain,))
+        if not rows:
+            return None
+        cookies, saved = rows[0]
+        return {'domain': domain, 'cookies': loads(cookies), 'saved': datetime.fromtimestamp(saved)}
+
+    def save(self, domain, cookies : list, saved : datetime):
+        self.storage.execute(
+            "INSERT INTO sessions (domain, cookies, saved) VALUES (?, ?, ?)"
+            " ON CONFLICT (domain) DO UPDATE SET cookies = excluded.cookies, saved = excluded.saved",
+            (domain, dumps(cookies), saved.timestamp())
+        )
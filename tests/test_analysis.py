@@ -0,0 +1,34 @@
+from bs4 import BeautifulSoup
+import pytest
+
+from analysis import walk_soup, walk_lexbor
+
+selectolax = pytest.importorskip("selectolax.lexbor")
+
+
+class Events:
+    def __init__(self):
+        self.events = []
+
+    def start(self, tag, attrs):
+        self.events.append(("start", tag))
+
+    def data(self, text, visible=True):
+        self.events.append(("data", str(text), visible))
+
+    def end(self):
+        self.events.append(("end",))
+
+
+@pytest.mark.parametrize("tag, inner", [
+    ("pre", "<b>a</b>  \n  <i>b</i>\n\n<span>  </span>"),
+    ("div", "<b>a</b>  \n  <i>b</i>\n\n<span>  </span>"),
+    # raw text for lexbor, no tags inside
+    ("textarea", "  \n  "),
+])
+def test_lexbor_keeps_whitespace_under_root(tag, inner):
+    html = f"<html><body><{tag}>{inner}</{tag}></body></html>"
+    soup_root = BeautifulSoup(html, "html.parser").body.find(tag)
+    lexbor_root = selectolax.LexborHTMLParser(html).body.css_first(tag)
+
+    assert walk_lexbor(lexbor_root, Events()).events == walk_soup(soup_root, Events()).events
@@ -0,0 +1,42 @@
+import mongomock
+
+from database import NotifyDB, PoppingDB
+from distributed import JobQueue, schedule_cycle
+
+
+def test_cycle_reported_once_queued():
+    client = mongomock.MongoClient()
+    queue = JobQueue(client, "test")
+    database = NotifyDB(client, "test")
+    pending_db = PoppingDB(client, "test", database)
+    pending_db.post_many(["https://a.example", "https://b.example"])
+
+    def enqueue(cycle, kind, urls):
+        # the reporter polling now must not see the cycle done
+        # (mongomock can't run the bulk upserts of JobQueue.enqueue)
+        assert queue.open_cycles() == []
+        for url in urls:
+            queue.collection.insert_one({'url': url, 'kind': kind, 'cycle': cycle, 'status': 'pending'})
+        return len(urls)
+    queue.enqueue = enqueue
+
+    assert schedule_cycle(queue, database, pending_db) == 2
+    cycle, = queue.open_cycles()
+    assert queue.remaining(cycle['_id']) == 2
+
+
+def test_empty_cycle_dropped():
+    client = mongomock.MongoClient()
+    queue = JobQueue(client, "test")
+    database = NotifyDB(client, "test")
+    assert schedule_cycle(queue, database, PoppingDB(client, "test", database)) == 0
+    assert queue.cycles.count_documents({}) == 0
+
+
+def test_unfinished_cycle_sealed():
+    queue = JobQueue(mongomock.MongoClient(), "test")
+    cycle = queue.new_cycle()
+    assert queue.open_cycles() == []
+    # the scheduler stopped before sealing it, the next one does
+    queue.seal_unfinished()
+    assert [open_cycle['_id'] for open_cycle in queue.open_cycles()] == [cycle]
@@ -0,0 +1,77 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import threading
+
+import pytest
+
+from fetcher import conditional_get, needs_browser, validators
+
+PAGE = b"<html><head><title>Page</title></head><body><p>content</p></body></html>"
+ETAG = '"v1"'
+LAST_MODIFIED = "Sat, 01 Mar 2025 10:00:00 GMT"
+
+
+class Handler(BaseHTTPRequestHandler):
+    requests = []
+
+    def do_GET(self):
+        Handler.requests.append((self.path, dict(self.headers)))
+        if self.path.startswith("/hop/"):
+            # /hop/3 -> /hop/2 -> ... -> /page
+            left = int(self.path.rsplit("/", 1)[1]) - 1
+            self.send_response(302)
+            self.send_header("Location", f"/hop/{left}" if left else "/page")
+            self.end_headers()
+            return
+
+        if self.headers.get("If-None-Match") == ETAG or self.headers.get("If-Modified-Since") == LAST_MODIFIED:
+            self.send_response(304)
+            self.send_header("ETag", ETAG)
+            self.end_headers()
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(PAGE)))
+        self.send_header("ETag", ETAG)
+        self.send_header("Last-Modified", LAST_MODIFIED)
+        self.end_headers()
+        self.wfile.write(PAGE)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    Handler.requests = []
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{httpd.server_address[1]}"
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def test_validators_stored_then_not_modified(server):
+    first = conditional_get(f"{server}/page")
+    assert first["status"] == 200
+    assert first["html"] == PAGE
+    assert not needs_browser(first)
+
+    stored = validators(first)
+    assert stored == {"etag": ETAG, "last-modified": LAST_MODIFIED}
+
+    second = conditional_get(f"{server}/page", stored["etag"], stored["last-modified"])
+    assert second["status"] == 304
+    assert second["html"] == b""
+    # sent back as given
+    headers = Handler.requests[-1][1]
+    assert headers["If-None-Match"] == ETAG
+    assert headers["If-Modified-Since"] == LAST_MODIFIED
+
+
+def test_redirects_followed_past_one(server):
+    response = conditional_get(f"{server}/hop/4")
+    assert response["status"] == 200
+    assert response["html"] == PAGE
+    assert [path for path, _ in Handler.requests] == ["/hop/4", "/hop/3", "/hop/2", "/hop/1", "/page"]
@@ -0,0 +1,100 @@
+from datetime import datetime, timedelta
+import socket
+
+import mongomock
+import pytest
+from aiosmtpd.controller import Controller
+
+from email_util import Outbox, OutboxSender
+
+REFUSED = "refused@example.com"
+
+
+class Handler:
+    def __init__(self):
+        self.messages = []
+        self.sessions = []
+
+    async def handle_RCPT(self, server, session, envelope, address, rcpt_options):
+        if address == REFUSED:
+            return "451 4.3.0 try again later"
+        envelope.rcpt_tos.append(address)
+        return "250 OK"
+
+    async def handle_DATA(self, server, session, envelope):
+        self.messages.append(envelope.rcpt_tos[0])
+        if session not in self.sessions:
+            self.sessions.append(session)
+        return "250 OK"
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+@pytest.fixture
+def smtp():
+    handler = Handler()
+    controller = Controller(handler, hostname="127.0.0.1", port=free_port())
+    controller.start()
+    yield handler, controller.port
+    controller.stop()
+
+
+@pytest.fixture
+def outbox():
+    return Outbox(mongomock.MongoClient(), "test")
+
+
+def new_sender(outbox, port):
+    return OutboxSender(outbox, "me@example.com", None, smtp_server="127.0.0.1", smtp_port=port, use_tls=False)
+
+
+def test_batch_sent_over_one_session(smtp, outbox):
+    handler, port = smtp
+    for i in range(3):
+        outbox.enqueue("me@example.com", f"user{i}@example.com", f"subject {i}", "<p>body</p>")
+
+    sender = new_sender(outbox, port)
+    assert sender.send_due() == 3
+    sender.close()
+
+    assert handler.messages == ["user0@example.com", "user1@example.com", "user2@example.com"]
+    assert len(handler.sessions) == 1
+    assert outbox.collection.count_documents({'status': 'sent'}) == 3
+
+
+def test_failed_send_backs_off(smtp, outbox):
+    handler, port = smtp
+    outbox.enqueue("me@example.com", "user0@example.com", "first", "<p>body</p>")
+    outbox.enqueue("me@example.com", REFUSED, "refused", "<p>body</p>")
+    outbox.enqueue("me@example.com", "user1@example.com", "after", "<p>body</p>")
+
+    sender = new_sender(outbox, port)
+    before = datetime.now()
+    assert sender.send_due() == 2
+    sender.close()
+
+    # the broken session was dropped, the next message logged in again
+    assert handler.messages == ["user0@example.com", "user1@example.com"]
+    assert len(handler.sessions) == 2
+
+    failed = outbox.collection.find_one({'to': REFUSED})
+    assert failed['status'] == 'pending'
+    assert failed['attempts'] == 1
+    # base_backoff (30s) for the first retry, mongo keeps milliseconds
+    assert before + timedelta(seconds=30, milliseconds=-1) <= failed['next-attempt'] < datetime.now() + timedelta(seconds=31)
+    assert 'try again later' in failed['last-error']
+
+    # not due yet, nothing is sent again
+    assert sender.send_due() == 0
+    assert outbox.claim() is None
+
+    outbox.collection.update_one({'_id': failed['_id']}, {'$set': {'next-attempt': datetime.now() - timedelta(seconds=1)}})
+    assert sender.send_due() == 0 # still refused
+    sender.close()
+    failed = outbox.collection.find_one({'_id': failed['_id']})
+    assert failed['attempts'] == 2
+    assert datetime.now() + timedelta(seconds=55) <= failed['next-attempt'] < datetime.now() + timedelta(seconds=61)
@@ -0,0 +1,83 @@
+from collections import Counter
+from datetime import datetime, timedelta
+import time
+
+import mongomock
+import pytest
+
+from database import NotifyDB, PoppingDB
+from scan_pool import run_pool
+from storage import SQLiteStorage
+
+
+@pytest.fixture(params=["sqlite", "mongo"])
+def client(request):
+    if request.param == "sqlite":
+        return SQLiteStorage(":memory:")
+    return mongomock.MongoClient()
+
+
+@pytest.fixture
+def pending(client):
+    pending = PoppingDB(client, "test", NotifyDB(client, "test"), max_attempts=3)
+    pending.post_many(["https://a.example", "https://bad.example", "https://c.example"])
+    return pending
+
+
+@pytest.fixture
+def scanner(monkeypatch):
+    # scanner.ingest with add_site stubbed : bad.example never gets added, stored.example was added by another process
+    scanner = pytest.importorskip("scanner") # needs seleniumbase
+    tries = Counter()
+
+    def add_site(site, driver, db, history=None, policy=None):
+        tries[site] += 1
+        if site == "https://stored.example":
+            raise ValueError(f"Site '{site}' already exists.")
+        return site != "https://bad.example"
+
+    monkeypatch.setattr(scanner, "add_site", add_site)
+    scanner.tries = tries
+    return scanner
+
+
+def test_failed_add_once_per_cycle(pending, scanner):
+    pending.post("https://stored.example")
+    for cycle in range(5):
+        scanner.tries.clear()
+        added = run_pool(pending, lambda site, driver : scanner.ingest(site, driver, pending.ndb, pending), lambda : None, workers=2)
+
+        if cycle == 0:
+            assert scanner.tries == {"https://a.example": 1, "https://bad.example": 1, "https://c.example": 1, "https://stored.example": 1}
+            assert sorted(site for site, is_added in added if not is_added) == ["https://bad.example", "https://stored.example"]
+        else:
+            # still tried every cycle, past max_attempts
+            assert scanner.tries == {"https://bad.example": 1}
+            assert added == [("https://bad.example", False)]
+        time.sleep(0.002) # mongo dates are in milliseconds, the next cycle starts after the release
+
+    assert pending.get_all_url() == ["https://bad.example"]
+
+
+def test_lease_of_dead_worker(pending):
+    first = pending.claim()
+    assert first == "https://a.example"
+    # never acked nor released : hidden until the lease runs out
+    assert "https://a.example" not in list_and_release(pending)
+    later = datetime.now() + pending.lease + timedelta(seconds=1)
+    assert pending.claim(later) == "https://a.example"
+
+
+def test_unanswered_claims_leave_url(pending):
+    pending.lease = timedelta(0)
+    for _ in range(pending.max_attempts):
+        assert pending.claim(datetime.now() + timedelta(seconds=1)) == "https://a.example"
+    # a worker died on it every time, left for the user to look at
+    assert pending.claim(datetime.now() + timedelta(seconds=1)) == "https://bad.example"
+
+
+def list_and_release(pending):
+    urls = list(pending)
+    for url in urls:
+        pending.release(url)
+    return urls
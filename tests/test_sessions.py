@@ -0,0 +1,51 @@
+from datetime import datetime, timedelta
+import time
+
+import mongomock
+import pytest
+
+from sessions import SessionStore
+from storage import SQLiteStorage
+
+DOMAIN = "site.example"
+
+
+@pytest.fixture(params=["sqlite", "mongo"])
+def client(request):
+    if request.param == "sqlite":
+        return SQLiteStorage(":memory:")
+    return mongomock.MongoClient()
+
+
+def test_save_keeps_cookie_fields(client):
+    store = SessionStore(client, "test")
+    store.save(DOMAIN, [
+        {"name": "a", "value": "1", "domain": DOMAIN, "expires": -1, "size": 2, "session": True},
+        {"name": "b", "value": "2", "expires": 0, "priority": "Medium"},
+        {"name": "c", "value": "3", "expires": time.time() + 3600},
+    ])
+    # another store on the same data, like a restarted process
+    cookies = SessionStore(client, "test").load(DOMAIN)
+    assert [sorted(cookie) for cookie in cookies] == [["domain", "name", "value"], ["name", "value"], ["expires", "name", "value"]]
+
+
+def test_load_drops_expired(client):
+    store = SessionStore(client, "test")
+    store.save(DOMAIN, [
+        {"name": "old", "value": "1", "expires": time.time() - 1},
+        {"name": "new", "value": "2", "expires": time.time() + 3600},
+        {"name": "session", "value": "3", "expires": -1},
+    ])
+    assert [cookie["name"] for cookie in store.load(DOMAIN)] == ["new", "session"]
+    assert store.load("other.example") == []
+
+
+def test_load_drops_stale_session(client):
+    store = SessionStore(client, "test", max_age=timedelta(days=7))
+    store.save(DOMAIN, [{"name": "a", "value": "1"}])
+    assert len(store.load(DOMAIN)) == 1
+    store.store.save(DOMAIN, [{"name": "a", "value": "1"}], datetime.now() - timedelta(days=8))
+    assert store.load(DOMAIN) == []
+    # saved again after a new captcha
+    store.save(DOMAIN, [{"name": "b", "value": "2"}])
+    assert [cookie["name"] for cookie in store.load(DOMAIN)] == ["b"]
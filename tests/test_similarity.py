@@ -0,0 +1,71 @@
+import pytest
+
+from similarity import SIMHASH_BITS, distance, hash64, links_distance, minhash, shingles, signature, simhash, text_distance
+
+TEXT = " ".join(f"word{i % 40} item {i}" for i in range(200))
+TEXTS = ["", "one", "Two Words", "a b c d", TEXT, "same same same same same other"]
+
+
+def slow_simhash(text):
+    # one counter per bit, as SimHash is usually written
+    counters = [0] * SIMHASH_BITS
+    for shingle, weight in shingles(text).items():
+        value = int.from_bytes(hash64(shingle), "little")
+        for bit in range(SIMHASH_BITS):
+            counters[bit] += weight if value >> bit & 1 else -weight
+    return f"{sum(1 << bit for bit in range(SIMHASH_BITS) if counters[bit] > 0):016x}"
+
+
+@pytest.mark.parametrize("text", TEXTS)
+def test_simhash_matches_counters(text):
+    assert simhash(text) == slow_simhash(text)
+
+
+def test_text_distance():
+    near = TEXT.replace("item 150", "item 1500")
+    far = " ".join(f"other{i} thing" for i in range(200))
+    assert text_distance(simhash(TEXT), simhash(TEXT.upper())) == 0
+    assert text_distance(simhash(TEXT), simhash(near)) < 0.15
+    assert text_distance(simhash(TEXT), simhash(far)) > 0.3
+
+
+def test_links_distance_exact():
+    # under MINHASH_SIZE links the sample is the whole union
+    previous = [f"https://site.example/{i}" for i in range(20)]
+    now = [f"https://site.example/{i}" for i in range(10, 40)]
+    assert links_distance(minhash(previous), minhash(now)) == pytest.approx(1 - 10 / 40)
+    assert links_distance(minhash(previous), minhash(previous)) == 0
+    assert links_distance([], []) == 0
+
+
+def test_distance_of_other_kind():
+    assert distance(signature(TEXT), signature(["https://site.example/1"])) == 1.0
+    assert distance(signature(["https://site.example/1"]), signature(TEXT)) == 1.0
+
+
+@pytest.fixture
+def scanner():
+    return pytest.importorskip("scanner") # needs seleniumbase
+
+
+def test_minor_change_threshold(scanner, monkeypatch):
+    near = TEXT.replace("item 150", "item 1500")
+    stored = {"content-signature": signature(TEXT)}
+    moved = distance(stored["content-signature"], signature(near))
+    assert 0 < moved < 0.5
+
+    assert scanner.is_minor_change({**stored, "change-threshold": 0.5}, near)
+    assert not scanner.is_minor_change({**stored, "change-threshold": moved / 2}, near)
+    # set to 0 for the site, every change counts
+    monkeypatch.setattr(scanner, "CHANGE_THRESHOLD", 0.5)
+    assert not scanner.is_minor_change({**stored, "change-threshold": 0}, near)
+
+    # None falls back to CHANGE_THRESHOLD
+    assert scanner.is_minor_change({**stored, "change-threshold": None}, near)
+    monkeypatch.setattr(scanner, "CHANGE_THRESHOLD", 0)
+    assert not scanner.is_minor_change({**stored, "change-threshold": None}, near)
+
+
+def test_minor_change_without_signature(scanner):
+    # stored before signatures were kept : compared by fingerprint only
+    assert not scanner.is_minor_change({"change-threshold": 1}, TEXT)
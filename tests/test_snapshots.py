@@ -0,0 +1,68 @@
+import os
+import time
+
+from algorithm import apply_extraction, collect_internal_links, fingerprint
+from parsers import parse_page
+from snapshots import SnapshotStore, read_snapshot, reprocess_one
+
+URL = "https://site.example/"
+# few words & many links : apply_extraction picks links, but not the same ones as collect_internal_links
+PAGE = (
+    "<html><head><title>Links</title></head><body>"
+    + "".join(f'<a href="/post/{i}">p{i}</a>' for i in range(20))
+    + '<script src="/static/app.js"></script><p>short</p></body></html>'
+)
+
+
+def scanned(extraction_fn):
+    title, body = parse_page(PAGE)
+    return fingerprint(extraction_fn(URL, body)[0])
+
+
+def test_reprocess_uses_kind_of_snapshot(tmp_path):
+    store = SnapshotStore(str(tmp_path))
+    store.put(URL, PAGE, "browser", "links")
+    snapshot, = store.list(URL)
+    assert snapshot["kind"] == "links"
+
+    result = reprocess_one(snapshot)
+    assert result["error"] is None
+    assert result["fingerprint"] == scanned(collect_internal_links)
+
+
+def test_reprocess_new_site(tmp_path):
+    store = SnapshotStore(str(tmp_path))
+    store.put(URL, PAGE, "browser")
+    snapshot, = store.list(URL)
+    assert snapshot["kind"] is None
+    assert reprocess_one(snapshot)["fingerprint"] == scanned(apply_extraction)
+
+
+def blobs(tmp_path):
+    return sorted(path.name for path in (tmp_path / "blobs").rglob("*.z*"))
+
+
+def test_same_page_stored_once(tmp_path):
+    store = SnapshotStore(str(tmp_path))
+    store.put(URL, PAGE, "browser")
+    blob, = (tmp_path / "blobs").rglob("*.z*")
+    written = blob.stat().st_mtime_ns
+    store.put(URL, PAGE, "browser")
+    store.put("https://other.example/", PAGE, "http")
+    assert blob.stat().st_mtime_ns == written # not written again
+    assert len(store.list()) == 3
+    assert len(blobs(tmp_path)) == 1
+    assert len({snapshot["path"] for snapshot in store.list()}) == 1
+
+
+def test_retention(tmp_path):
+    store = SnapshotStore(str(tmp_path), keep=2)
+    pages = [PAGE.replace("short", f"version {i}") for i in range(3)]
+    for page in pages:
+        store.put(URL, page, "browser")
+        time.sleep(0.001) # distinct taken
+
+    kept = store.list(URL)
+    assert [read_snapshot(snapshot) for snapshot in kept] == pages[:0:-1]
+    # the oldest page isn't used by any row anymore
+    assert blobs(tmp_path) == sorted(os.path.basename(snapshot["path"]) for snapshot in kept)
@@ -0,0 +1,53 @@
+from pathlib import Path
+
+from bs4 import BeautifulSoup
+import pytest
+
+from algorithm import apply_extraction, Extraction
+from analysis import PageStream, MemoryCapExceeded
+
+CORPUS = Path(__file__).parent.parent / "benchmarks" / "corpus"
+URL = "http://www.example.com/index.html"
+
+PAGES = {
+    "charrefs": "<html><head><title>T &amp; co</title></head><body><div>a &#150; b &#169; &#x1F600; &nbsp;&bogus; c</div></body></html>",
+    "empty elements": "<html><head><title>T</title></head><body><div>one<br>two<br/>three</br><img src='/a.png'></img></div></body></html>",
+    "whitespace": "<html><head><title>T</title></head><body><div>  </div><pre> keep \n  this </pre><textarea>\n </textarea><p>x  y</p></body></html>",
+    "links": "<html><head><title>T</title></head><body>" + "".join(f'<a href="/{i}">{i}</a>' for i in range(30))
+        + '<a href="https://other.com/x">out</a><script src="/app.js"></script></body></html>',
+}
+PAGES.update({path.name: path.read_text() for path in sorted(CORPUS.glob("*.html"))})
+
+
+def chunks(page, size):
+    return (page[start:start + size] for start in range(0, len(page), size))
+
+
+@pytest.mark.parametrize("name", PAGES)
+@pytest.mark.parametrize("size", [7, 4096])
+def test_stream_matches_tree(name, size):
+    # same result as the tree path on the installed bs4 (the one poetry.lock pins)
+    page = PAGES[name]
+    soup = BeautifulSoup(page, "html.parser")
+    stream = PageStream(chunks(page, size))
+
+    assert apply_extraction(URL, stream) == apply_extraction(URL, soup.body)
+    assert stream.title == soup.title.text
+
+
+@pytest.mark.parametrize("name", PAGES)
+def test_stream_matches_tree_in_region(name):
+    page = PAGES[name]
+    pinned = Extraction()
+    expected = pinned(URL, BeautifulSoup(page, "html.parser").body)
+    if pinned.region is None:
+        pytest.skip("links site, no region")
+
+    tree, stream = Extraction("text", pinned.region), Extraction("text", pinned.region)
+    assert stream(URL, PageStream(chunks(page, 4096))) == tree(URL, BeautifulSoup(page, "html.parser").body) == expected
+
+
+def test_memory_cap():
+    page = "<html><head><title>T</title></head><body>" + "<div>some text</div>" * 1000 + "</body></html>"
+    with pytest.raises(MemoryCapExceeded):
+        apply_extraction(URL, PageStream(chunks(page, 100), memory_cap=1000))
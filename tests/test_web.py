@@ -0,0 +1,39 @@
+from fastapi.testclient import TestClient
+import pytest
+
+from database import NotifyDB, PoppingDB
+from storage import SQLiteStorage
+from web import WebApp
+
+URL = "https://site.example/page"
+
+
+@pytest.fixture(scope="module")
+def api():
+    # WebApp is built once per process
+    storage = SQLiteStorage(":memory:")
+    database = NotifyDB(storage, "test")
+    database.post(URL, "Title", ["some text", 9])
+    return TestClient(WebApp(database, PoppingDB(storage, "test", database))), database
+
+
+@pytest.mark.parametrize("threshold", [True, False, -0.1, 1.5, "0.5", [0.5]])
+def test_threshold_rejected(api, threshold):
+    client, _ = api
+    response = client.patch(f"/api/notification/{URL}", json={"change-threshold": threshold})
+    assert response.status_code == 400
+
+
+@pytest.mark.parametrize("threshold", [0, 1, 0.25, None])
+def test_threshold_set(api, threshold):
+    client, database = api
+    response = client.patch(f"/api/notification/{URL}", json={"change-threshold": threshold})
+    assert response.status_code == 200
+    assert response.json()["change-threshold"] == threshold
+    assert database.get(URL, False)["change-threshold"] == threshold
+
+
+def test_threshold_unknown_site(api):
+    client, _ = api
+    response = client.patch("/api/notification/https://unknown.example", json={"change-threshold": 0.5})
+    assert response.status_code == 404
@@ -12,20 +12,8 @@ def run_once(func):
     return wrapper
 
 
-from urllib.parse import urlparse, urljoin
-def is_external_link(link, base_url):
-    # check if link is different origin from base_url
-    # Combine the base URL and the link if it's a relative URL
-    full_link = urljoin(base_url, link)
-    
-    # Extract the base URL components (scheme, domain)
-    base_parsed = urlparse(base_url)
-    
-    # Extract the target link components (scheme, domain)
-    full_parsed = urlparse(full_link)
-    
-    # Check if the domain or scheme is different
-    return base_parsed.netloc != full_parsed.netloc or base_parsed.scheme != full_parsed.scheme
+# check if link is different origin from base_url, base url parsed once (see links.py)
+from links import is_external_link
 
 
 from bs4 import BeautifulSoup
@@ -58,6 +46,9 @@ def remove_external_links(base_url : str, soup : BeautifulSoup) -> BeautifulSoup
     for attr in ["href", "src"]:
         links = soup.find_all(attrs={attr: True})
         for link in links:
+            if link.decomposed:
+                # inside an external link removed before
+                continue
             l = link.get(attr)
             if is_external_link(l, base_url):
                 link.decompose()
@@ -110,8 +101,12 @@ def time_difference_description(previous_time: datetime) -> str:
     return "Just now"
 
 
+from functools import lru_cache
+
+@lru_cache(maxsize=1)
 def get_local_ip() -> str:
     # https://stackoverflow.com/questions/166506/finding-local-ip-addresses-using-pythons-stdlib?page=1&tab=scoredesc#tab-top
+    # once per process, it's in every digest
     import socket
     s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
     s.connect(("8.8.8.8", 80))
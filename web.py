@@ -1,48 +1,148 @@
-from fastapi import FastAPI, HTTPException, APIRouter
-from database import PoppingDB, NotifyDB, move_all_from_notify_to_popping
+from fastapi import FastAPI, HTTPException, APIRouter, Request, Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from database import PoppingDB, NotifyDB, HistoryDB, move_all_from_notify_to_popping
+from metrics import metrics
+from events import events
 from utils import run_once
+import asyncio
+import hashlib
+import json
+
+
+def etag_json(request : Request, payload):
+    # json response with an ETag, 304 if the client already has this exact payload
+    response = JSONResponse(jsonable_encoder(payload), headers={"Cache-Control": "no-cache"})
+    etag = f'"{hashlib.sha1(response.body).hexdigest()}"'
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers={"ETag": etag, "Cache-Control": "no-cache"})
+    response.headers["ETag"] = etag
+    return response
+
+
+def sse_message(item) -> str:
+    event_id, event, data = item
+    return f"id: {event_id}\nevent: {event}\ndata: {json.dumps(jsonable_encoder(data))}\n\n"
+
 
 @run_once
-def WebApp(notifyDB : NotifyDB,pendingDB : PoppingDB):
+def WebApp(notifyDB : NotifyDB,pendingDB : PoppingDB, historyDB : HistoryDB = None):
     app = FastAPI()
     router = APIRouter(prefix="/api")
 
+    # pymongo is blocking, every db call goes through the thread pool to keep the event loop free
+
     @router.get("/notification")
-    async def get_notification_sites():
-        return notifyDB.get_all()
+    async def get_notification_sites(request: Request, limit: int = 100, after: str = None, content: bool = False):
+        # page through with ?after=<next>, the stored content is left out unless ?content=true
+        limit = min(max(limit, 1), 1000)
+        sites, next_cursor = await run_in_threadpool(notifyDB.get_page, limit, after, content)
+        return etag_json(request, {"items": sites, "next": next_cursor})
     
     @router.delete("/notification/{url:path}")
     async def delete_notification_sites(url: str):
         try:
-            notifyDB.delete(url)
+            await run_in_threadpool(notifyDB.delete, url)
         except ValueError:
             raise HTTPException(status_code=404, detail="Site not found")
+        if historyDB is not None:
+            await run_in_threadpool(historyDB.delete, url)
+        metrics.forget(url)
+        events.publish("site-removed", {"url": url})
         return {"message": "Site deleted successfully"}
     
+    @router.patch("/notification/{url:path}")
+    async def update_notification_site(url: str, settings: dict):
+        # {"change-threshold": 0 - 1 or null for the default}, see similarity.py
+        threshold = settings.get("change-threshold")
+        # bool is an int for isinstance, true would pass as 1
+        if threshold is not None and (isinstance(threshold, bool) or not isinstance(threshold, (int, float)) or not 0 <= threshold <= 1):
+            raise HTTPException(status_code=400, detail="change-threshold must be between 0 and 1")
+        try:
+            await run_in_threadpool(notifyDB.set_threshold, url, threshold)
+        except ValueError:
+            raise HTTPException(status_code=404, detail="Site not found")
+        site = await run_in_threadpool(notifyDB.get, url, False)
+        events.publish("site", site)
+        return site
+
     @router.get("/pending")
-    async def get_pending_sites():
-        return pendingDB.get_all_url()
+    async def get_pending_sites(request: Request):
+        return etag_json(request, await run_in_threadpool(pendingDB.get_all_url))
 
     @router.post("/pending")
     async def add_pending_sites(site: dict):
         try:
-            pendingDB.post(site["url"])
+            await run_in_threadpool(pendingDB.post, site["url"])
         except ValueError:
             raise HTTPException(status_code=409 , detail="site already in db")
+        events.publish("pending", {"url": site["url"]})
         return {"message": "Site added successfully"}
 
     @router.delete("/pending/{url:path}")
     async def delete_pending_sites(url: str):
         try:
-            pendingDB.delete(url)
+            await run_in_threadpool(pendingDB.delete, url)
         except ValueError:
             raise HTTPException(status_code=404, detail="Site not found")
+        events.publish("pending-removed", {"url": url})
         return {"message": "Site deleted successfully"}
     
 
+    if historyDB is not None:
+        @router.get("/history/{url:path}")
+        async def get_site_history(request: Request, url: str, version: int = None):
+            # list of versions, or the content of one with ?version=N (rebuilt on request)
+            if version is None:
+                return etag_json(request, await run_in_threadpool(historyDB.list_versions, url))
+            try:
+                content = await run_in_threadpool(historyDB.get, url, version)
+            except ValueError:
+                raise HTTPException(status_code=404, detail="Version not found")
+            return etag_json(request, {"url": url, "version": version, "content": content})
+
+    @router.get("/events")
+    async def get_events(request: Request):
+        # server-sent events, see events.py. EventSource resends Last-Event-ID on reconnect to get what it missed
+        last_id = request.headers.get("last-event-id")
+        subscription, backlog = events.subscribe(
+            asyncio.get_running_loop(),
+            int(last_id) if last_id and last_id.isdigit() else None
+        )
+
+        async def stream():
+            try:
+                yield "retry: 5000\n\n"
+                for item in backlog:
+                    yield sse_message(item)
+                while not await request.is_disconnected():
+                    item = await events.next(subscription, timeout=15)
+                    # comment line as keep-alive, so proxies don't close an idle stream
+                    yield ": keep-alive\n\n" if item is None else sse_message(item)
+            finally:
+                events.unsubscribe(subscription)
+
+        return StreamingResponse(
+            stream(),
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+        )
+
+    @router.get("/metrics")
+    async def get_metrics():
+        # prometheus scrape endpoint, timings of this process' scans
+        return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+    @router.get("/metrics/slowest")
+    async def get_slowest_sites(limit: int = 20):
+        # sites by mean scan time, each with its slowest stages first
+        return metrics.slowest(min(max(limit, 1), 1000))
+
     @router.post("/refresh")
     async def refresh_database():
-        move_all_from_notify_to_popping(notifyDB, pendingDB)
+        await run_in_threadpool(move_all_from_notify_to_popping, notifyDB, pendingDB)
+        events.publish("reload", {})
         return {"message" : "Site Refresh successful"}
     
 
@@ -50,16 +150,23 @@ def WebApp(notifyDB : NotifyDB,pendingDB : PoppingDB):
     return app
 
 
-if __name__ == "__main__":
-    from pymongo import MongoClient
+def serve_app(app, port):
+    # the api & the built frontend (frontend/ builds into static/)
     from fastapi.staticfiles import StaticFiles
     import uvicorn
-    db_client = "mongodb://localhost:27017/"
-    dbname = 'notification-db-test'
-    client = MongoClient(db_client)  # Replace with your MongoDB connection
-    database = NotifyDB(client, dbname)
-    pending_db = PoppingDB(client,dbname, database)
 
-    app = WebApp(database, pending_db)
-    app.mount("/", StaticFiles(directory="static",html=True), name="static")
-    uvicorn.run(app, host="localhost", port=5000)
+    app.mount("/", StaticFiles(directory="static", html=True), name="static")
+    uvicorn.run(app, host="0.0.0.0", port=port)
+
+
+def serve(port):
+    # dashboard only, none of the scanning code is loaded
+    from pymongo import MongoClient
+    from storage import open_storage
+    from config import db_client, dbname
+
+    client = open_storage(db_client)
+    database = NotifyDB(client, dbname)
+    pending_db = PoppingDB(client, dbname, database)
+    history_db = HistoryDB(client, dbname) if isinstance(client, MongoClient) else None
+    serve_app(WebApp(database, pending_db, history_db), port)